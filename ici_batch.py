@@ -0,0 +1,272 @@
+"""
+Headless ICI detection over (net, sta, cha, period) jobs, for batch reprocessing without a
+display (no Qt import).
+
+Examples
+--------
+python ici_batch.py --species fw_10 fw_15 --job XX.STA1.HHZ 2024-01-01 2024-02-01
+python ici_batch.py --config config/config.json --species all --jobs jobs.csv --output /data/ici
+python ici_batch.py --species fw_10 --job XX.STA1.HHZ 2015-01-01 2020-01-01 --checkpoint /data/ici/checkpoints
+python ici_batch.py --species fw_10 --job XX.STA1.HHZ 2025-01-01 2030-01-01 --watch 60
+
+The jobs file is a CSV file with the columns net, sta, cha, starttime and endtime. The result
+of each job and species is written as a pickle file (the same dictionary as the one saved
+from the GUI) in <output>/<net>.<sta>.<cha>/<species>_<starttime>_<endtime>.pkl.
+
+With --checkpoint (or CHECKPOINT_folder in the configuration), the cepstra of each day are
+written to a shard as soon as the day is processed (see lib.checkpoint): a job run again,
+after a failure or when new day files arrived, only processes the days missing a shard
+computed with the same parameters, or whose file changed since.
+
+With --watch, the channels of the jobs are polled every given number of seconds, and the
+bins completed by the data appended to the day files are processed as they arrive (see
+lib.sdsWatcher). The new bins are appended to
+<output>/<net>.<sta>.<cha>/<species>_detections.csv and to the cepstrogram store of the channel
+in <EXPORT_folder>/cepstrograms (see lib.resultStore), and the positive detections are printed.
+"""
+import os
+import sys
+import time
+import json
+import pickle
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+from lib.networkFuntions import get_network_file_list, get_file_availability
+from lib.sdsCatalog import CATALOG_FILENAME
+from lib.dayProcessing import get_species_parameters
+from lib.batchProcessing import get_files_to_process, get_processing_options, run_detection, run_multi_species_detection
+from lib.sdsWatcher import SdsWatcher
+from lib.resultStore import STORE_FOLDER, PARTITION_FREQUENCY, save_cepstrogram
+from lib.whaleIciDetection import get_preset_parameters
+
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "config.json")
+METRICS = {"5mn": "5T", "15mn": "15T", "1H": "1H"}
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ICI detection without the graphical interface.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH,
+                        help="The configuration file (SDS, inventory and export folders, processing options).")
+    parser.add_argument("--species", nargs="+", required=True,
+                        help="The preset species to detect, or 'all'.")
+    parser.add_argument("--job", nargs=3, action="append", default=[], metavar=("NET.STA.CHA", "STARTTIME", "ENDTIME"),
+                        help="A channel and a period to process (can be repeated).")
+    parser.add_argument("--jobs", help="A CSV file of jobs (columns net, sta, cha, starttime, endtime).")
+    parser.add_argument("--metric", default="1H", choices=list(METRICS),
+                        help="The width of the time bins of the cepstrogram.")
+    parser.add_argument("--threshold", type=float, default=0.5, help="The peak to valley ratio threshold.")
+    parser.add_argument("--output", help="The output folder (default: <EXPORT_folder>/ici_batch).")
+    parser.add_argument("--backend", choices=["thread", "process"], help="Override WORKER_backend.")
+    parser.add_argument("--workers", type=int, help="Override WORKER_count.")
+    parser.add_argument("--checkpoint",
+                        help="The folder of the per-day shards, to resume the jobs or process only the new days "
+                             "(overrides CHECKPOINT_folder).")
+    parser.add_argument("--watch", type=float, metavar="SECONDS",
+                        help="Poll the channels of the jobs every SECONDS and process the new data as it arrives.")
+    parser.add_argument("--verbose", action="store_true", help="Log the progress to the console.")
+    return parser.parse_args(argv)
+
+
+def get_jobs(args) -> pd.DataFrame:
+    """Return the jobs of the command line and of the jobs file (net, sta, cha, starttime, endtime)."""
+    jobs = []
+    for channel_id, starttime, endtime in args.job:
+        net, sta, cha = channel_id.split('.')
+        jobs.append({'net': net, 'sta': sta, 'cha': cha, 'starttime': starttime, 'endtime': endtime})
+    jobs = pd.DataFrame(jobs, columns=['net', 'sta', 'cha', 'starttime', 'endtime'])
+    if args.jobs:
+        jobs = pd.concat([jobs, pd.read_csv(args.jobs, dtype=str)[jobs.columns]], ignore_index=True)
+    jobs['starttime'] = pd.to_datetime(jobs['starttime'])
+    jobs['endtime'] = pd.to_datetime(jobs['endtime'])
+    return jobs
+
+
+def get_file_list(net: str, sta: str, config: dict) -> pd.DataFrame:
+    """Return the day files of a station, with their availability (see NetworkManager.load_metadata)."""
+    catalog_path = os.path.join(config["EXPORT_folder"], CATALOG_FILENAME)
+    files_df = get_network_file_list(net, sta, config["SDS_folder"], catalog_path)
+    if files_df.empty:
+        return files_df
+    files_df['cha'] = files_df['cha'].str.split('.').str[0]
+    try:
+        files_df = get_file_availability(files_df, catalog_path)
+    except Exception as e:
+        logging.error(f"Error loading data availability: {e}")
+    return files_df
+
+
+def get_output_path(output_dir: str, job, species: str) -> str:
+    folder = os.path.join(output_dir, f"{job.net}.{job.sta}.{job.cha}")
+    os.makedirs(folder, exist_ok=True)
+    period = f"{job.starttime:%Y%m%dT%H%M}_{job.endtime:%Y%m%dT%H%M}"
+    return os.path.join(folder, f"{species}_{period}.pkl")
+
+
+def run_job(job, files_df: pd.DataFrame, species_list: list, params: dict, metric: str) -> dict:
+    """
+    Run the detection of the species of one job and return species -> result (the species
+    without any processed day are missing).
+    """
+    files_to_process_df = get_files_to_process(files_df, job.net, job.sta, job.cha, job.starttime, job.endtime)
+    if files_to_process_df.empty:
+        return {}
+
+    job_params = dict(params)
+    job_params.update({
+        'starttime': job.starttime,
+        'endtime': job.endtime,
+        'files_to_process_df': files_to_process_df,
+    })
+    if len(species_list) > 1:
+        job_params['species_list'] = species_list
+        job_params['species'] = species_list[0]
+        return run_multi_species_detection(files_to_process_df, job_params, metric)
+
+    species = species_list[0]
+    job_params.update(get_species_parameters([species], job_params)[species])
+    result = run_detection(files_to_process_df, job_params, metric)
+    return {species: result} if result is not None else {}
+
+
+def write_detections(file_path: str, update: dict):
+    """Append the bins of a watcher update (see SdsWatcher.poll) to a detections CSV file."""
+    detections = pd.DataFrame({
+        'time': pd.to_datetime(update['tscale']),
+        'p2vr': update['p2vr'],
+        'positive': update['positive'],
+    })
+    detections.to_csv(file_path, mode='a', header=not os.path.exists(file_path), index=False)
+
+
+def save_watched_months(store_root: str, watcher: SdsWatcher, species: str, months: set):
+    """Store the bins of a watcher in the given months (see lib.resultStore.save_cepstrogram)."""
+    result = watcher.get_result()
+    kept = pd.DatetimeIndex(result['tscale']).to_period(PARTITION_FREQUENCY).isin(list(months))
+    try:
+        save_cepstrogram(store_root, f"{watcher.net}.{watcher.sta}.{watcher.cha}", species, dict(
+            watcher.params, tscale=result['tscale'][kept], q=result['q'], cepstro=result['cepstro'][:, kept],
+            p2vr=result['p2vr'][kept], positive=result['positive'][kept]))
+    except Exception as e:
+        logging.error(f"Error saving the cepstrogram of {watcher.net}.{watcher.sta}.{watcher.cha} ({species}): {e}")
+
+
+def run_watch(jobs: pd.DataFrame, species_list: list, params: dict, config: dict, metric: str, output_dir: str,
+              interval: float):
+    """
+    Poll the channels of the jobs until interrupted (see SdsWatcher).
+
+    The new bins of each poll are appended to the detections CSV files; the cepstrogram store
+    is only written when a month is over (the month of the last bin has changed) and when the
+    watch is interrupted, so that a poll never rewrites the partition of the current month.
+    """
+    catalog_path = os.path.join(config["EXPORT_folder"], CATALOG_FILENAME)
+    store_root = os.path.join(config["EXPORT_folder"], STORE_FOLDER)
+    watchers = []
+    for job in jobs.itertuples():
+        for species, species_params in get_species_parameters(species_list, params).items():
+            watcher = SdsWatcher(config["SDS_folder"], job.net, job.sta, job.cha, species_params, metric,
+                                 catalog_path, job.starttime, job.endtime)
+            folder = os.path.join(output_dir, f"{job.net}.{job.sta}.{job.cha}")
+            os.makedirs(folder, exist_ok=True)
+            watchers.append((watcher, species, os.path.join(folder, f"{species}_detections.csv")))
+    # The months of each watcher with bins not stored yet
+    unsaved_months = [set() for _ in watchers]
+
+    try:
+        while True:
+            started = time.monotonic()
+            for (watcher, species, file_path), months in zip(watchers, unsaved_months):
+                try:
+                    update = watcher.poll()
+                except Exception as e:
+                    logging.error(f"Error watching {watcher.net}.{watcher.sta}.{watcher.cha} ({species}): {e}")
+                    continue
+                if update is None:
+                    continue
+                write_detections(file_path, update)
+                months.update(pd.DatetimeIndex(update['tscale']).to_period(PARTITION_FREQUENCY))
+                current_month = pd.Timestamp(watcher.tscale[-1]).to_period(PARTITION_FREQUENCY)
+                completed_months = {month for month in months if month < current_month}
+                if completed_months:
+                    save_watched_months(store_root, watcher, species, completed_months)
+                    months -= completed_months
+                for t, p2vr in zip(pd.to_datetime(update['tscale'])[update['positive'] == 1],
+                                   np.asarray(update['p2vr'])[update['positive'] == 1]):
+                    print(f"{t} {watcher.net}.{watcher.sta}.{watcher.cha} {species} p2vr={p2vr:.2f}", flush=True)
+            time.sleep(max(0., interval - (time.monotonic() - started)))
+    finally:
+        for (watcher, species, _), months in zip(watchers, unsaved_months):
+            if months:
+                save_watched_months(store_root, watcher, species, months)
+
+
+def main(argv=None) -> int:
+    args = parse_arguments(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
+    with open(args.config, 'r') as file:
+        config = json.load(file)
+    presets = get_preset_parameters()
+    species_list = presets.index.tolist() if args.species == ['all'] else args.species
+    unknown_species = [species for species in species_list if species not in presets.index]
+    if unknown_species:
+        logging.error(f"Unknown species: {', '.join(unknown_species)} (presets: {', '.join(presets.index)})")
+        return 2
+
+    jobs = get_jobs(args)
+    if jobs.empty:
+        logging.error("No job to process (use --job or --jobs)")
+        return 2
+
+    params = get_processing_options(config)
+    if args.backend:
+        params['backend'] = args.backend
+    if args.workers is not None:
+        params['max_workers'] = args.workers
+    if args.checkpoint:
+        params['checkpoint_dir'] = args.checkpoint
+    params.update({'metric': METRICS[args.metric], 'p2vr_threshold': args.threshold, 'streaming': False})
+    output_dir = args.output or os.path.join(config["EXPORT_folder"], "ici_batch")
+
+    if args.watch:
+        try:
+            run_watch(jobs, species_list, params, config, METRICS[args.metric], output_dir, args.watch)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    file_lists = {}
+    n_failed = 0
+    for job in jobs.itertuples():
+        job_name = f"{job.net}.{job.sta}.{job.cha} {job.starttime} - {job.endtime}"
+        try:
+            if (job.net, job.sta) not in file_lists:
+                file_lists[(job.net, job.sta)] = get_file_list(job.net, job.sta, config)
+            results = run_job(job, file_lists[(job.net, job.sta)], species_list, params, METRICS[args.metric])
+        except Exception as e:
+            logging.error(f"Error processing {job_name}: {e}")
+            n_failed += 1
+            continue
+
+        if not results:
+            logging.warning(f"No data processed for {job_name}")
+            n_failed += 1
+            continue
+        for species, result in results.items():
+            file_path = get_output_path(output_dir, job, species)
+            with open(file_path, 'wb') as pickle_file:
+                pickle.dump(result, pickle_file)
+            logging.info(f"Results saved successfully to {file_path}")
+
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
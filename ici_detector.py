@@ -20,6 +20,7 @@ from PySide6.QtGui import QKeySequence, QShortcut
 from lib.whaleIciDetection import (
     get_preset_parameters
 )
+from lib.batchProcessing import get_processing_options
 
 # === Workers refactorisés ===
 from module.bdd.module import ManualSelectionHandler
@@ -170,6 +171,9 @@ class MainWindow(QWidget):
         self.networkMapPlotter.plot_network_map(network_stations, selected_station, network_coords, dfstations=self.dfstations)
 
     
+    def set_file_availability(self, dfmseeds):
+        self.dfmseeds = dfmseeds
+
     def run_detection_process(self):
         try:
             starttime = datetime.strptime(self.starttime_edit.text(), '%Y/%m/%d %H:%M')
@@ -182,6 +186,7 @@ class MainWindow(QWidget):
                                                                                                      starttime,
                                                                                                      endtime)
             dict_params["stations_df"] = self.dfstations
+            dict_params.update(get_processing_options(self.network_manager.config))
             self.module_detector.compute_ici_detection(dict_params)
 
         except Exception as e:
@@ -199,6 +204,7 @@ class MainWindow(QWidget):
                                                                                                      starttime,
                                                                                                      endtime)
             dict_params["stations_df"] = self.dfstations
+            dict_params.update(get_processing_options(self.network_manager.config))
             self.module_spectrogram.compute_spectrogram(dict_params)
 
         except Exception as e:
@@ -396,6 +402,7 @@ class MainWindow(QWidget):
 
         # Charger les données au démarrage
         self.dfstations, self.dfmseeds = self.network_manager.load_metadata()
+        self.network_manager.start_availability_indexing().sig_availability_ready.connect(self.set_file_availability)
         logging.info("Stations and files loaded.")
         logging.info(self.dfstations.head())
         logging.info(self.dfmseeds.head())
@@ -701,7 +708,7 @@ class MainWindow(QWidget):
         self.toggle_shortcut = QShortcut(QKeySequence("Ctrl+B"), self)
         self.toggle_shortcut.activated.connect(self.toggle_controls_visibility)
 
-        self.module_detector.display.sig_save_cepstrogram.connect(self.module_detector.save_results_to_pickle)
+        self.module_detector.display.sig_save_cepstrogram.connect(self.module_detector.save_results)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
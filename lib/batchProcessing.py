@@ -0,0 +1,369 @@
+import os
+import shutil
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+from lib.dayProcessing import (
+    process_detection_day, process_multi_species_day, get_species_parameters, get_spectrogram_groups, get_day_neighbors,
+    get_day_window, run_p2vr_detection, update_p2vr_detection
+)
+from lib.checkpoint import (
+    get_checkpoint_dir, get_day_source, load_manifest, is_day_completed, save_day_shard, load_day_shard,
+    save_result, load_result, invalidate_results
+)
+from lib.parallel import create_executor, get_worker_count, iter_results, load_array
+from lib.fftBackend import get_fft_worker_count
+from lib.resultBuffer import CepstrogramBuffer
+
+
+def get_processing_options(config: dict) -> dict:
+    """
+    Return the processing options shared by the workers from the configuration (decoded-sample
+    cache location and size, execution backend and number of workers, 0 meaning sized from the
+    CPUs and free memory, number of STFT frames computed at a time, 0 meaning the whole day at
+    once, and number of threads of each FFT, 0 meaning the CPUs shared between the days
+    processed at once), and the folder of the per-day checkpoints (see lib.checkpoint), None
+    to disable them.
+    """
+    return {
+        "cache_dir": config.get("CACHE_folder", os.path.join(config["EXPORT_folder"], "cache")),
+        "cache_size": int(float(config.get("CACHE_size_GB", 20)) * 1024**3),
+        "backend": config.get("WORKER_backend", "thread"),
+        "max_workers": int(config.get("WORKER_count", 0)),
+        "stft_chunk_size": int(config.get("STFT_chunk_size", 1024)),
+        "fft_workers": int(config.get("FFT_workers", 0)),
+        "checkpoint_dir": config.get("CHECKPOINT_folder"),
+    }
+
+
+def get_files_to_process(files_df: pd.DataFrame, network: str, station: str, channel: str, starttime, endtime) -> pd.DataFrame:
+    """
+    Select the day files of a channel covering [starttime, endtime).
+
+    Parameters
+    ----------
+    files_df : pd.DataFrame
+        The file list (see get_network_file_list and get_file_availability).
+    network, station, channel : str
+        The channel to process.
+    starttime, endtime : datetime
+        The period to process.
+
+    Returns
+    -------
+    pd.DataFrame
+        The files starting in the period, preceded by the last file starting before it.
+    """
+    filtered_df = files_df[
+        (files_df['net'] == network) &
+        (files_df['sta'] == station) &
+        (files_df['cha'] == channel) &
+        (files_df['starttime'] < starttime)
+    ]
+
+    selected_df = files_df[
+        (files_df['net'] == network) &
+        (files_df['sta'] == station) &
+        (files_df['cha'] == channel) &
+        (files_df['starttime'] >= starttime) &
+        (files_df['starttime'] < endtime)
+    ]
+
+    if not filtered_df.empty:
+        last_file = filtered_df.iloc[[-1]]
+        selected_df = pd.concat([last_file, selected_df])
+
+    # Skip the days known to be empty from the MiniSEED headers, before any decoding
+    if 'coverage' in selected_df.columns:
+        selected_df = selected_df[~(selected_df['coverage'] == 0)]
+
+    return selected_df.reset_index(drop=True)
+
+
+def get_job_parameters(params: dict, metric: str = None) -> dict:
+    """
+    Return the parameters sent to each per-day job (without the DataFrames, which would
+    otherwise be pickled for every job by the process backend), with the metric if given.
+    """
+    job_params = {key: value for key, value in params.items() if not isinstance(value, pd.DataFrame)}
+    if metric is not None:
+        job_params['metric'] = metric
+    return job_params
+
+
+def get_channel_id(files_df: pd.DataFrame) -> str:
+    """Return 'net.sta.cha' of the files of files_df."""
+    row = files_df.iloc[0]
+    return f"{row['net']}.{row['sta']}.{row['cha']}"
+
+
+def get_row_source(row, neighbors: tuple, params: dict) -> dict:
+    """Return the source of the day of a row of files_df (see get_day_source)."""
+    return get_day_source(row.filename, get_day_window(row.datetime, params), neighbors)
+
+
+def process_day(fn, filename: str, day, *args) -> tuple:
+    """Run fn(filename, day, *args) and return (filename, day, result), so that the results
+    yielded in completion order can be matched with their day."""
+    return filename, day, fn(filename, day, *args)
+
+
+def get_detection_result(tscale, q, cepstro, params: dict, cancelled: bool = False, checkpoint_dir: str = None,
+                         previous_result: tuple = None, changed: np.ndarray = None) -> dict:
+    """
+    Compute the peak to valley ratio of a cepstrogram and return the detection result
+    (tscale, q, cepstro, p2vr, positive, and the parameters).
+
+    With the (tscale, p2vr) of a previous run on the same checkpoint (see lib.checkpoint.load_result),
+    it is only recomputed around the changed bins (see update_p2vr_detection). The peak to
+    valley ratio is stored in checkpoint_dir for the next run.
+    """
+    if previous_result is not None and changed is not None:
+        p2vr, positive_detection = update_p2vr_detection(tscale, q, cepstro, params, *previous_result, changed)
+    else:
+        p2vr, positive_detection = run_p2vr_detection(q, cepstro, params)
+    if checkpoint_dir:
+        save_result(checkpoint_dir, params, tscale, p2vr)
+    result = {
+        'tscale': tscale,
+        'q': q,
+        'cepstro': cepstro,
+        'p2vr': p2vr,
+        'positive': positive_detection
+    }
+    result.update(params)
+    result['cancelled'] = cancelled
+    return result
+
+
+def run_detection(files_df: pd.DataFrame, params: dict, metric: str = '1H', cancel_event=None, resume_event=None,
+                  on_day=None) -> dict:
+    """
+    Run the ICI detection of one species over the day files of files_df.
+
+    With params['checkpoint_dir'], the cepstra of each day are written to a shard as soon as
+    the day is processed (see lib.checkpoint), and the days whose shard was computed with the
+    same parameters, from the same files (unchanged since) and time window, are read back
+    instead of being processed again. Only the new or changed days are then processed, and the peak to
+    valley ratio is only recomputed over the bins whose rolling window holds one of them.
+
+    Parameters
+    ----------
+    files_df : pd.DataFrame
+        The day files (see get_files_to_process).
+    params : dict
+        The detection parameters and the processing options (see get_processing_options).
+    metric : str
+        The width of the time bins of the cepstrogram.
+    cancel_event, resume_event : threading.Event, optional
+        Cancel or pause the processing (see lib.parallel.iter_results). When cancelled, the
+        result of the days already processed is returned.
+    on_day : callable, optional
+        Called with (tscale, q, cepstro) of each processed day, in completion order.
+
+    Returns
+    -------
+    dict
+        The detection result (see get_detection_result), or None if no day was processed.
+    """
+    backend = params.get('backend', 'thread')
+    n_workers = get_worker_count(params.get('max_workers'))
+    job_params = get_job_parameters(params, metric)
+    # The FFT threads share the CPUs with the days processed at the same time
+    job_params['fft_workers'] = get_fft_worker_count(min(n_workers, max(1, len(files_df))), params.get('fft_workers'))
+    # The process backend hands the cepstra back through memory-mapped .npy files
+    output_dir = tempfile.mkdtemp(prefix='ici_detector_') if backend == 'process' else None
+
+    # Each finished day is inserted in time order in a preallocated buffer
+    buffer = CepstrogramBuffer(files_df['datetime'], metric)
+
+    checkpoint_dir = None
+    if params.get('checkpoint_dir'):
+        checkpoint_dir = get_checkpoint_dir(params['checkpoint_dir'], get_channel_id(files_df), job_params)
+    manifest = load_manifest(checkpoint_dir) if checkpoint_dir else {}
+    previous_result = load_result(checkpoint_dir, params) if checkpoint_dir else None
+    # The bins computed by this run
+    changed = np.zeros(len(buffer.grid), dtype=bool)
+
+    n_days = 0
+
+    def insert_day(t_hourly, q, c_hourly, processed=True):
+        nonlocal n_days
+        index = buffer.insert(t_hourly, q, c_hourly)
+        changed[index] = processed
+        n_days += 1
+        if on_day is not None:
+            on_day(buffer.grid[index], q, buffer.cepstro[:, index])
+
+    # The samples around midnight are read from the neighbouring days
+    jobs = []
+    sources = {}
+    for row, row_neighbors in zip(files_df.itertuples(), get_day_neighbors(files_df)):
+        if checkpoint_dir:
+            sources[(row.filename, row.datetime)] = get_row_source(row, row_neighbors, params)
+            if is_day_completed(manifest, checkpoint_dir, row.datetime, sources[(row.filename, row.datetime)]):
+                shard = load_day_shard(checkpoint_dir, row.datetime)
+                if shard is not None:
+                    insert_day(*shard, processed=False)
+                    continue
+        jobs.append((process_detection_day, row.filename, row.datetime, job_params, output_dir, row_neighbors))
+    if checkpoint_dir:
+        logging.info(f'ICI detection resumed from {checkpoint_dir}: {n_days} days restored, {len(jobs)} to process')
+        if jobs:
+            # The stored peak to valley ratio is only valid for the shards it was computed from
+            invalidate_results(checkpoint_dir)
+
+    try:
+        with create_executor(backend, n_workers) as executor:
+            # Days are submitted a few at a time so that pause and cancel take effect quickly
+            for filename, day, result in iter_results(executor, process_day, jobs, 2 * n_workers,
+                                                      cancel_event, resume_event):
+                if result is None:
+                    continue
+                t_hourly, q, c_hourly = result
+                c_hourly = load_array(c_hourly)
+                if checkpoint_dir:
+                    save_day_shard(checkpoint_dir, day, sources[(filename, day)], t_hourly, q, c_hourly)
+                insert_day(t_hourly, q, c_hourly)
+    finally:
+        if output_dir is not None:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if cancelled:
+        logging.info(f'ICI detection cancelled after {n_days} days')
+
+    if buffer.is_empty():
+        return None
+
+    tscale, q, cepstro = buffer.get_result()
+    return get_detection_result(tscale, q, cepstro, params, cancelled, checkpoint_dir, previous_result,
+                                changed[buffer.filled])
+
+
+def run_multi_species_detection(files_df: pd.DataFrame, params: dict, metric: str = '1H', cancel_event=None,
+                                resume_event=None, on_day=None) -> dict:
+    """
+    Run the detection of every species of params['species_list'] (with their preset
+    parameters) in one pass over the files: each day is decoded once, and the species
+    sharing the same spectrogram share the same cepstra.
+
+    With params['checkpoint_dir'], each group of species sharing the same cepstra has its
+    own shards (see run_detection), and a day is only processed for the groups missing one
+    (or all of them if its file changed).
+
+    Parameters
+    ----------
+    files_df, params, metric, cancel_event, resume_event
+        See run_detection.
+    on_day : callable, optional
+        Called with a dict species -> (tscale, q, cepstro) for each processed day, in
+        completion order.
+
+    Returns
+    -------
+    dict
+        species -> detection result (see get_detection_result), for the species with at
+        least one processed day.
+    """
+    backend = params.get('backend', 'thread')
+    n_workers = get_worker_count(params.get('max_workers'))
+    job_params = get_job_parameters(params, metric)
+    job_params['fft_workers'] = get_fft_worker_count(min(n_workers, max(1, len(files_df))), params.get('fft_workers'))
+    species_params = get_species_parameters(params['species_list'], job_params)
+    groups = list(get_spectrogram_groups(species_params).values())
+    output_dir = tempfile.mkdtemp(prefix='ici_detector_') if backend == 'process' else None
+
+    # One buffer per group of species sharing the same cepstra
+    buffers = [CepstrogramBuffer(files_df['datetime'], metric) for _ in groups]
+
+    checkpoint_dirs = [get_checkpoint_dir(params['checkpoint_dir'], get_channel_id(files_df), species_params[group[0]])
+                       if params.get('checkpoint_dir') else None for group in groups]
+    manifests = [load_manifest(checkpoint_dir) if checkpoint_dir else {} for checkpoint_dir in checkpoint_dirs]
+    previous_results = {species: load_result(checkpoint_dir, species_params[species])
+                        for group, checkpoint_dir in zip(groups, checkpoint_dirs) if checkpoint_dir for species in group}
+    changed = [np.zeros(len(buffer.grid), dtype=bool) for buffer in buffers]
+
+    def insert_group_day(day_results, group_index, t_hourly, q, c_hourly, processed=True):
+        index = buffers[group_index].insert(t_hourly, q, c_hourly)
+        changed[group_index][index] = processed
+        for species in groups[group_index]:
+            day_results[species] = (buffers[group_index].grid[index], q, buffers[group_index].cepstro[:, index])
+
+    n_days = 0
+    # The results of the groups restored from their shards, for the days processed for the other groups
+    restored_results = {}
+    jobs = []
+    sources = {}
+    processed_groups = set()
+    for row, row_neighbors in zip(files_df.itertuples(), get_day_neighbors(files_df)):
+        if params.get('checkpoint_dir'):
+            sources[(row.filename, row.datetime)] = get_row_source(row, row_neighbors, params)
+        day_results = {}
+        missing_groups = []
+        for group_index, checkpoint_dir in enumerate(checkpoint_dirs):
+            shard = None
+            if checkpoint_dir and is_day_completed(manifests[group_index], checkpoint_dir, row.datetime,
+                                                   sources[(row.filename, row.datetime)]):
+                shard = load_day_shard(checkpoint_dir, row.datetime)
+            if shard is None:
+                missing_groups.append(group_index)
+            else:
+                insert_group_day(day_results, group_index, *shard, processed=False)
+        if missing_groups:
+            processed_groups.update(missing_groups)
+            restored_results[(row.filename, row.datetime)] = day_results
+            day_species_params = {species: species_params[species]
+                                  for group_index in missing_groups for species in groups[group_index]}
+            jobs.append((process_multi_species_day, row.filename, row.datetime, day_species_params, output_dir,
+                         row_neighbors))
+        else:
+            n_days += 1
+            if on_day is not None:
+                on_day(day_results)
+
+    # The stored peak to valley ratios are only valid for the shards they were computed from
+    for group_index in processed_groups:
+        if checkpoint_dirs[group_index]:
+            invalidate_results(checkpoint_dirs[group_index])
+
+    try:
+        with create_executor(backend, n_workers) as executor:
+            for filename, day, results in iter_results(executor, process_day, jobs, 2 * n_workers,
+                                                       cancel_event, resume_event):
+                day_results = restored_results.pop((filename, day))
+                for group_index, group in enumerate(groups):
+                    if not results or group[0] not in results:
+                        continue
+                    t_hourly, q, c_hourly = results[group[0]]
+                    c_hourly = load_array(c_hourly)
+                    if checkpoint_dirs[group_index]:
+                        save_day_shard(checkpoint_dirs[group_index], day, sources[(filename, day)], t_hourly, q, c_hourly)
+                    insert_group_day(day_results, group_index, t_hourly, q, c_hourly)
+                if not day_results:
+                    continue
+                n_days += 1
+                if on_day is not None:
+                    on_day(day_results)
+    finally:
+        if output_dir is not None:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if cancelled:
+        logging.info(f'ICI detection cancelled after {n_days} days')
+
+    species_results = {}
+    for group_index, (group, buffer) in enumerate(zip(groups, buffers)):
+        if buffer.is_empty():
+            continue
+        tscale, q, cepstro = buffer.get_result()
+        for species in group:
+            species_result_params = dict(params)
+            species_result_params.update({key: value for key, value in species_params[species].items()
+                                          if key != 'fft_workers'})
+            species_results[species] = get_detection_result(tscale, q, cepstro, species_result_params, cancelled,
+                                                            checkpoint_dirs[group_index], previous_results.get(species),
+                                                            changed[group_index][buffer.filled])
+    return species_results
@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+
+CHECKPOINT_PARAMETERS = ['fftsize', 'overlap', 'integration', 'filter_boundaries', 'quefrency_range', 'metric']
+PARAMETERS_FILENAME = 'parameters.json'
+MANIFEST_FILENAME = 'days.jsonl'
+P2VR_PARAMETERS = ['peak_boundaries', 'valley_boundaries']
+
+
+def get_checkpoint_parameters(params: dict) -> dict:
+    """Return the parameters the cepstra of a day depend on (JSON serializable)."""
+    return {key: np.asarray(params.get(key)).tolist() for key in CHECKPOINT_PARAMETERS}
+
+
+def get_parameters_hash(params: dict, keys: list = CHECKPOINT_PARAMETERS) -> str:
+    """Return a hash of the parameters keys (by default, the ones the cepstra of a day depend on)."""
+    text = json.dumps({key: np.asarray(params.get(key)).tolist() for key in keys}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def get_checkpoint_dir(checkpoint_root: str, channel_id: str, params: dict) -> str:
+    """
+    Return (and create) the folder of the day shards of a channel computed with params: one
+    sub-folder of checkpoint_root/channel_id per parameter hash, so that shards computed with
+    other parameters are never reused.
+    """
+    checkpoint_dir = os.path.join(checkpoint_root, channel_id, get_parameters_hash(params))
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    parameters_path = os.path.join(checkpoint_dir, PARAMETERS_FILENAME)
+    if not os.path.exists(parameters_path):
+        with open(parameters_path, 'w') as file:
+            json.dump(get_checkpoint_parameters(params), file, indent=4)
+    return checkpoint_dir
+
+
+def get_day_key(day) -> str:
+    return pd.Timestamp(day).floor('D').strftime('%Y-%m-%d')
+
+
+def get_file_state(filename: str) -> dict:
+    """
+    Return the size and modification time of a file, read from the file itself: the ones of
+    the SDS catalog are only refreshed with their directory, which a file rewritten or
+    appended in place does not modify.
+    """
+    try:
+        stat = os.stat(filename)
+        size, mtime = stat.st_size, stat.st_mtime
+    except OSError:
+        size, mtime = None, None
+    return {'filename': str(filename), 'size': size, 'mtime': mtime}
+
+
+def get_day_source(filename: str, window, neighbors: tuple = None) -> dict:
+    """
+    Return what the cepstra of a day are computed from: its file with its size and
+    modification time, its time window and the neighbouring files read around midnight (with
+    their size and modification time). A day whose source differs from the one of its shard
+    is processed again.
+    """
+    source = get_file_state(filename)
+    source.update({
+        'window': [pd.Timestamp(value).isoformat() for value in window] if window is not None else None,
+        'neighbors': [get_file_state(neighbor) if neighbor else None for neighbor in (neighbors or (None, None))],
+    })
+    return source
+
+
+def load_manifest(checkpoint_dir: str) -> dict:
+    """
+    Read the manifest of a checkpoint folder: day -> source (see get_day_source) and shard.
+    The manifest is appended one line per day, the last line of a day wins, and a line
+    truncated by a crash is ignored.
+    """
+    manifest = {}
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            manifest[entry['day']] = entry
+    return manifest
+
+
+def is_day_completed(manifest: dict, checkpoint_dir: str, day, source: dict) -> bool:
+    """Return True if the shard of a day exists and was computed from the same source."""
+    entry = manifest.get(get_day_key(day))
+    return (entry is not None
+            and source['mtime'] is not None
+            and all(entry.get(key) == value for key, value in source.items())
+            and os.path.exists(os.path.join(checkpoint_dir, entry['shard'])))
+
+
+def save_day_shard(checkpoint_dir: str, day, source: dict, t, q: np.ndarray, c: np.ndarray):
+    """
+    Write the binned cepstra of a day (the output of get_binned_cepstra) to its shard and
+    record it in the manifest with its source (see get_day_source). The shard is written to
+    a temporary file first, so that a crash never leaves a partial shard behind.
+    """
+    day_key = get_day_key(day)
+    shard = f'{day_key}.npz'
+    shard_path = os.path.join(checkpoint_dir, shard)
+    temporary_path = shard_path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, t=np.asarray(t, dtype='datetime64[ns]'), q=np.asarray(q), c=np.asarray(c))
+    os.replace(temporary_path, shard_path)
+
+    entry = dict(day=day_key, shard=shard, **source)
+    with open(os.path.join(checkpoint_dir, MANIFEST_FILENAME), 'a') as file:
+        file.write(json.dumps(entry) + '\n')
+
+
+def load_day_shard(checkpoint_dir: str, day) -> tuple:
+    """
+    Read the shard of a day.
+
+    Returns
+    -------
+    tuple
+        (t, q, c) as returned by get_binned_cepstra, or None if the shard cannot be read.
+    """
+    shard_path = os.path.join(checkpoint_dir, f'{get_day_key(day)}.npz')
+    try:
+        with np.load(shard_path) as shard:
+            return shard['t'], shard['q'], shard['c']
+    except Exception as e:
+        logging.error(f"Error reading the checkpoint {shard_path}: {e}")
+        return None
+
+
+def get_result_path(checkpoint_dir: str, params: dict) -> str:
+    return os.path.join(checkpoint_dir, f'p2vr_{get_parameters_hash(params, P2VR_PARAMETERS)}.npz')
+
+
+def save_result(checkpoint_dir: str, params: dict, tscale, p2vr: np.ndarray):
+    """
+    Store the peak to valley ratio of the cepstrogram assembled from the shards, so that the
+    next run only recomputes it around the days processed again (see
+    lib.dayProcessing.update_p2vr_detection).
+    """
+    result_path = get_result_path(checkpoint_dir, params)
+    temporary_path = result_path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, tscale=pd.to_datetime(tscale).to_numpy(dtype='datetime64[ns]'), p2vr=np.asarray(p2vr))
+    os.replace(temporary_path, result_path)
+
+
+def load_result(checkpoint_dir: str, params: dict) -> tuple:
+    """
+    Read the peak to valley ratio stored by save_result.
+
+    Returns
+    -------
+    tuple
+        (tscale, p2vr), or None if there is none.
+    """
+    result_path = get_result_path(checkpoint_dir, params)
+    if not os.path.exists(result_path):
+        return None
+    try:
+        with np.load(result_path) as result:
+            return result['tscale'], result['p2vr']
+    except Exception as e:
+        logging.error(f"Error reading the checkpoint {result_path}: {e}")
+        return None
+
+
+def invalidate_results(checkpoint_dir: str):
+    """
+    Remove the stored peak to valley ratios, before shards are rewritten: a run interrupted
+    afterwards must not reuse values computed from the previous shards.
+    """
+    for name in os.listdir(checkpoint_dir):
+        if name.startswith('p2vr_') and name.endswith('.npz'):
+            os.remove(os.path.join(checkpoint_dir, name))
@@ -0,0 +1,614 @@
+import numpy as np
+import pandas as pd
+import logging
+from datetime import timedelta
+from obspy import UTCDateTime, Stream
+from lib.signalProcessing import get_spectrogram, get_batched_spectrogram, get_cepstro, get_quefrency_slice
+from lib.networkFuntions import get_calibrated_stream, get_stream_window, read_mseed_headers
+from lib.sampleCache import get_cached_stream_for_selected_file, read_cached_stream
+from lib.whaleIciDetection import get_binned_mean_cepstra, get_peak_to_valley_ratio, get_preset_parameters
+from lib.parallel import dump_array
+from lib.fftBackend import set_workers
+
+
+DEFAULT_STFT_CHUNK_SIZE = 1024  # frames computed at a time by get_spectrogram
+DAY_MARGIN_SETTLING = 10.  # seconds added to the half frame read around a day, for the filters to settle
+P2VR_WINDOW_SIZE = 12  # bins of the rolling mean of the peak to valley ratio
+
+
+def get_day_neighbors(files_df: pd.DataFrame) -> list:
+    """
+    Return the files of the previous and next days of each file of files_df (see
+    get_stitched_day_stream), among the files of files_df.
+
+    Parameters
+    ----------
+    files_df : pd.DataFrame
+        The files to process (filename and datetime columns, one file per day).
+
+    Returns
+    -------
+    list of tuple
+        (previous_filename, next_filename) of each row (None when the day is missing).
+    """
+    days = pd.to_datetime(files_df['datetime']).dt.floor('D')
+    filenames = dict(zip(days, files_df['filename']))
+    one_day = pd.Timedelta(days=1)
+    return [(filenames.get(day - one_day), filenames.get(day + one_day)) for day in days]
+
+
+def get_frame_margin(fftsize: int, dem_boundaries, sampling_rate: float) -> float:
+    """
+    Return the duration (s) of the samples needed on each side of a day to compute the frames
+    centred near midnight: half a frame at the rate of the spectrogram (2 * (fmax - fmin)
+    when demodulated) plus DAY_MARGIN_SETTLING.
+    """
+    rate = sampling_rate
+    if dem_boundaries:
+        rate = 2 * (dem_boundaries[1] - dem_boundaries[0])
+    return 0.5 * fftsize / rate + DAY_MARGIN_SETTLING
+
+
+def get_day_window(day, params: dict) -> tuple:
+    """
+    Return the part [start, end) of a day within the selected period (params['starttime']
+    and params['endtime'], if set), or None if they do not overlap.
+    """
+    start = pd.Timestamp(day).floor('D')
+    end = start + pd.Timedelta(days=1)
+    if params.get('starttime') is not None:
+        start = max(start, pd.Timestamp(params['starttime']))
+    if params.get('endtime') is not None:
+        end = min(end, pd.Timestamp(params['endtime']))
+    if start >= end:
+        return None
+    return start, end
+
+
+def get_stitched_day_stream(filename: str, day, params: dict, margin, neighbors: tuple = None,
+                            window: tuple = None) -> Stream:
+    """
+    Read a day file (through the sample cache when params['cache_dir'] is set) and trim it
+    to [day - margin, day + 24h + margin]. The samples of the margins missing from the file
+    are read from the neighbouring day files (only the records of the margins), so that the
+    frames centred near midnight are computed from actual samples, once (see
+    lib.signalProcessing.get_frame_grid).
+
+    With a window shorter than the day (see get_day_window), the stream is trimmed to
+    [window start - margin, window end + margin] instead, and, unless the day is in the
+    sample cache, only the records of this time span are decoded.
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to read.
+    day : datetime
+        The day of the file.
+    params : dict
+        The processing parameters.
+    margin : float or callable
+        The margin (s), or a function returning it from the sampling rate (see
+        get_frame_margin).
+    neighbors : tuple, optional
+        (previous_filename, next_filename), the files of the previous and next days (None
+        if missing).
+    window : tuple, optional
+        [start, end) within the day (datetime, UTC). The whole day if None.
+
+    Returns
+    -------
+    Stream
+        An ObsPy Stream containing the data of the day (or window) and of its margins.
+    """
+    if window is None:
+        window = (day, day + timedelta(hours=24))
+    window_start, window_end = (UTCDateTime(pd.Timestamp(value).to_pydatetime()) for value in window)
+
+    st = None
+    if window_end - window_start < 86400:
+        # A day already in the cache is only sliced, otherwise only the window is decoded
+        st = read_cached_stream(filename, params.get('cache_dir'))
+        if st is None:
+            segments, _ = read_mseed_headers(filename)
+            if not segments:
+                return Stream()
+            window_margin = margin(segments[0][6]) if callable(margin) else margin
+            st = get_stream_window(filename, window_start - window_margin, window_end + window_margin)
+    if st is None:
+        st = get_cached_stream_for_selected_file(filename, params.get('cache_dir'), params.get('cache_size'))
+    if not st:
+        return st
+    if callable(margin):
+        margin = margin(st[0].stats.sampling_rate)
+
+    starttime = window_start - margin
+    endtime = window_end + margin
+    st.trim(starttime, endtime)
+    if not st:
+        return st
+
+    previous_file, next_file = neighbors or (None, None)
+    channel = st[0].stats.channel
+    delta = st[0].stats.delta
+    first = min(tr.stats.starttime for tr in st)
+    last = max(tr.stats.endtime for tr in st)
+    try:
+        if previous_file and first - starttime >= delta:
+            st += get_stream_window(previous_file, starttime, first - delta, channel)
+        if next_file and endtime - last >= delta:
+            st += get_stream_window(next_file, last + delta, endtime, channel)
+    except Exception as e:
+        logging.error(f"Error reading the neighbouring days of {filename}: {e}")
+
+    # Joins the adjacent traces only
+    st.merge(method=-1)
+    st.sort()
+    return st
+
+
+def get_trace_batches(st: Stream, time_range: tuple = None) -> list:
+    """
+    Group the traces of a stream that can be processed as one stack (same number of samples,
+    sampling rate and dtype), e.g. the acquisition cycles of a duty-cycle recording. With
+    time_range ([start, end)), the traces not within time_range are left alone.
+
+    Returns
+    -------
+    list of list of int
+        The positions of the traces of each group, in the order of their first trace.
+    """
+    if time_range is not None:
+        start, end = (UTCDateTime(pd.Timestamp(value).to_pydatetime()) for value in time_range)
+
+    batches = {}
+    for position, tr in enumerate(st):
+        if time_range is not None and not (start <= tr.stats.starttime and tr.stats.endtime < end):
+            key = position
+        else:
+            key = (tr.stats.npts, tr.stats.sampling_rate, tr.data.dtype.str)
+        batches.setdefault(key, []).append(position)
+    return list(batches.values())
+
+
+def process_species(st: Stream, preset_parameters: dict, time_range: tuple = None, grid_origin=None) -> tuple:
+    """
+    Compute the cepstrogram of every trace of the stream for the given species parameters.
+
+    The traces of equal length (the cycles of duty-cycle recordings) are processed as one
+    stack by get_batched_spectrogram, the other ones one by one by get_spectrogram.
+
+    With time_range ([start, end)), only the frames centred in time_range are computed (see
+    get_spectrogram), the traces overlapping its boundaries not being batched.
+
+    Parameters
+    ----------
+    st : Stream
+        The stream to process.
+    preset_parameters : dict
+        The detection parameters (fftsize, overlap, integration, filter_boundaries and,
+        optionally, stft_chunk_size).
+    time_range : tuple, optional
+        [start, end) (datetime, UTC).
+    grid_origin : datetime, optional
+        The origin of the frame grid (see get_spectrogram), e.g. the start of the day.
+
+    Returns
+    -------
+    t : np.ndarray
+        Array of time values.
+    q : np.ndarray
+        Array of quefrency values.
+    c : np.ndarray
+        Cepstrogram.
+    """
+    try:
+        fftsize = preset_parameters['fftsize']
+        noverlap = int(preset_parameters['fftsize'] * preset_parameters['overlap'])
+        integration = preset_parameters['integration']
+        dem_boundaries = [preset_parameters['filter_boundaries'][0], preset_parameters['filter_boundaries'][1]]
+        chunk_size = preset_parameters.get('stft_chunk_size', DEFAULT_STFT_CHUNK_SIZE)
+
+        # Results of each trace, in the order of the stream
+        all_times = [None] * len(st)
+        all_spectrograms = [None] * len(st)
+        f = None
+
+        for batch in get_trace_batches(st, time_range):
+            if len(batch) > 1:
+                result = get_batched_spectrogram([st[position] for position in batch], fftsize, noverlap, integration,
+                                                 dem_boundaries, chunk_size)
+                if result is not None:
+                    f, t, s = result
+                    for k, position in enumerate(batch):
+                        all_times[position] = t[k]
+                        all_spectrograms[position] = s[k]
+                    continue
+
+            for position in batch:
+                f, t, s = get_spectrogram(st[position], fftsize, noverlap, integration, dem_boundaries, chunk_size,
+                                          time_range=time_range, grid_origin=grid_origin)
+                all_times[position] = t
+                all_spectrograms[position] = s
+
+        # Concatenate all results (frequencies are the same for all traces)
+        t = np.concatenate(all_times)
+        s = np.concatenate(all_spectrograms, axis=1)
+
+        return get_cepstro(t, f, s)
+    except Exception as e:
+        logging.error(f'Error processing species: {e}')
+        return None, None, None
+
+
+def get_binned_cepstra(st: Stream, day, params: dict, output_dir: str = None, window: tuple = None):
+    """
+    Compute the cepstrogram of the frames of a day stream centred in [day, day + 24h) (or in
+    window, see get_day_window) and average it over bins of params['metric'].
+
+    The mean cepstra are detrended over the whole quefrency range (see
+    get_binned_mean_cepstra), and only then cut to params['quefrency_range'] (if set).
+
+    Returns
+    -------
+    tuple or None
+        (t_hourly, q, c_hourly), or None if the day holds no data.
+    """
+    current_day = pd.Timestamp(day).floor('D')
+    if window is None:
+        window = (current_day, current_day + pd.Timedelta(days=1))
+    t, q, c = process_species(st, params, window, current_day)
+
+    metric = params['metric']
+    delta = timedelta(seconds=pd.to_timedelta(metric).total_seconds())
+
+    hours = pd.date_range(start=current_day, periods=int((24*3600)/delta.total_seconds()), freq=metric)
+    bin_index, c_hourly = get_binned_mean_cepstra(t, c, q, hours.to_numpy(), delta)
+    kept = get_quefrency_slice(q, params.get('quefrency_range'))
+    q, c_hourly = q[kept], c_hourly[kept]
+
+    if len(bin_index) > 0:
+        return np.array(hours[bin_index]), q, dump_array(c_hourly, output_dir)
+    return None
+
+
+def process_detection_day(filename: str, day, params: dict, output_dir: str = None, neighbors: tuple = None):
+    """
+    Compute the mean cepstra of one day file, averaged over bins of params['metric'].
+    Only the part of the day within params['starttime'] and params['endtime'] (if set) is
+    processed.
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to process.
+    day : datetime
+        The day of the file.
+    params : dict
+        The detection parameters.
+    output_dir : str, optional
+        If given, the cepstra are returned as the path of a .npy file written in this
+        folder (see lib.parallel.dump_array).
+    neighbors : tuple, optional
+        The files of the previous and next days (see get_stitched_day_stream).
+
+    Returns
+    -------
+    tuple or None
+        (t_hourly, q, c_hourly), or None if the day holds no data.
+    """
+    window = get_day_window(day, params)
+    if window is None:
+        return None
+    with set_workers(params.get('fft_workers')):
+        try:
+            def margin(sampling_rate):
+                return get_frame_margin(params['fftsize'], params['filter_boundaries'], sampling_rate)
+            st = get_stitched_day_stream(filename, day, params, margin, neighbors, window)
+            return get_binned_cepstra(st, day, params, output_dir, window)
+
+        except Exception as e:
+            # Log the error and return None
+            logging.error(f"ICI detection - Error processing file {filename}: {e}")
+            return None
+
+
+def get_quefrency_range(peak_boundaries, valley_boundaries) -> list:
+    """Return the quefrencies the peak to valley ratio needs: from 0 to the end of the peak and valley bands."""
+    return [0.0, float(max(peak_boundaries[1], valley_boundaries[1]))]
+
+
+def get_species_parameters(species_list: list, params: dict) -> dict:
+    """
+    Return the detection parameters of each species: params updated with the preset of the
+    species (see get_preset_parameters).
+
+    Only the quefrencies up to the peak and valley bands are kept (quefrency_range, see
+    get_binned_cepstra); the species sharing the same spectrogram share the widest of their
+    ranges, so that they are still computed once per day (see get_spectrogram_groups).
+
+    Parameters
+    ----------
+    species_list : list of str
+        The species (index of get_preset_parameters).
+    params : dict
+        The parameters shared by all the species (metric, p2vr_threshold, processing options...).
+
+    Returns
+    -------
+    dict
+        species -> detection parameters.
+    """
+    presets = get_preset_parameters()
+    species_params = {}
+    for species in species_list:
+        preset = presets.loc[species]
+        species_params[species] = dict(params)
+        species_params[species].update({
+            'species': species,
+            'fftsize': int(preset['fftsize']),
+            'overlap': float(preset['overlap']),
+            'integration': int(preset['integration']),
+            'filter_boundaries': (float(preset['fmin']), float(preset['fmax'])),
+            'peak_boundaries': tuple(preset['peak_boundaries']),
+            'valley_boundaries': tuple(preset['valley_boundaries']),
+            'quefrency_range': get_quefrency_range(preset['peak_boundaries'], preset['valley_boundaries']),
+        })
+
+    for group in get_spectrogram_groups(species_params, quefrency_range=False).values():
+        quefrency_range = [0.0, max(species_params[species]['quefrency_range'][1] for species in group)]
+        for species in group:
+            species_params[species]['quefrency_range'] = quefrency_range
+    return species_params
+
+
+def get_spectrogram_groups(species_params: dict, quefrency_range: bool = True) -> dict:
+    """
+    Group the species whose cepstrograms are identical (same fftsize, overlap, integration,
+    band and quefrency range), so that they are computed once per day.
+
+    Parameters
+    ----------
+    species_params : dict
+        species -> detection parameters (see get_species_parameters).
+    quefrency_range : bool
+        If False, the species sharing the same spectrogram are grouped whatever their
+        quefrency ranges.
+
+    Returns
+    -------
+    dict
+        (fftsize, noverlap, integration, filter_boundaries, quefrency_range) -> list of species.
+    """
+    groups = {}
+    for species, params in species_params.items():
+        species_range = params.get('quefrency_range') if quefrency_range else None
+        key = (
+            int(params['fftsize']),
+            int(params['fftsize'] * params['overlap']),
+            params['integration'],
+            tuple(params['filter_boundaries']),
+            tuple(species_range) if species_range is not None else None,
+        )
+        groups.setdefault(key, []).append(species)
+    return groups
+
+
+def process_multi_species_day(filename: str, day, species_params: dict, output_dir: str = None, neighbors: tuple = None):
+    """
+    Compute the mean cepstra of one day file for several species. The day is read and
+    decoded once, and the species sharing the same spectrogram (see get_spectrogram_groups)
+    share the same cepstra.
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to process.
+    day : datetime
+        The day of the file.
+    species_params : dict
+        species -> detection parameters (see get_species_parameters). The processing
+        options (cache, metric, fft_workers) are taken from the first species.
+    output_dir, neighbors : optional
+        See process_detection_day.
+
+    Returns
+    -------
+    dict or None
+        species -> (t_hourly, q, c_hourly) for the species with data, or None if the day
+        could not be read.
+    """
+    params = next(iter(species_params.values()))
+    window = get_day_window(day, params)
+    if window is None:
+        return None
+    with set_workers(params.get('fft_workers')):
+        try:
+            # The margins of the species with the longest frames
+            def margin(sampling_rate):
+                return max(get_frame_margin(species['fftsize'], species['filter_boundaries'], sampling_rate)
+                           for species in species_params.values())
+            st = get_stitched_day_stream(filename, day, params, margin, neighbors, window)
+        except Exception as e:
+            logging.error(f"ICI detection - Error reading file {filename}: {e}")
+            return None
+
+        results = {}
+        for group in get_spectrogram_groups(species_params).values():
+            try:
+                # Each group gets the margins it would have been read with alone
+                group_params = species_params[group[0]]
+                group_margin = get_frame_margin(group_params['fftsize'], group_params['filter_boundaries'],
+                                                st[0].stats.sampling_rate)
+                group_st = st.slice(UTCDateTime(window[0].to_pydatetime()) - group_margin,
+                                    UTCDateTime(window[1].to_pydatetime()) + group_margin)
+                result = get_binned_cepstra(group_st, day, group_params, output_dir, window)
+            except Exception as e:
+                logging.error(f"ICI detection - Error processing file {filename} for {', '.join(group)}: {e}")
+                continue
+            if result is not None:
+                for species in group:
+                    results[species] = result
+        return results
+
+
+def get_spectrogram_dem_boundaries(dem_boundaries, sampling_rate: float):
+    """Return the demodulation band, or None if it is the whole band [0, fs/2]."""
+    if not dem_boundaries==None:
+        if dem_boundaries[0]==0 and 2*dem_boundaries[1]==sampling_rate:
+            dem_boundaries=None
+    return dem_boundaries
+
+
+def process_spectrogram_day(filename: str, day, stations_df: pd.DataFrame, params: dict, output_dir: str = None,
+                            neighbors: tuple = None):
+    """
+    Compute the calibrated long-term spectrogram (in dB) of one day file. Only the part of
+    the day within params['starttime'] and params['endtime'] (if set) is processed.
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to process.
+    day : datetime
+        The day of the file.
+    stations_df : pd.DataFrame
+        The station details of the network (for calibration).
+    params : dict
+        The spectrogram parameters.
+    output_dir : str, optional
+        If given, the spectrogram is returned as the path of a .npy file written in this
+        folder (see lib.parallel.dump_array).
+    neighbors : tuple, optional
+        The files of the previous and next days (see get_stitched_day_stream).
+
+    Returns
+    -------
+    tuple or None
+        (t, f, slog), or None if the file could not be processed.
+    """
+    window = get_day_window(day, params)
+    if window is None:
+        return None
+    with set_workers(params.get('fft_workers')):
+        try:
+            def margin(sampling_rate):
+                dem_boundaries = get_spectrogram_dem_boundaries(params['dem_boundaries'], sampling_rate)
+                return get_frame_margin(params['fftsize'], dem_boundaries, sampling_rate)
+            st = get_stitched_day_stream(filename, day, params, margin, neighbors, window)
+            st = get_calibrated_stream(st, stations_df)
+            fs = st[0].stats.sampling_rate
+            dem_boundaries = get_spectrogram_dem_boundaries(params['dem_boundaries'], fs)
+            current_day = pd.Timestamp(day).floor('D')
+            f, t, s = get_spectrogram(
+                st[0],
+                params['fftsize'],
+                params['noverlap'],
+                params['integration'],
+                dem_boundaries,
+                params.get('stft_chunk_size', DEFAULT_STFT_CHUNK_SIZE),
+                params.get('reducer', 'mean'),
+                window,
+                current_day
+            )
+            return t, f, dump_array(120 + 10 * np.log10(np.abs(s)), output_dir)
+        except Exception as e:
+
+            logging.error(f"Spectro - Error processing file {filename}: {e}")
+            return None
+
+
+def get_positive_detection(p2vr, threshold) -> np.ndarray:
+    """Return 1 where p2vr is above threshold, 0 elsewhere."""
+    above_threshold_indices = np.where(p2vr > threshold)[0]
+    positive_detection = np.zeros_like(p2vr, dtype=int)
+    positive_detection[above_threshold_indices] = 1
+    return positive_detection
+
+
+def run_p2vr_detection(q, c, params, prefix_sums=None):
+    """
+    Compute the peak to valley ratio of the cepstrogram and the positive detections
+    (p2vr above params['p2vr_threshold']). prefix_sums is the optional output of
+    get_quefrency_prefix_sums for c.
+    """
+    p2vr= get_peak_to_valley_ratio(q, c, params['peak_boundaries'], params['valley_boundaries'], P2VR_WINDOW_SIZE, prefix_sums)
+    return p2vr, get_positive_detection(p2vr, params["p2vr_threshold"])
+
+
+def extend_p2vr_detection(q, c, params, first: int):
+    """
+    Compute the peak to valley ratio and the positive detections of the bins first: of the
+    cepstrogram c, the bins before being unchanged: only their last P2VR_WINDOW_SIZE - 1 bins
+    are read, to complete the rolling windows.
+    """
+    start = max(0, first - (P2VR_WINDOW_SIZE - 1))
+    p2vr = get_peak_to_valley_ratio(q, c[:, start:], params['peak_boundaries'], params['valley_boundaries'],
+                                    P2VR_WINDOW_SIZE)
+    p2vr = np.asarray(p2vr)[first - start:]
+    return p2vr, get_positive_detection(p2vr, params["p2vr_threshold"])
+
+
+def update_p2vr_detection(tscale, q, c, params, previous_tscale, previous_p2vr, changed):
+    """
+    Same as run_p2vr_detection, reusing the peak to valley ratio of a previous run.
+
+    The p2vr of a bin is the rolling mean over the P2VR_WINDOW_SIZE bins ending at it: it is
+    taken from the previous run when these bins are the same as then and unchanged, and only
+    recomputed over the span of the windows holding a new or changed bin.
+
+    Parameters
+    ----------
+    tscale : array-like of datetime
+        The time of the bins of c.
+    q, c, params
+        See run_p2vr_detection.
+    previous_tscale : array-like of datetime
+        The time of the bins of the previous run.
+    previous_p2vr : np.ndarray
+        The peak to valley ratio of the previous run.
+    changed : np.ndarray
+        True for the bins of c computed again since the previous run.
+
+    Returns
+    -------
+    tuple
+        (p2vr, positive_detection), as run_p2vr_detection.
+    """
+    tscale = pd.to_datetime(tscale).to_numpy(dtype='datetime64[ns]')
+    previous_tscale = pd.to_datetime(previous_tscale).to_numpy(dtype='datetime64[ns]')
+    previous_p2vr = np.asarray(previous_p2vr)
+    n_bins = len(tscale)
+    if len(previous_tscale) == 0 or n_bins == 0:
+        return run_p2vr_detection(q, c, params)
+
+    position = np.minimum(np.searchsorted(previous_tscale, tscale), len(previous_tscale) - 1)
+    found = (previous_tscale[position] == tscale) & ~np.asarray(changed, dtype=bool)
+    previous_index = np.where(found, position, -1)
+    offset = previous_index - np.arange(n_bins)
+
+    # Every bin of the window must be found at the same offset, and a window truncated by the
+    # start of the cepstrogram must have been truncated the same way
+    reusable = found.copy()
+    for lag in range(1, P2VR_WINDOW_SIZE):
+        inside = np.arange(n_bins) >= lag
+        same_bin = np.empty(n_bins, dtype=bool)
+        same_bin[inside] = found[:-lag] & (offset[:-lag] == offset[inside])
+        same_bin[~inside] = previous_index[~inside] < lag
+        reusable &= same_bin
+
+    p2vr = np.empty(n_bins)
+    p2vr[reusable] = previous_p2vr[previous_index[reusable]]
+
+    # The other bins are computed by runs, each with the bins before it completing its windows
+    recomputed = np.flatnonzero(~reusable)
+    if len(recomputed):
+        breaks = np.flatnonzero(np.diff(recomputed) > 1)
+        for first, last in zip(recomputed[np.r_[0, breaks + 1]], recomputed[np.r_[breaks, len(recomputed) - 1]]):
+            start = max(0, first - (P2VR_WINDOW_SIZE - 1))
+            p2vr_run = get_peak_to_valley_ratio(q, c[:, start:last + 1], params['peak_boundaries'],
+                                                params['valley_boundaries'], P2VR_WINDOW_SIZE)
+            p2vr[first:last + 1] = np.asarray(p2vr_run)[first - start:]
+    logging.info(f'Peak to valley ratio recomputed on {len(recomputed)} of {n_bins} bins')
+
+    p2vr = pd.Series(p2vr)
+    return p2vr, get_positive_detection(p2vr, params["p2vr_threshold"])
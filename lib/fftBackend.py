@@ -0,0 +1,74 @@
+import os
+import functools
+import numpy as np
+import scipy.fft
+import scipy.signal as sp
+
+
+def get_fft_worker_count(n_jobs: int = 1, fft_workers: int = None) -> int:
+    """
+    Return the number of threads of each FFT.
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of jobs running at the same time (the size of the worker pool, or the
+        number of days if lower).
+    fft_workers : int, optional
+        The requested number of threads. If None or 0, the CPUs are shared between the
+        jobs, so that the pool and the FFTs do not oversubscribe them.
+
+    Returns
+    -------
+    int
+        The number of threads (at least 1).
+    """
+    if fft_workers:
+        return max(1, int(fft_workers))
+    return max(1, (os.cpu_count() or 1) // max(1, n_jobs))
+
+
+def set_workers(workers: int = None):
+    """
+    Context manager setting the number of threads of the FFTs of this module in the current
+    thread (see scipy.fft.set_workers). None means 1.
+    """
+    return scipy.fft.set_workers(max(1, int(workers or 1)))
+
+
+def get_workers() -> int:
+    """Return the number of threads of the FFTs in the current thread."""
+    return scipy.fft.get_workers()
+
+
+def rfft(x: np.ndarray, n: int = None, axis: int = -1) -> np.ndarray:
+    return scipy.fft.rfft(x, n=n, axis=axis, workers=get_workers())
+
+
+def irfft(x: np.ndarray, n: int = None, axis: int = -1) -> np.ndarray:
+    return scipy.fft.irfft(x, n=n, axis=axis, workers=get_workers())
+
+
+@functools.lru_cache(maxsize=32)
+def get_stft_window(nperseg: int, dtype: np.dtype) -> tuple:
+    """
+    Return the window and the scaling factor used by scipy.signal.stft for segments of
+    nperseg samples of the given input dtype, computed once per (nperseg, dtype).
+
+    Returns
+    -------
+    window : np.ndarray
+        The periodic hann window (read-only), as rounded by scipy for this dtype.
+    scale : complex
+        The 'spectrum' scaling factor.
+    outdtype : np.dtype
+        The complex dtype of the STFT.
+    """
+    outdtype = np.result_type(dtype, np.complex64)
+    window = sp.get_window('hann', nperseg)
+    if np.result_type(window, np.complex64) != outdtype:
+        window = window.astype(outdtype)
+    scale = np.sqrt(1.0 / window.sum()**2)
+    window = np.ascontiguousarray(window.real)
+    window.setflags(write=False)
+    return window, scale, outdtype
@@ -0,0 +1,104 @@
+import functools
+import numpy as np
+import scipy.signal as sp
+
+
+DEFAULT_FILTER_CHUNK_SIZE = 2**20  # samples filtered at a time by sosfiltfilt_inplace
+
+
+@functools.lru_cache(maxsize=64)
+def _design_butter_sos(order: int, band, btype: str, fs: float) -> np.ndarray:
+    return sp.butter(order, band, btype, fs=fs, output='sos')
+
+
+def get_butter_sos(order: int, band, btype: str, fs: float) -> np.ndarray:
+    """
+    Return the second-order sections of a Butterworth filter, designed once per
+    (order, band, btype, fs).
+
+    Parameters
+    ----------
+    order : int
+        The order of the filter.
+    band : float or list of float
+        The cutoff frequency, or [fmin, fmax] for band filters (Hz).
+    btype : str
+        'lowpass', 'highpass', 'bandpass' or 'bandstop'.
+    fs : float
+        The sampling rate (Hz).
+
+    Returns
+    -------
+    np.ndarray
+        The second-order sections (shared between the callers: not to be modified).
+    """
+    band = tuple(float(value) for value in band) if np.ndim(band) else float(band)
+    return _design_butter_sos(int(order), band, btype, float(fs))
+
+
+def get_default_padlen(sos: np.ndarray) -> int:
+    """Return the default padlen of scipy.signal.sosfiltfilt for sos."""
+    n_sections = sos.shape[0]
+    return 3 * (2 * n_sections + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum()))
+
+
+def _get_initial_state(zi: np.ndarray, x0: np.ndarray) -> np.ndarray:
+    """Scale the steady-state sosfilt_zi of each section by the first samples x0."""
+    return zi.reshape((zi.shape[0],) + (1,) * x0.ndim + (2,)) * x0[np.newaxis, ..., np.newaxis]
+
+
+def sosfiltfilt_inplace(sos: np.ndarray, data: np.ndarray, padlen: int = None,
+                        chunk_size: int = DEFAULT_FILTER_CHUNK_SIZE) -> np.ndarray:
+    """
+    Zero-phase filtering of data along its last axis, written in place.
+
+    This is scipy.signal.sosfiltfilt (odd extension of padlen samples, steady-state initial
+    conditions) computed as a forward and a backward pass over chunks of chunk_size samples,
+    so that no full-length copy of the data is made. The filter state is kept in float64: for
+    float64 data the output is the same as sosfiltfilt's, for float32 data the forward pass is
+    rounded to float32 before the backward pass.
+
+    Parameters
+    ----------
+    sos : np.ndarray
+        The second-order sections (see get_butter_sos).
+    data : np.ndarray
+        The (writable, floating point) samples, or a stack of time series (traces x samples).
+    padlen : int, optional
+        The number of samples of the odd extension at both ends (default: the one of
+        sosfiltfilt).
+    chunk_size : int, optional
+        The number of samples filtered at a time. All the samples at once if None or 0.
+
+    Returns
+    -------
+    np.ndarray
+        data, filtered.
+    """
+    n_samples = data.shape[-1]
+    if padlen is None:
+        padlen = get_default_padlen(sos)
+    if n_samples <= padlen:
+        raise ValueError(f"The length of the input vector x must be greater than padlen, which is {padlen}.")
+    chunk_size = chunk_size or n_samples
+    zi = sp.sosfilt_zi(sos)
+
+    # Odd extensions of both ends (computed before the data is overwritten)
+    left_ext = 2 * data[..., :1] - data[..., padlen:0:-1]
+    right_ext = 2 * data[..., -1:] - data[..., -2:-(padlen + 2):-1]
+
+    # Forward pass
+    _, state = sp.sosfilt(sos, left_ext, axis=-1, zi=_get_initial_state(zi, left_ext[..., 0]))
+    for start in range(0, n_samples, chunk_size):
+        end = min(start + chunk_size, n_samples)
+        data[..., start:end], state = sp.sosfilt(sos, data[..., start:end], axis=-1, zi=state)
+    right_filtered, state = sp.sosfilt(sos, right_ext, axis=-1, zi=state)
+
+    # Backward pass, starting from the end of the right extension
+    right_filtered = right_filtered[..., ::-1]
+    _, state = sp.sosfilt(sos, right_filtered, axis=-1, zi=_get_initial_state(zi, right_filtered[..., 0]))
+    for end in range(n_samples, 0, -chunk_size):
+        start = max(end - chunk_size, 0)
+        filtered, state = sp.sosfilt(sos, data[..., start:end][..., ::-1], axis=-1, zi=state)
+        data[..., start:end] = filtered[..., ::-1]
+    return data
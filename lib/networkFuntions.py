@@ -10,7 +10,13 @@ from datetime import timedelta
 import numpy as np
 # from pydub import AudioSegment
 # from mutagen.flac import FLAC
-from scipy.signal import butter, filtfilt
+from lib.filterBank import get_butter_sos, sosfiltfilt_inplace
+from lib.parallel import create_executor
+import re
+from lib.sdsCatalog import (
+    refresh_catalog, read_inventory_cache, write_inventory_cache, STATION_COLUMNS,
+    get_unindexed_files, write_mseed_index, read_mseed_index
+)
 
 import os
 import glob
@@ -20,25 +26,10 @@ import logging
 
 
 
-def get_network_details(net_path: str, inventory_path: str) -> pd.DataFrame:
+def _flatten_inventory(inv) -> list:
     """
-    Extracts the network details from the inventory XML file.
-
-    Parameters
-    ----------
-    net_path : str
-        The network code.
-    inventory_path : str
-        Path to the inventory folder.
-
-    Returns
-    -------
-    pd.DataFrame
-        A pandas DataFrame with the station details.
+    Flatten an ObsPy inventory into one row per channel (see STATION_COLUMNS).
     """
-    logging.info(f'Loading inventory for network: {net_path} from {inventory_path}')
-    inv = inventory.read_inventory(os.path.join(inventory_path, f'{net_path}*.xml'))
-
     df_stations = []
     for net in inv:
         for station in net:
@@ -80,72 +71,107 @@ def get_network_details(net_path: str, inventory_path: str) -> pd.DataFrame:
                         None
                     ])
 
-    df_stations = pd.DataFrame(df_stations, columns=[
-        'net', 'net_start', 'net_end', 'sta', 'lon', 'lat', 'ele', 'cha', 'sample_rate', 'sensitivity', 'starttime', 'endtime'
-    ])
-    return df_stations.drop_duplicates()
+    return df_stations
 
 
-def get_network_file_list(net: str, sta: str, sds_path: str) -> pd.DataFrame:
+def _read_inventory_rows(xml_file: str) -> list:
     """
-    Create the list of mseed files available for the network and station.
+    Read one StationXML file and flatten it. Module-level so that it can run in a process pool.
+    """
+    return _flatten_inventory(inventory.read_inventory(xml_file))
+
+
+def get_network_details(net_path: str, inventory_path: str, cache_path: str = None, max_workers: int = None) -> pd.DataFrame:
+    """
+    Extracts the network details from the inventory XML file.
 
     Parameters
     ----------
-    net : str
-        The network code ("*" for all networks").
-    sta : str
-        The station name ("*" for all stations").
-    sds_path : str
-        Path to the SDS files.
+    net_path : str
+        The network code.
+    inventory_path : str
+        Path to the inventory folder.
+    cache_path : str, optional
+        Path to the on-disk catalog holding the flattened station table. When given,
+        only the XML files whose mtime or size changed since the last call are parsed.
+    max_workers : int, optional
+        Number of processes used to parse the changed XML files (default: number of CPUs).
 
     Returns
     -------
     pd.DataFrame
-        A pandas DataFrame with all the corresponding files and some details.
+        A pandas DataFrame with the station details.
     """
-    # Use os.path.join to create a platform-independent file pattern
-    logging.info(f'Loading file list for network: {net}, station: {sta} from {sds_path}')
-    file_pattern = os.path.join(sds_path, '*', net, sta, '*', '*.*')
-    logging.info(f'Looking for files with pattern: {file_pattern}')
-    file_list = sorted(glob.glob(file_pattern))
-    logging.info(f'Found {len(file_list)} files.')
+    logging.info(f'Loading inventory for network: {net_path} from {inventory_path}')
+    if not cache_path:
+        inv = inventory.read_inventory(os.path.join(inventory_path, f'{net_path}*.xml'))
+        df_stations = pd.DataFrame(_flatten_inventory(inv), columns=STATION_COLUMNS)
+        return df_stations.drop_duplicates()
+
+    xml_files = sorted(glob.glob(os.path.join(inventory_path, f'{net_path}*.xml')))
+    df_cached, stale_files = read_inventory_cache(cache_path, xml_files)
+    logging.info(f'Inventory cache: {len(xml_files) - len(stale_files)} files up to date, {len(stale_files)} to parse.')
+
+    if len(stale_files) > 1:
+        with create_executor('process', max_workers or os.cpu_count()) as executor:
+            parsed = dict(zip(stale_files, executor.map(_read_inventory_rows, stale_files)))
+    else:
+        parsed = {xml_file: _read_inventory_rows(xml_file) for xml_file in stale_files}
 
-    # Separate valid and invalid files
-    valid_files = []
-    invalid_files = []
+    df_parsed = []
+    for xml_file, rows in parsed.items():
+        write_inventory_cache(cache_path, xml_file, rows)
+        df_parsed.append(pd.DataFrame(rows, columns=STATION_COLUMNS))
 
-    for file in file_list:
-        # Check if the file path has the expected structure
-        path_parts = file.split(os.sep)
-        if len(path_parts) >= 6 and len(path_parts[-1].split('.')) >= 7:
-            valid_files.append(file)
-        else:
-            invalid_files.append(file)
+    df_stations = [df for df in [df_cached] + df_parsed if not df.empty]
+    df_stations = pd.concat(df_stations, ignore_index=True) if df_stations else df_cached
+    return df_stations.drop_duplicates()
+
+
+def parse_sds_filenames(file_list: list) -> pd.DataFrame:
+    """
+    Extract the SDS components of a list of file paths in one vectorized pass.
+
+    Parameters
+    ----------
+    file_list : list of str
+        Normalized paths following <SDSROOT>/<YEAR>/<NET>/<STA>/<CHAN>.D/<NET>.<STA>.<LOC>.<CHAN>.D.<YEAR>.<DOY>
+
+    Returns
+    -------
+    pd.DataFrame
+        A pandas DataFrame with the columns filename, year, net, sta, cha, julian, starttime and datetime.
+    """
+    filenames = pd.Series(file_list, dtype=object)
+
+    # Check if the file path has the expected structure
+    basenames = filenames.str.rsplit(os.sep, n=1).str[-1]
+    valid = (filenames.str.count(re.escape(os.sep)) >= 5) & (basenames.str.count(re.escape('.')) >= 6)
 
     # Log invalid files
-    if invalid_files:
+    invalid_files = filenames[~valid]
+    if not invalid_files.empty:
         logging.warning(f'{len(invalid_files)} invalid files found:')
         for invalid_file in invalid_files:
             logging.warning(f'Invalid file: {invalid_file}')
 
     # Process valid files
-    df_files = pd.DataFrame(valid_files, columns=['filename'])
+    df_files = pd.DataFrame({'filename': filenames[valid].to_numpy()})
     logging.info(f'Processing {len(df_files)} valid files.')
 
-    # Normalize file paths to use the correct separator for the platform
-    df_files['filename'] = df_files['filename'].apply(os.path.normpath)
-
     # Extract components from the filename
-    df_files['year'] = df_files['filename'].apply(lambda x: x.split(os.sep)[-5])
-    df_files['net'] = df_files['filename'].apply(lambda x: x.split(os.sep)[-4])
-    df_files['sta'] = df_files['filename'].apply(lambda x: x.split(os.sep)[-3])
-    df_files['cha'] = df_files['filename'].apply(lambda x: x.split(os.sep)[-2])
-    df_files['julian'] = df_files['filename'].apply(lambda x: x.split(os.sep)[-1].split('.')[6])
-
-    df_files['starttime'] = df_files['filename'].apply(
-        lambda x: x.split(os.sep)[-1].split('.')[7] if len(x.split(os.sep)[-1].split('.')) > 7 else '00'
-    )
+    path_parts = df_files['filename'].str.rsplit(os.sep, n=5, expand=True)
+    name_parts = df_files['filename'].str.rsplit(os.sep, n=1).str[-1].str.split('.', expand=True)
+    if df_files.empty:
+        path_parts = pd.DataFrame(columns=range(6), dtype=object)
+        name_parts = pd.DataFrame(columns=range(7), dtype=object)
+
+    df_files['year'] = path_parts[1]
+    df_files['net'] = path_parts[2]
+    df_files['sta'] = path_parts[3]
+    df_files['cha'] = path_parts[4]
+    df_files['julian'] = name_parts[6]
+    df_files['starttime'] = name_parts[7].fillna('00') if 7 in name_parts.columns else '00'
 
     # Convert to datetime
     df_files['starttime'] = pd.to_datetime(
@@ -156,6 +182,160 @@ def get_network_file_list(net: str, sta: str, sds_path: str) -> pd.DataFrame:
     )
 
     return df_files
+
+
+def get_network_file_list(net: str, sta: str, sds_path: str, catalog_path: str = None, cha: str = '*') -> pd.DataFrame:
+    """
+    Create the list of mseed files available for the network and station.
+
+    Parameters
+    ----------
+    net : str
+        The network code ("*" for all networks").
+    sta : str
+        The station name ("*" for all stations").
+    sds_path : str
+        Path to the SDS files.
+    catalog_path : str, optional
+        Path to the on-disk SDS catalog. When given, only the channel directories
+        modified since the last call are rescanned instead of globbing the whole archive.
+    cha : str
+        The channel code ("*" for all channels).
+
+    Returns
+    -------
+    pd.DataFrame
+        A pandas DataFrame with all the corresponding files and some details (and their size
+        and mtime when read from the catalog).
+    """
+    logging.info(f'Loading file list for network: {net}, station: {sta} from {sds_path}')
+    df_catalog = None
+    if catalog_path:
+        try:
+            df_catalog = refresh_catalog(catalog_path, sds_path, net, sta, cha)
+            file_list = df_catalog['filename'].tolist()
+        except Exception as e:
+            logging.error(f'Error reading the SDS catalog {catalog_path}: {e}')
+            catalog_path = None
+
+    if not catalog_path:
+        # Use os.path.join to create a platform-independent file pattern
+        file_pattern = os.path.join(sds_path, '*', net, sta, '*' if cha == '*' else f'{cha}.*', '*.*')
+        logging.info(f'Looking for files with pattern: {file_pattern}')
+        # Normalize file paths to use the correct separator for the platform
+        file_list = sorted(os.path.normpath(file) for file in glob.glob(file_pattern))
+    logging.info(f'Found {len(file_list)} files.')
+
+    df_files = parse_sds_filenames(file_list)
+    if df_catalog is not None and not df_files.empty:
+        df_files = df_files.merge(df_catalog[['filename', 'size', 'mtime']], on='filename', how='left')
+    return df_files
+
+
+def read_mseed_headers(filename: str) -> tuple:
+    """
+    Read the trace segments and gaps of a MiniSEED file from its record headers only
+    (no sample decoding).
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to index.
+
+    Returns
+    -------
+    segments : list of tuple
+        (network, station, location, channel, starttime, endtime, sampling_rate, npts) for each trace.
+    gaps : list of tuple
+        (channel, starttime, endtime) for each gap between two traces.
+    """
+    try:
+        stream = read(filename, headonly=True, format='MSEED')
+    except Exception as e:
+        logging.error(f"Error reading headers of {filename}: {e}")
+        return [], []
+
+    stream.sort()
+    segments = [(tr.stats.network, tr.stats.station, tr.stats.location, tr.stats.channel,
+                 tr.stats.starttime.timestamp, tr.stats.endtime.timestamp,
+                 tr.stats.sampling_rate, tr.stats.npts) for tr in stream]
+    gaps = [(gap[3], gap[4].timestamp, gap[5].timestamp) for gap in stream.get_gaps() if gap[6] > 0]
+    return segments, gaps
+
+
+AVAILABILITY_COLUMNS = ['data_starttime', 'data_endtime', 'sampling_rate', 'n_segments', 'n_gaps', 'coverage']
+
+
+def get_file_availability(df_files: pd.DataFrame, catalog_path: str, max_workers: int = None,
+                          index: bool = True) -> pd.DataFrame:
+    """
+    Add the data availability read from the MiniSEED headers to the file list.
+
+    Files not yet indexed (or modified since) are indexed first, in a process pool, unless
+    index is False: their availability is then left unknown.
+
+    Parameters
+    ----------
+    df_files : pd.DataFrame
+        A pandas DataFrame as returned by get_network_file_list (built from the catalog).
+    catalog_path : str
+        Path to the on-disk SDS catalog.
+    max_workers : int, optional
+        Number of processes used to index the files (default: number of CPUs).
+    index : bool
+        Whether to index the files not indexed yet (slow on a cold catalog).
+
+    Returns
+    -------
+    pd.DataFrame
+        df_files with the additional columns data_starttime, data_endtime, sampling_rate,
+        n_segments, n_gaps and coverage (fraction of the day covered by data, NaN when
+        the file is not in the catalog).
+    """
+    filenames = df_files['filename'].tolist()
+    unindexed_files = get_unindexed_files(catalog_path, filenames)
+    if unindexed_files and not index:
+        # The index of modified files is out of date
+        filenames = list(set(filenames).difference(unindexed_files))
+    elif unindexed_files:
+        logging.info(f'Indexing MiniSEED headers of {len(unindexed_files)} files.')
+        if len(unindexed_files) > 1:
+            with create_executor('process', max_workers or os.cpu_count()) as executor:
+                headers = dict(zip(unindexed_files, executor.map(read_mseed_headers, unindexed_files, chunksize=64)))
+        else:
+            headers = {filename: read_mseed_headers(filename) for filename in unindexed_files}
+        write_mseed_index(catalog_path, headers)
+
+    df_segments, df_gaps, indexed_files = read_mseed_index(catalog_path, filenames)
+
+    # Duration of data inside [day, day + 24h] for each segment
+    day_start = df_files.set_index('filename')['datetime'].astype('int64') / 1e9
+    seg_day = df_segments['filename'].map(day_start)
+    seg_start = np.maximum(df_segments['starttime'], seg_day)
+    seg_end = np.minimum(df_segments['endtime'] + 1 / df_segments['sampling_rate'], seg_day + 86400)
+    df_segments = df_segments.assign(duration=np.clip(seg_end - seg_start, 0, None))
+
+    availability = df_segments.groupby('filename').agg(
+        data_starttime=('starttime', 'min'),
+        data_endtime=('endtime', 'max'),
+        sampling_rate=('sampling_rate', 'first'),
+        n_segments=('starttime', 'size'),
+        duration=('duration', 'sum'),
+    )
+    availability['n_gaps'] = df_gaps.groupby('filename').size()
+    availability['coverage'] = np.clip(availability.pop('duration') / 86400, 0, 1)
+    availability['data_starttime'] = pd.to_datetime(availability['data_starttime'], unit='s')
+    availability['data_endtime'] = pd.to_datetime(availability['data_endtime'], unit='s')
+
+    # Replaces the availability of a previous call
+    df_files = df_files.drop(columns=AVAILABILITY_COLUMNS, errors='ignore').join(availability, on='filename')
+    df_files['n_segments'] = df_files['n_segments'].fillna(0).astype(int)
+    df_files['n_gaps'] = df_files['n_gaps'].fillna(0).astype(int)
+    # Indexed files without any segment are empty: no data for this day
+    df_files.loc[df_files['filename'].isin(indexed_files), 'coverage'] = df_files['coverage'].fillna(0.0)
+    return df_files
+
+
 # def get_network_file_list(net: str, sta: str, sds_path: str) -> pd.DataFrame:
 #     """
 #     Create the list of mseed files available for the network and station.
@@ -300,14 +480,8 @@ def get_stream_for_selected_file(filename: str, channel: str = None, day: str =
     Returns
     -------
     Stream
-        An ObsPy Stream containing the data.
+        An ObsPy Stream containing the data (float32, highpass-filtered at 1 Hz).
     """
-    def highpass_filter(data, cutoff, fs, order=4):
-        nyquist = 0.5 * fs
-        normal_cutoff = cutoff / nyquist
-        b, a = butter(order, normal_cutoff, btype='high', analog=False)
-        return filtfilt(b, a, data)
-    
     if '.flac' in filename:
         stream = read_flac_file(filename)
     else:
@@ -323,8 +497,9 @@ def get_stream_for_selected_file(filename: str, channel: str = None, day: str =
 
     try:
         for tr in stream:
-            tr.data = tr.data.astype(float)
-            tr.data = highpass_filter(tr.data, cutoff=1.0, fs=tr.stats.sampling_rate)
+            # One float32 copy at most, filtered in place
+            tr.data = np.require(tr.data, dtype=np.float32, requirements=['C', 'W'])
+            sosfiltfilt_inplace(get_butter_sos(4, 1.0, 'highpass', tr.stats.sampling_rate), tr.data)
         # stream = stream.merge()
         # stream.merge(method=1, fill_value=0)
     except Exception as e:
@@ -333,6 +508,43 @@ def get_stream_for_selected_file(filename: str, channel: str = None, day: str =
     return stream
 
 
+def get_stream_window(filename: str, starttime, endtime, channel: str = None, settling: float = 10.) -> Stream:
+    """
+    Create a stream containing the data of a file between starttime and endtime, decoding
+    only the records of this window (plus settling seconds on each side for the highpass
+    filter, see get_stream_for_selected_file).
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to read.
+    starttime, endtime : UTCDateTime
+        The time window.
+    channel : str, optional
+        The channel to select.
+    settling : float
+        The samples read and filtered before and after the window (seconds).
+
+    Returns
+    -------
+    Stream
+        An ObsPy Stream containing the data (float32, highpass-filtered at 1 Hz).
+    """
+    stream = read(filename, starttime=starttime - settling, endtime=endtime + settling)
+    if channel:
+        stream = stream.select(channel=channel)
+
+    for tr in stream:
+        tr.data = np.require(tr.data, dtype=np.float32, requirements=['C', 'W'])
+        try:
+            sosfiltfilt_inplace(get_butter_sos(4, 1.0, 'highpass', tr.stats.sampling_rate), tr.data)
+        except ValueError as e:
+            # Fewer samples than the padding of the filter
+            logging.error(f"Impossible to filter {tr.id} of {filename}: {e}")
+    stream.trim(starttime, endtime)
+    return stream
+
+
 def get_calibrated_stream(stream: Stream, df_stations: pd.DataFrame) -> Stream:
     """
     Calibrate the given stream using the sensitivity values from the station details DataFrame.
@@ -0,0 +1,266 @@
+import itertools
+import logging
+import numpy as np
+import pandas as pd
+from lib.whaleIciDetection import get_quefrency_prefix_sums, get_quefrency_region_mean, get_time_prefix_sums, get_rolling_mean
+
+
+def get_boundary_grid(peak_lows, peak_highs, valley_lows, valley_highs) -> list:
+    """
+    Return every (peak_boundaries, valley_boundaries) combination of the given values with
+    valley_low < peak_low < peak_high < valley_high.
+    """
+    return [([peak_low, peak_high], [valley_low, valley_high])
+            for peak_low, peak_high, valley_low, valley_high in itertools.product(peak_lows, peak_highs, valley_lows, valley_highs)
+            if valley_low < peak_low < peak_high < valley_high]
+
+
+def get_p2vr_grid(quefrency: np.ndarray, cepstrogram: np.ndarray, boundary_sets: list, window_sizes: list,
+                  prefix_sums: tuple = None) -> np.ndarray:
+    """
+    Compute the peak to valley ratio (see get_peak_to_valley_ratio) of a cepstrogram for a
+    whole grid of boundary sets and rolling windows.
+
+    The quefrency prefix sums are computed once, the region means of all the boundary sets
+    are obtained in one pass, and their cumulative sums over time are shared by all the
+    rolling windows.
+
+    Parameters
+    ----------
+    quefrency : np.ndarray
+        Array of quefrency values.
+    cepstrogram : np.ndarray
+        Cepstrogram data (quefrency x time).
+    boundary_sets : list
+        List of (peak_boundaries, valley_boundaries) pairs (see get_boundary_grid).
+    window_sizes : list of int
+        The rolling window sizes.
+    prefix_sums : tuple, optional
+        The output of get_quefrency_prefix_sums for this cepstrogram.
+
+    Returns
+    -------
+    np.ndarray
+        The peak to valley ratios (boundary sets x windows x time).
+    """
+    logging.info("Call function: get_p2vr_grid")
+    if prefix_sums is None:
+        prefix_sums = get_quefrency_prefix_sums(cepstrogram)
+
+    peak = np.array([peak_boundaries for peak_boundaries, _ in boundary_sets], dtype=float)
+    valley = np.array([valley_boundaries for _, valley_boundaries in boundary_sets], dtype=float)
+
+    peak_mean = get_time_prefix_sums(get_quefrency_region_mean(quefrency, prefix_sums, peak[:, 0], peak[:, 1]))
+    valley_low_mean = get_time_prefix_sums(get_quefrency_region_mean(quefrency, prefix_sums, valley[:, 0], peak[:, 0]))
+    valley_high_mean = get_time_prefix_sums(get_quefrency_region_mean(quefrency, prefix_sums, peak[:, 1], valley[:, 1]))
+
+    p2vr = np.empty((len(boundary_sets), len(window_sizes), peak_mean[0].shape[-1] - 1))
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for index, window_size in enumerate(window_sizes):
+            valley_smoothed = 0.5 * get_rolling_mean(None, window_size, valley_low_mean) + \
+                              0.5 * get_rolling_mean(None, window_size, valley_high_mean)
+            peak_smoothed = get_rolling_mean(None, window_size, peak_mean)
+            p2vr[:, index] = (peak_smoothed ** 3 / valley_smoothed ** 3) - 1
+    return p2vr
+
+
+def get_selection_intervals(selections: pd.DataFrame, station: str = None) -> pd.DataFrame:
+    """
+    Normalize the manual selections (bdd.csv, see ManualSelectionHandler.load_selections)
+    to a DataFrame with the columns start, end, qmin and qmax.
+
+    Parameters
+    ----------
+    selections : pd.DataFrame
+        The manual selections (columns sta, xmin, xmax, ymin, ymax).
+    station : str, optional
+        If given, only the selections of this station are kept.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    selections = selections.rename(columns={'datemin': 'xmin', 'datemax': 'xmax', 'quefmin': 'ymin', 'quefmax': 'ymax'})
+    if station is not None and 'sta' in selections.columns:
+        selections = selections[selections['sta'] == station]
+
+    xmin = pd.to_datetime(selections['xmin'])
+    xmax = pd.to_datetime(selections['xmax'])
+    ymin = selections['ymin'].astype(float)
+    ymax = selections['ymax'].astype(float)
+    return pd.DataFrame({
+        'start': np.minimum(xmin, xmax),
+        'end': np.maximum(xmin, xmax),
+        'qmin': np.minimum(ymin, ymax),
+        'qmax': np.maximum(ymin, ymax),
+    }).reset_index(drop=True)
+
+
+def get_selection_labels(tscale, intervals: pd.DataFrame, boundary_sets: list = None, bin_width=None) -> np.ndarray:
+    """
+    Label the time bins covered by a manual selection.
+
+    Parameters
+    ----------
+    tscale : array-like of datetime
+        The start time of the bins.
+    intervals : pd.DataFrame
+        The output of get_selection_intervals.
+    boundary_sets : list, optional
+        If given, a selection only labels a boundary set whose peak region overlaps its
+        quefrency range, and one row of labels is returned per boundary set.
+    bin_width : timedelta, optional
+        The width of the bins. If None, a bin is labelled when its start time is within a
+        selection, otherwise when it overlaps a selection.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean labels (time), or (boundary sets x time).
+    """
+    t = pd.to_datetime(pd.Series(tscale)).to_numpy(dtype='datetime64[ns]')
+    t_end = t if bin_width is None else t + pd.to_timedelta(bin_width).to_timedelta64()
+
+    start = intervals['start'].to_numpy(dtype='datetime64[ns]')
+    end = intervals['end'].to_numpy(dtype='datetime64[ns]')
+    if bin_width is None:
+        in_selection = (t >= start[:, np.newaxis]) & (t <= end[:, np.newaxis])
+    else:
+        in_selection = (t_end > start[:, np.newaxis]) & (t < end[:, np.newaxis])
+
+    if boundary_sets is None:
+        return in_selection.any(axis=0)
+
+    peak = np.array([peak_boundaries for peak_boundaries, _ in boundary_sets], dtype=float)
+    overlaps = (intervals['qmin'].to_numpy() < peak[:, 1, np.newaxis]) & (intervals['qmax'].to_numpy() > peak[:, 0, np.newaxis])
+    # (boundary sets x selections) @ (selections x time)
+    return (overlaps.astype(np.int64) @ in_selection.astype(np.int64)) > 0
+
+
+def score_p2vr_grid(p2vr: np.ndarray, labels: np.ndarray, boundary_sets: list, window_sizes: list, thresholds) -> pd.DataFrame:
+    """
+    Score every (boundary set, window, threshold) of a p2vr grid against the labels.
+
+    Parameters
+    ----------
+    p2vr : np.ndarray
+        The output of get_p2vr_grid (boundary sets x windows x time).
+    labels : np.ndarray
+        The output of get_selection_labels, (time) or (boundary sets x time).
+    boundary_sets : list
+        The boundary sets of the grid.
+    window_sizes : list of int
+        The rolling windows of the grid.
+    thresholds : array-like of float
+        The p2vr thresholds (a bin is detected when p2vr > threshold).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per grid point (config) and threshold, with the confusion counts, precision,
+        recall, false positive rate and F1 score (the ROC table).
+    """
+    logging.info("Call function: score_p2vr_grid")
+    thresholds = np.sort(np.asarray(thresholds, dtype=float))
+    labels = np.broadcast_to(np.asarray(labels, dtype=bool), (p2vr.shape[0], p2vr.shape[-1])).astype(np.int64)
+
+    n_boundaries, n_windows, n_thresholds = p2vr.shape[0], p2vr.shape[1], len(thresholds)
+    tp = np.empty((n_boundaries, n_windows, n_thresholds), dtype=np.int64)
+    fp = np.empty_like(tp)
+    n_positives = labels.sum(axis=1)
+    n_negatives = labels.shape[1] - n_positives
+
+    window_offsets = 2 * np.arange(n_windows)[:, np.newaxis]
+    for k in range(n_boundaries):
+        # Number of thresholds below each value (NaN bins are never detected): a value is
+        # detected at threshold j when this number is above j
+        above = np.searchsorted(thresholds, np.nan_to_num(p2vr[k], nan=-np.inf), side='left')
+        index = (window_offsets + labels[k]) * (n_thresholds + 1) + above
+        counts = np.bincount(index.ravel(), minlength=2 * n_windows * (n_thresholds + 1)).reshape(n_windows, 2, n_thresholds + 1)
+        detected = np.cumsum(counts[..., ::-1], axis=-1)[..., ::-1][..., 1:]
+        fp[k], tp[k] = detected[:, 0], detected[:, 1]
+
+    n_configs = n_boundaries * n_windows
+    peak_boundaries = np.empty(n_boundaries, dtype=object)
+    valley_boundaries = np.empty(n_boundaries, dtype=object)
+    for k, (peak, valley) in enumerate(boundary_sets):
+        peak_boundaries[k], valley_boundaries[k] = peak, valley
+
+    table = pd.DataFrame({
+        'config': np.repeat(np.arange(n_configs), n_thresholds),
+        'peak_boundaries': np.repeat(peak_boundaries, n_windows * n_thresholds),
+        'valley_boundaries': np.repeat(valley_boundaries, n_windows * n_thresholds),
+        'window_size': np.tile(np.repeat(window_sizes, n_thresholds), n_boundaries),
+        'threshold': np.tile(thresholds, n_configs),
+        'tp': tp.ravel(),
+        'fp': fp.ravel(),
+        'fn': (n_positives[:, np.newaxis, np.newaxis] - tp).ravel(),
+        'tn': (n_negatives[:, np.newaxis, np.newaxis] - fp).ravel(),
+    })
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['precision'] = table['tp'] / (table['tp'] + table['fp'])
+        table['recall'] = table['tp'] / (table['tp'] + table['fn'])
+        table['fpr'] = table['fp'] / (table['fp'] + table['tn'])
+        table['f1'] = 2 * table['precision'] * table['recall'] / (table['precision'] + table['recall'])
+    return table
+
+
+def summarize_p2vr_scores(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarize the ROC table of score_p2vr_grid per grid point (boundary set and window):
+    area under the ROC curve and threshold of best F1 score, sorted by decreasing AUC.
+    """
+    n_configs = table['config'].iloc[-1] + 1
+    n_thresholds = len(table) // n_configs
+
+    # ROC curves from (0, 0) (highest threshold) to (1, 1) (lowest threshold)
+    fpr = table['fpr'].fillna(0).to_numpy().reshape(n_configs, n_thresholds)[:, ::-1]
+    tpr = table['recall'].fillna(0).to_numpy().reshape(n_configs, n_thresholds)[:, ::-1]
+    fpr = np.hstack([np.zeros((n_configs, 1)), fpr, np.ones((n_configs, 1))])
+    tpr = np.hstack([np.zeros((n_configs, 1)), tpr, np.ones((n_configs, 1))])
+    auc = np.sum(np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2, axis=1)
+
+    f1 = table['f1'].fillna(-1).to_numpy().reshape(n_configs, n_thresholds)
+    best = np.arange(n_configs) * n_thresholds + np.argmax(f1, axis=1)
+
+    summary = table.iloc[best][['peak_boundaries', 'valley_boundaries', 'window_size', 'threshold', 'precision', 'recall', 'f1']]
+    summary = summary.rename(columns={'threshold': 'best_threshold'})
+    summary.insert(3, 'auc', auc)
+    return summary.sort_values('auc', ascending=False, ignore_index=True)
+
+
+def evaluate_p2vr_parameters(result: dict, selections: pd.DataFrame, boundary_sets: list, window_sizes: list, thresholds,
+                             station: str = None, match_quefrency: bool = True) -> tuple:
+    """
+    Compute and score a p2vr parameter grid on a stored detection result.
+
+    Parameters
+    ----------
+    result : dict
+        A detection result (tscale, q, cepstro and, optionally, metric).
+    selections : pd.DataFrame
+        The manual selections (see ManualSelectionHandler.load_selections).
+    boundary_sets : list
+        List of (peak_boundaries, valley_boundaries) pairs (see get_boundary_grid).
+    window_sizes : list of int
+        The rolling window sizes.
+    thresholds : array-like of float
+        The p2vr thresholds.
+    station : str, optional
+        The station of the result, to select its manual selections.
+    match_quefrency : bool
+        If True, a selection only counts for the boundary sets whose peak region overlaps it.
+
+    Returns
+    -------
+    table : pd.DataFrame
+        The ROC table (see score_p2vr_grid).
+    summary : pd.DataFrame
+        The summary per grid point (see summarize_p2vr_scores).
+    """
+    p2vr = get_p2vr_grid(result['q'], result['cepstro'], boundary_sets, window_sizes)
+    intervals = get_selection_intervals(selections, station)
+    labels = get_selection_labels(result['tscale'], intervals, boundary_sets if match_quefrency else None,
+                                  result.get('metric'))
+    table = score_p2vr_grid(p2vr, labels, boundary_sets, window_sizes, thresholds)
+    return table, summarize_p2vr_scores(table)
@@ -0,0 +1,154 @@
+import os
+import uuid
+import logging
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+
+BACKENDS = ['thread', 'process']
+DEFAULT_MEMORY_PER_WORKER = 1024**3  # bytes, a decoded day plus its STFT at 250 Hz
+
+
+def get_available_memory():
+    """
+    Return the available physical memory in bytes, or None if it cannot be determined.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_worker_count(max_workers: int = None, memory_per_worker: int = DEFAULT_MEMORY_PER_WORKER) -> int:
+    """
+    Return the number of workers to use.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The requested number of workers. If None or 0, it is sized from the number of
+        CPUs and the available memory.
+    memory_per_worker : int
+        Estimated peak memory of one worker in bytes.
+
+    Returns
+    -------
+    int
+        The number of workers (at least 1).
+    """
+    if max_workers:
+        return max(1, int(max_workers))
+
+    n_workers = os.cpu_count() or 1
+    available_memory = get_available_memory()
+    if available_memory:
+        n_workers = min(n_workers, int(available_memory // memory_per_worker))
+    return max(1, n_workers)
+
+
+def create_executor(backend: str = 'thread', max_workers: int = None) -> concurrent.futures.Executor:
+    """
+    Create the executor running the per-day jobs.
+
+    Parameters
+    ----------
+    backend : str
+        'thread' or 'process'. The process backend uses the 'spawn' start method so that
+        it is safe to use from a Qt application.
+    max_workers : int, optional
+        The number of workers (see get_worker_count).
+
+    Returns
+    -------
+    concurrent.futures.Executor
+    """
+    n_workers = get_worker_count(max_workers)
+    logging.info(f'Creating a {backend} executor with {n_workers} workers')
+    if backend == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+    return concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+
+
+def dump_array(array: np.ndarray, output_dir: str = None):
+    """
+    Store an array as a .npy file in output_dir and return its path, so that large results
+    are handed back from a worker process through a memory map instead of being pickled.
+    The array is returned unchanged when output_dir is None.
+    """
+    if output_dir is None:
+        return array
+    path = os.path.join(output_dir, f'{uuid.uuid4().hex}.npy')
+    np.save(path, array)
+    return path
+
+
+def load_array(array):
+    """
+    Return the array stored by dump_array as a read-only memory map (or the array itself).
+    """
+    if isinstance(array, str):
+        return np.load(array, mmap_mode='r')
+    return array
+
+
+def iter_results(executor: concurrent.futures.Executor, fn, jobs, max_in_flight: int,
+                 cancel_event=None, resume_event=None):
+    """
+    Run fn(*args) for each args of jobs on the executor and yield the results as they complete.
+
+    At most max_in_flight jobs are submitted at a time, so that pausing or cancelling takes
+    effect quickly and the memory of the pending jobs is released promptly.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        The executor running the jobs.
+    fn : callable
+        The (picklable, for the process backend) function to run.
+    jobs : iterable of tuple
+        The arguments of each job.
+    max_in_flight : int
+        The maximum number of submitted and not yet completed jobs.
+    cancel_event : threading.Event, optional
+        When set, no new job is submitted and the pending jobs are cancelled. The jobs
+        already running are waited for and their results are still yielded.
+    resume_event : threading.Event, optional
+        When cleared, no new job is submitted until it is set again.
+
+    Yields
+    ------
+    The result of each job (in completion order).
+    """
+    jobs = iter(jobs)
+    pending = set()
+    exhausted = False
+
+    while True:
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        paused = resume_event is not None and not resume_event.is_set()
+
+        if cancelled:
+            for future in pending:
+                future.cancel()
+            pending = {future for future in pending if not future.cancelled()}
+        elif not paused:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    args = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(fn, *args))
+
+        if not pending:
+            if cancelled or exhausted:
+                return
+            # Paused: wait until resumed or cancelled
+            resume_event.wait(0.2)
+            continue
+
+        done, pending = concurrent.futures.wait(pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
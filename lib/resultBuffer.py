@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+
+class CepstrogramBuffer:
+    """
+    Preallocated, time-ordered buffer of the binned cepstra of a detection run.
+
+    The time grid holds every bin of every processed day, so that the results of each
+    day can be inserted in place as soon as they are available, in any order, without
+    sorting and concatenating all the days at the end.
+    """
+
+    def __init__(self, days, metric: str):
+        """
+        Parameters
+        ----------
+        days : array-like of datetime
+            The processed days.
+        metric : str
+            The width of the bins (pandas frequency, e.g. '1H' or '5T').
+        """
+        delta = pd.to_timedelta(metric).to_timedelta64()
+        bins_per_day = int(np.timedelta64(24, 'h') / delta)
+        days = np.unique(pd.to_datetime(pd.Series(days)).dt.floor('D').to_numpy(dtype='datetime64[ns]'))
+        self.grid = np.unique((days[:, np.newaxis] + np.arange(bins_per_day) * delta).ravel())
+        self.filled = np.zeros(len(self.grid), dtype=bool)
+        self.q = None
+        self.cepstro = None
+
+    def insert(self, t, q: np.ndarray, c: np.ndarray) -> np.ndarray:
+        """
+        Insert the cepstra c (quefrency x time) of the bins t.
+
+        Returns
+        -------
+        np.ndarray
+            The positions of the bins in the buffer.
+        """
+        if self.cepstro is None:
+            self.q = np.asarray(q)
+            self.cepstro = np.full((len(self.q), len(self.grid)), np.nan, dtype=np.asarray(c).dtype)
+
+        t = pd.to_datetime(t).to_numpy(dtype='datetime64[ns]')
+        index = np.minimum(np.searchsorted(self.grid, t), len(self.grid) - 1)
+        # Bins outside of the grid are ignored
+        on_grid = self.grid[index] == t
+        index = index[on_grid]
+        self.cepstro[:, index] = np.asarray(c)[:, on_grid]
+        self.filled[index] = True
+        return index
+
+    def is_empty(self) -> bool:
+        return not self.filled.any()
+
+    def get_result(self) -> tuple:
+        """
+        Return the filled bins only.
+
+        Returns
+        -------
+        tscale : np.ndarray
+            The time of the bins (datetime64[ns]).
+        q : np.ndarray
+            Array of quefrency values.
+        cepstro : np.ndarray
+            The cepstra (quefrency x time).
+        """
+        return self.grid[self.filled], self.q, self.cepstro[:, self.filled]
@@ -0,0 +1,246 @@
+import os
+import json
+import shutil
+import logging
+import importlib
+import numpy as np
+import pandas as pd
+import xarray as xr
+from lib.checkpoint import CHECKPOINT_PARAMETERS, P2VR_PARAMETERS, PARAMETERS_FILENAME, get_parameters_hash
+
+
+STORE_FOLDER = 'cepstrograms'
+PARTITION_FREQUENCY = 'M'  # one file per month of bins
+PARTITION_FORMAT = '%Y-%m'
+COMPRESSION_LEVEL = 4
+# The parameters the stored cepstro, p2vr and positive depend on (one folder per hash)
+STORE_PARAMETERS = CHECKPOINT_PARAMETERS + P2VR_PARAMETERS + ['p2vr_threshold']
+
+
+def get_store_engine() -> str:
+    """
+    Return the storage engine of the cepstrograms: h5netcdf (a requirement), or else the
+    first installed engine writing compressed chunks (netcdf4, zarr). Without any of them,
+    scipy writes plain NetCDF3, neither chunked nor compressed, and a warning is logged.
+    """
+    for engine, module in (('h5netcdf', 'h5netcdf'), ('netcdf4', 'netCDF4'), ('zarr', 'zarr')):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        return engine
+    logging.warning("h5netcdf is not installed (see requirements.txt): the cepstrograms are stored as "
+                    "uncompressed NetCDF3 files")
+    return 'scipy'
+
+
+def get_partition_dir(store_root: str, channel_id: str, species: str, params: dict) -> str:
+    """
+    Return the folder of the month partitions of a channel (net.sta.cha) and species
+    computed with params: one sub-folder per hash of the STORE_PARAMETERS, so that the
+    results of other parameters are never merged nor overwritten.
+    """
+    return os.path.join(store_root, channel_id, str(species), get_parameters_hash(params, STORE_PARAMETERS))
+
+
+def get_stored_parameters(store_root: str, channel_id: str, species: str) -> dict:
+    """Return the parameters of the stored cepstrograms of a channel and species (hash -> parameters)."""
+    species_dir = os.path.join(store_root, channel_id, str(species))
+    stored_parameters = {}
+    for name in sorted(os.listdir(species_dir)) if os.path.isdir(species_dir) else []:
+        try:
+            with open(os.path.join(species_dir, name, PARAMETERS_FILENAME), 'r') as file:
+                stored_parameters[name] = json.load(file)
+        except (OSError, ValueError):
+            continue
+    return stored_parameters
+
+
+def get_partition_path(partition_dir: str, month, engine: str) -> str:
+    extension = '.zarr' if engine == 'zarr' else '.nc'
+    return os.path.join(partition_dir, pd.Timestamp(month).strftime(PARTITION_FORMAT) + extension)
+
+
+def get_result_parameters(result: dict) -> dict:
+    """Return the scalar parameters of a detection result (JSON serializable)."""
+    parameters = {}
+    for key, value in result.items():
+        if key in ('tscale', 'q', 'cepstro', 'p2vr', 'positive') or isinstance(value, (pd.DataFrame, pd.Series)):
+            continue
+        if isinstance(value, pd.Timestamp):
+            value = value.isoformat()
+        try:
+            parameters[key] = json.loads(json.dumps(np.asarray(value).tolist()))
+        except (TypeError, ValueError):
+            continue
+    return parameters
+
+
+def get_result_dataset(result: dict) -> xr.Dataset:
+    """
+    Return a detection result (tscale, q, cepstro, p2vr and positive) as a dataset with
+    the time and quefrency dimensions, the other parameters of the result being kept as a
+    JSON attribute.
+    """
+    time = pd.to_datetime(result['tscale']).to_numpy(dtype='datetime64[ns]')
+    q = np.asarray(result['q'])
+    n_bins = len(time)
+    p2vr = np.asarray(result['p2vr'], dtype=float) if result.get('p2vr') is not None else np.full(n_bins, np.nan)
+    positive = result.get('positive')
+    positive = np.asarray(positive, dtype='int8') if positive is not None else np.zeros(n_bins, dtype='int8')
+    return xr.Dataset(
+        {
+            'cepstro': (('quefrency', 'time'), np.asarray(result['cepstro'], dtype=np.float32)),
+            'p2vr': ('time', p2vr),
+            'positive': ('time', positive),
+        },
+        coords={'time': time, 'quefrency': q},
+        attrs={'parameters': json.dumps(get_result_parameters(result))},
+    )
+
+
+def get_dataset_result(dataset: xr.Dataset) -> dict:
+    """Return a stored dataset as a detection result dict (the reverse of get_result_dataset)."""
+    result = json.loads(dataset.attrs.get('parameters', '{}'))
+    result.update({
+        'tscale': dataset['time'].values,
+        'q': dataset['quefrency'].values,
+        'cepstro': dataset['cepstro'].values,
+        'p2vr': pd.Series(dataset['p2vr'].values),
+        'positive': dataset['positive'].values.astype(int),
+    })
+    return result
+
+
+def get_encoding(dataset: xr.Dataset, engine: str, metric: str = None) -> dict:
+    """Return the encoding of a partition: time chunks of one day of bins, compressed when supported."""
+    bins_per_day = int(pd.Timedelta(days=1) / pd.to_timedelta(metric)) if metric else 24
+    time_chunk = max(1, min(bins_per_day, dataset.sizes['time']))
+    encoding = {'time': {'units': 'seconds since 1970-01-01', 'dtype': 'float64'}}
+    for name, variable in dataset.data_vars.items():
+        chunks = tuple(time_chunk if dim == 'time' else dataset.sizes[dim] for dim in variable.dims)
+        if engine == 'zarr':
+            encoding[name] = {'chunks': chunks}
+        elif engine in ('netcdf4', 'h5netcdf'):
+            encoding[name] = {'zlib': True, 'complevel': COMPRESSION_LEVEL, 'chunksizes': chunks}
+    return encoding
+
+
+def open_partition(partition_path: str, engine: str) -> xr.Dataset:
+    """Open a month partition lazily (the arrays are only read when accessed)."""
+    if engine == 'zarr':
+        return xr.open_zarr(partition_path, chunks=None)
+    return xr.open_dataset(partition_path, engine=engine, chunks=None)
+
+
+def write_partition(dataset: xr.Dataset, partition_path: str, engine: str, metric: str = None):
+    """Write a month partition to a temporary path first, so that a crash never leaves a partial file behind."""
+    temporary_path = partition_path + '.tmp'
+    if os.path.isdir(temporary_path):
+        shutil.rmtree(temporary_path)
+    encoding = get_encoding(dataset, engine, metric)
+    if engine == 'zarr':
+        dataset.to_zarr(temporary_path, mode='w', encoding=encoding)
+        if os.path.isdir(partition_path):
+            shutil.rmtree(partition_path)
+        os.rename(temporary_path, partition_path)
+    else:
+        dataset.to_netcdf(temporary_path, engine=engine, encoding=encoding)
+        os.replace(temporary_path, partition_path)
+
+
+def save_cepstrogram(store_root: str, channel_id: str, species: str, result: dict, engine: str = None) -> list:
+    """
+    Store a detection result in the month partitions of its channel, species and parameters
+    (<store_root>/<net>.<sta>.<cha>/<species>/<parameters hash>/<YYYY-MM>.nc, or .zarr, the
+    parameters being written to the parameters.json file of the folder).
+
+    The bins are merged with the ones already stored in the months they cover (the new bins
+    replacing the stored ones at the same time), so that saving part of a period, or the new
+    bins of a watcher, leaves the rest of the stored cepstrogram untouched. A month stored
+    with other parameters or quefrencies is never merged: it is left as is and logged.
+
+    Returns
+    -------
+    list
+        The paths of the written partitions.
+    """
+    engine = engine or get_store_engine()
+    dataset = get_result_dataset(result)
+    if dataset.sizes['time'] == 0:
+        return []
+    parameters_hash = get_parameters_hash(result, STORE_PARAMETERS)
+    partition_dir = get_partition_dir(store_root, channel_id, species, result)
+    os.makedirs(partition_dir, exist_ok=True)
+    parameters_path = os.path.join(partition_dir, PARAMETERS_FILENAME)
+    if not os.path.exists(parameters_path):
+        with open(parameters_path, 'w') as file:
+            json.dump({key: np.asarray(result.get(key)).tolist() for key in STORE_PARAMETERS}, file, indent=4)
+
+    paths = []
+    months = pd.DatetimeIndex(dataset['time'].values).to_period(PARTITION_FREQUENCY)
+    for month in months.unique():
+        month_dataset = dataset.isel(time=np.flatnonzero(months == month))
+        partition_path = get_partition_path(partition_dir, month.start_time, engine)
+        if os.path.exists(partition_path):
+            try:
+                with open_partition(partition_path, engine) as stored:
+                    stored = stored.load()
+            except Exception as e:
+                logging.error(f"Error reading the stored cepstrogram {partition_path}, overwritten: {e}")
+            else:
+                parameters = json.loads(stored.attrs.get('parameters', '{}'))
+                if (get_parameters_hash(parameters, STORE_PARAMETERS) != parameters_hash or
+                        not np.array_equal(stored['quefrency'].values, month_dataset['quefrency'].values)):
+                    logging.error(f"The stored cepstrogram {partition_path} was computed with other parameters, "
+                                  f"not merged")
+                    continue
+                kept = ~np.isin(stored['time'].values, month_dataset['time'].values)
+                month_dataset = xr.concat([stored.isel(time=np.flatnonzero(kept)), month_dataset], dim='time',
+                                          combine_attrs='override').sortby('time')
+                parameters.update(json.loads(dataset.attrs['parameters']))
+                month_dataset.attrs = {'parameters': json.dumps(parameters)}
+        write_partition(month_dataset, partition_path, engine, result.get('metric'))
+        paths.append(partition_path)
+    logging.info(f"Cepstrogram saved to {partition_dir} ({len(paths)} months)")
+    return paths
+
+
+def open_cepstrogram(store_root: str, channel_id: str, species: str, params: dict, starttime=None, endtime=None,
+                     engine: str = None) -> xr.Dataset:
+    """
+    Open the stored cepstrogram of a channel and species computed with params (a detection
+    result, or one of get_stored_parameters) between starttime and endtime: only the month
+    partitions of the period are opened, and a single month is returned lazily.
+
+    Returns
+    -------
+    xr.Dataset
+        The cepstro, p2vr and positive variables over time (and quefrency), or None if no
+        bin is stored in the period.
+    """
+    engine = engine or get_store_engine()
+    partition_dir = get_partition_dir(store_root, channel_id, species, params)
+    first = pd.Timestamp(starttime).to_period(PARTITION_FREQUENCY) if starttime is not None else None
+    last = pd.Timestamp(endtime).to_period(PARTITION_FREQUENCY) if endtime is not None else None
+    extension = '.zarr' if engine == 'zarr' else '.nc'
+
+    datasets = []
+    for name in sorted(os.listdir(partition_dir)) if os.path.isdir(partition_dir) else []:
+        if not name.endswith(extension):
+            continue
+        try:
+            month = pd.Period(name[:-len(extension)], PARTITION_FREQUENCY)
+        except ValueError:
+            continue
+        if (first is not None and month < first) or (last is not None and month > last):
+            continue
+        try:
+            datasets.append(open_partition(os.path.join(partition_dir, name), engine))
+        except Exception as e:
+            logging.error(f"Error opening the stored cepstrogram {name}: {e}")
+    if not datasets:
+        return None
+
+    dataset = datasets[0] if len(datasets) == 1 else xr.concat(datasets, dim='time', combine_attrs='override')
+    return dataset.sel(time=slice(starttime, endtime))
@@ -0,0 +1,175 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+from lib.networkFuntions import get_stream_for_selected_file
+
+
+DEFAULT_CACHE_SIZE = 20 * 1024**3  # bytes
+_SAMPLES_FILE = 'samples.npy'
+_META_FILE = 'meta.json'
+
+
+def _get_entry_path(cache_dir: str, filename: str, channel: str = None, day: str = None) -> str:
+    """Return the cache folder of a (file, channel, day) entry."""
+    key = f'{os.path.abspath(filename)}|{channel}|{day}'
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def _load_entry(entry_path: str, filename: str):
+    """Return the cached stream of an entry, or None if it is missing or out of date."""
+    meta_path = os.path.join(entry_path, _META_FILE)
+    try:
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        stat = os.stat(filename)
+        if meta['mtime'] != stat.st_mtime or meta['size'] != stat.st_size:
+            return None
+        samples = np.load(os.path.join(entry_path, _SAMPLES_FILE), mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # LRU bookkeeping: the meta file mtime is the last access time of the entry
+    try:
+        os.utime(meta_path)
+    except OSError:
+        pass
+
+    stream = Stream()
+    for trace in meta['traces']:
+        header = dict(trace['stats'])
+        header['starttime'] = UTCDateTime(header['starttime'])
+        stream += Trace(data=samples[trace['offset']:trace['offset'] + trace['npts']], header=header)
+    return stream
+
+
+def _write_entry(entry_path: str, filename: str, stream: Stream):
+    """Store a stream as one float32 .npy file and its metadata, atomically."""
+    cache_dir = os.path.dirname(entry_path)
+    stat = os.stat(filename)
+    meta = {'filename': os.path.abspath(filename), 'mtime': stat.st_mtime, 'size': stat.st_size, 'traces': []}
+
+    offset = 0
+    for tr in stream:
+        meta['traces'].append({
+            'offset': offset,
+            'npts': int(tr.stats.npts),
+            'stats': {
+                'network': tr.stats.network,
+                'station': tr.stats.station,
+                'location': tr.stats.location,
+                'channel': tr.stats.channel,
+                'starttime': str(tr.stats.starttime),
+                'sampling_rate': tr.stats.sampling_rate,
+            }
+        })
+        offset += tr.stats.npts
+
+    tmp_path = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        samples = np.lib.format.open_memmap(os.path.join(tmp_path, _SAMPLES_FILE), mode='w+', dtype=np.float32, shape=(offset,))
+        for trace, tr in zip(meta['traces'], stream):
+            samples[trace['offset']:trace['offset'] + trace['npts']] = tr.data
+        samples.flush()
+        del samples
+        with open(os.path.join(tmp_path, _META_FILE), 'w') as file:
+            json.dump(meta, file)
+
+        shutil.rmtree(entry_path, ignore_errors=True)
+        os.replace(tmp_path, entry_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def enforce_cache_size(cache_dir: str, max_size: int = DEFAULT_CACHE_SIZE):
+    """
+    Remove the least recently used entries until the cache fits in max_size bytes.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache folder.
+    max_size : int
+        The maximum size of the cache in bytes.
+    """
+    entries = []
+    total_size = 0
+    for entry in os.scandir(cache_dir):
+        meta_path = os.path.join(entry.path, _META_FILE)
+        if not entry.is_dir() or not os.path.exists(meta_path):
+            continue
+        size = sum(f.stat().st_size for f in os.scandir(entry.path))
+        entries.append((os.stat(meta_path).st_mtime, size, entry.path))
+        total_size += size
+
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
+        logging.info(f'Sample cache: evicted {path}')
+
+
+def read_cached_stream(filename: str, cache_dir: str = None, channel: str = None, day: str = None) -> Stream:
+    """
+    Return the cached stream of a file (see get_cached_stream_for_selected_file), or None if
+    it is not in the cache. The file is never decoded.
+    """
+    if not cache_dir:
+        return None
+    return _load_entry(_get_entry_path(cache_dir, filename, channel, day), filename)
+
+
+def get_cached_stream_for_selected_file(filename: str, cache_dir: str = None, max_size: int = None,
+                                        channel: str = None, day: str = None) -> Stream:
+    """
+    Same as get_stream_for_selected_file, but the decoded and highpass-filtered samples are
+    kept in a local cache as memory-mapped float32 arrays, so that the MiniSEED decoding and
+    the filtering are skipped the next time the same file is processed.
+
+    Entries are invalidated when the mtime or size of the source file changes, and the least
+    recently used entries are evicted when the cache exceeds max_size.
+
+    Parameters
+    ----------
+    filename : str
+        The mseed file to read.
+    cache_dir : str, optional
+        The cache folder. If None, the file is read without cache.
+    max_size : int, optional
+        The maximum size of the cache in bytes (default DEFAULT_CACHE_SIZE).
+    channel : str, optional
+        The channel to select.
+    day : str, optional
+        The day to trim the stream to (in 'YYYY-MM-DD' format).
+
+    Returns
+    -------
+    Stream
+        An ObsPy Stream whose traces hold read-only float32 memory maps.
+    """
+    if not cache_dir:
+        return get_stream_for_selected_file(filename, channel, day)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_path = _get_entry_path(cache_dir, filename, channel, day)
+    stream = _load_entry(entry_path, filename)
+    if stream is not None:
+        logging.info(f'Sample cache hit: {filename}')
+        return stream
+
+    stream = get_stream_for_selected_file(filename, channel, day)
+    try:
+        _write_entry(entry_path, filename, stream)
+        enforce_cache_size(cache_dir, max_size or DEFAULT_CACHE_SIZE)
+        cached_stream = _load_entry(entry_path, filename)
+        if cached_stream is not None:
+            return cached_stream
+    except Exception as e:
+        logging.error(f'Sample cache - Error caching {filename}: {e}')
+    return stream
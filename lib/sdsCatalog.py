@@ -0,0 +1,376 @@
+import os
+import sqlite3
+import logging
+import fnmatch
+import pandas as pd
+
+
+CATALOG_FILENAME = 'sds_catalog.sqlite'
+_QUERY_CHUNK_SIZE = 500  # below the SQLite limit of query parameters
+
+STATION_COLUMNS = [
+    'net', 'net_start', 'net_end', 'sta', 'lon', 'lat', 'ele', 'cha', 'sample_rate', 'sensitivity', 'starttime', 'endtime'
+]
+STATION_DATE_COLUMNS = ['net_start', 'net_end', 'starttime', 'endtime']
+
+
+def open_catalog(catalog_path: str) -> sqlite3.Connection:
+    """
+    Open (and create if needed) the on-disk SDS catalog.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+
+    Returns
+    -------
+    sqlite3.Connection
+        An open connection on the catalog.
+    """
+    folder = os.path.dirname(catalog_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    connection = sqlite3.connect(catalog_path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            mtime REAL
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            filename TEXT PRIMARY KEY,
+            directory TEXT,
+            size INTEGER,
+            mtime REAL
+        );
+        CREATE INDEX IF NOT EXISTS files_directory ON files(directory);
+        CREATE TABLE IF NOT EXISTS inventory_files (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS inventory_stations (
+            path TEXT,
+            net TEXT, net_start TEXT, net_end TEXT, sta TEXT,
+            lon REAL, lat REAL, ele REAL, cha TEXT,
+            sample_rate REAL, sensitivity REAL, starttime TEXT, endtime TEXT
+        );
+        CREATE INDEX IF NOT EXISTS inventory_stations_path ON inventory_stations(path);
+        CREATE TABLE IF NOT EXISTS indexed_files (
+            filename TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS segments (
+            filename TEXT,
+            network TEXT, station TEXT, location TEXT, channel TEXT,
+            starttime REAL, endtime REAL, sampling_rate REAL, npts INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS segments_filename ON segments(filename);
+        CREATE TABLE IF NOT EXISTS gaps (
+            filename TEXT,
+            channel TEXT,
+            starttime REAL, endtime REAL
+        );
+        CREATE INDEX IF NOT EXISTS gaps_filename ON gaps(filename);
+    """)
+    return connection
+
+
+def list_channel_directories(sds_path: str, net: str = '*', sta: str = '*', cha: str = '*') -> dict:
+    """
+    List the <YEAR>/<NET>/<STA>/<CHAN>.D directories of the SDS archive with their mtime.
+
+    Only directories are visited, so this stays cheap even on archives holding
+    hundreds of thousands of day files.
+
+    Parameters
+    ----------
+    sds_path : str
+        Path to the SDS root folder.
+    net : str
+        The network code (wildcards allowed).
+    sta : str
+        The station name (wildcards allowed).
+    cha : str
+        The channel code (wildcards allowed).
+
+    Returns
+    -------
+    dict
+        Mapping {normalized directory path: mtime}.
+    """
+    def subdirectories(path, pattern='*'):
+        try:
+            with os.scandir(path) as entries:
+                return [e for e in entries
+                        if e.is_dir() and not e.name.startswith('.') and fnmatch.fnmatchcase(e.name, pattern)]
+        except OSError as e:
+            logging.warning(f'Impossible to list {path}: {e}')
+            return []
+
+    directories = {}
+    for year in subdirectories(sds_path):
+        for network in subdirectories(year.path, net):
+            for station in subdirectories(network.path, sta):
+                for channel in subdirectories(station.path, '*' if cha == '*' else f'{cha}.*'):
+                    directories[os.path.normpath(channel.path)] = channel.stat().st_mtime
+    return directories
+
+
+def _scan_directory(directory: str) -> list:
+    """Return the (filename, directory, size, mtime) rows of the files found in a channel directory."""
+    rows = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Same selection as the glob pattern '*.*' used by get_network_file_list
+                if entry.name.startswith('.') or '.' not in entry.name or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                rows.append((os.path.normpath(entry.path), directory, stat.st_size, stat.st_mtime))
+    except OSError as e:
+        logging.warning(f'Impossible to scan {directory}: {e}')
+    return rows
+
+
+def refresh_catalog(catalog_path: str, sds_path: str, net: str = '*', sta: str = '*', cha: str = '*') -> pd.DataFrame:
+    """
+    Bring the catalog up to date with the SDS archive and return the matching files.
+
+    A channel directory is rescanned only when its mtime differs from the one stored
+    in the catalog (i.e. a file was added, removed or renamed in it). Directories that
+    disappeared from the archive are purged from the catalog.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+    sds_path : str
+        Path to the SDS root folder.
+    net : str
+        The network code ("*" for all networks).
+    sta : str
+        The station name ("*" for all stations).
+    cha : str
+        The channel code ("*" for all channels).
+
+    Returns
+    -------
+    pd.DataFrame
+        A pandas DataFrame with the columns filename, directory, size and mtime, sorted by filename.
+    """
+    directories = list_channel_directories(sds_path, net, sta, cha)
+
+    connection = open_catalog(catalog_path)
+    try:
+        stored = dict(connection.execute('SELECT path, mtime FROM directories').fetchall())
+
+        # Stored directories belonging to the requested scope which no longer exist
+        sds_root = os.path.normpath(sds_path)
+        removed = []
+        for path in stored:
+            parts = os.path.relpath(path, sds_root).split(os.sep)
+            if len(parts) == 4 and not parts[0].startswith('..') and path not in directories \
+                    and fnmatch.fnmatchcase(parts[1], net) and fnmatch.fnmatchcase(parts[2], sta) \
+                    and (cha == '*' or fnmatch.fnmatchcase(parts[3], f'{cha}.*')):
+                removed.append(path)
+
+        changed = [path for path, mtime in directories.items() if stored.get(path) != mtime]
+        logging.info(f'SDS catalog: {len(directories)} directories, {len(changed)} to rescan, {len(removed)} removed.')
+
+        with connection:
+            for path in removed + changed:
+                connection.execute('DELETE FROM files WHERE directory = ?', (path,))
+                connection.execute('DELETE FROM directories WHERE path = ?', (path,))
+            for path in changed:
+                connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', _scan_directory(path))
+                connection.execute('INSERT OR REPLACE INTO directories VALUES (?, ?)', (path, directories[path]))
+
+        # Only the files of the requested directories are read (by index)
+        paths = list(directories)
+        df_files = [pd.read_sql_query(
+            f'SELECT filename, directory, size, mtime FROM files WHERE directory IN ({", ".join("?" * len(chunk))})',
+            connection, params=chunk) for chunk in (paths[i:i + _QUERY_CHUNK_SIZE]
+                                                    for i in range(0, len(paths), _QUERY_CHUNK_SIZE))]
+    finally:
+        connection.close()
+
+    df_files = pd.concat(df_files, ignore_index=True) if df_files else \
+        pd.DataFrame(columns=['filename', 'directory', 'size', 'mtime'])
+    return df_files.sort_values('filename').reset_index(drop=True)
+
+
+def read_inventory_cache(catalog_path: str, xml_files: list) -> tuple:
+    """
+    Return the cached station rows of the StationXML files that did not change.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+    xml_files : list of str
+        The StationXML files to load.
+
+    Returns
+    -------
+    df_stations : pd.DataFrame
+        The cached rows (STATION_COLUMNS) of the up-to-date files.
+    stale_files : list of str
+        The files missing from the cache or whose mtime/size changed.
+    """
+    connection = open_catalog(catalog_path)
+    try:
+        stored = {path: (mtime, size) for path, mtime, size in
+                  connection.execute('SELECT path, mtime, size FROM inventory_files').fetchall()}
+        up_to_date, stale_files = [], []
+        for xml_file in xml_files:
+            stat = os.stat(xml_file)
+            if stored.get(xml_file) == (stat.st_mtime, stat.st_size):
+                up_to_date.append(xml_file)
+            else:
+                stale_files.append(xml_file)
+
+        df_stations = pd.read_sql_query(f'SELECT {", ".join(STATION_COLUMNS)}, path FROM inventory_stations', connection)
+    finally:
+        connection.close()
+
+    df_stations = df_stations[df_stations['path'].isin(up_to_date)].drop(columns='path')
+    for column in STATION_DATE_COLUMNS:
+        df_stations[column] = pd.to_datetime(df_stations[column], errors='coerce')
+    return df_stations.reset_index(drop=True), stale_files
+
+
+def write_inventory_cache(catalog_path: str, xml_file: str, rows: list):
+    """
+    Replace the cached station rows of a StationXML file.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+    xml_file : str
+        The parsed StationXML file.
+    rows : list
+        The flattened rows (STATION_COLUMNS) of the file.
+    """
+    date_indices = [STATION_COLUMNS.index(column) for column in STATION_DATE_COLUMNS]
+    records = []
+    for row in rows:
+        row = list(row)
+        for i in date_indices:
+            row[i] = row[i].isoformat() if row[i] is not None else None
+        records.append([xml_file] + row)
+
+    stat = os.stat(xml_file)
+    connection = open_catalog(catalog_path)
+    try:
+        with connection:
+            connection.execute('DELETE FROM inventory_stations WHERE path = ?', (xml_file,))
+            connection.executemany(
+                f'INSERT INTO inventory_stations (path, {", ".join(STATION_COLUMNS)}) VALUES ({", ".join("?" * (len(STATION_COLUMNS) + 1))})',
+                records
+            )
+            connection.execute('INSERT OR REPLACE INTO inventory_files VALUES (?, ?, ?)', (xml_file, stat.st_mtime, stat.st_size))
+    finally:
+        connection.close()
+
+
+def _create_selection(connection: sqlite3.Connection, filenames: list):
+    """Store filenames in the temporary table selection, so that queries only read their rows (by index)."""
+    connection.execute('CREATE TEMP TABLE IF NOT EXISTS selection (filename TEXT PRIMARY KEY)')
+    connection.execute('DELETE FROM selection')
+    connection.executemany('INSERT OR IGNORE INTO selection VALUES (?)', ((filename,) for filename in filenames))
+
+
+def get_unindexed_files(catalog_path: str, filenames: list) -> list:
+    """
+    Return the files whose MiniSEED headers were never indexed or changed since.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+    filenames : list of str
+        The files to check (as stored in the catalog by refresh_catalog).
+
+    Returns
+    -------
+    list of str
+        The files to (re)index.
+    """
+    connection = open_catalog(catalog_path)
+    try:
+        _create_selection(connection, filenames)
+        df_files = pd.read_sql_query("""
+            SELECT f.filename FROM selection s JOIN files f ON f.filename = s.filename
+            LEFT JOIN indexed_files i ON f.filename = i.filename
+            WHERE i.filename IS NULL OR i.mtime != f.mtime OR i.size != f.size
+        """, connection)
+    finally:
+        connection.close()
+    return df_files['filename'].tolist()
+
+
+def write_mseed_index(catalog_path: str, headers: dict):
+    """
+    Store the trace segments and gaps read from the MiniSEED headers.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+    headers : dict
+        Mapping {filename: (segments, gaps)} as returned by read_mseed_headers.
+    """
+    connection = open_catalog(catalog_path)
+    try:
+        with connection:
+            for filename, (segments, gaps) in headers.items():
+                stat = connection.execute('SELECT mtime, size FROM files WHERE filename = ?', (filename,)).fetchone()
+                connection.execute('DELETE FROM segments WHERE filename = ?', (filename,))
+                connection.execute('DELETE FROM gaps WHERE filename = ?', (filename,))
+                connection.executemany('INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                       [(filename,) + tuple(segment) for segment in segments])
+                connection.executemany('INSERT INTO gaps VALUES (?, ?, ?, ?)',
+                                       [(filename,) + tuple(gap) for gap in gaps])
+                if stat is not None:
+                    connection.execute('INSERT OR REPLACE INTO indexed_files VALUES (?, ?, ?)', (filename,) + tuple(stat))
+    finally:
+        connection.close()
+
+
+def read_mseed_index(catalog_path: str, filenames: list) -> tuple:
+    """
+    Load the indexed trace segments and gaps of the given files.
+
+    Parameters
+    ----------
+    catalog_path : str
+        Path to the SQLite catalog file.
+    filenames : list of str
+        The files to load.
+
+    Returns
+    -------
+    df_segments : pd.DataFrame
+        One row per trace segment (filename, network, station, location, channel,
+        starttime, endtime, sampling_rate, npts), times in epoch seconds.
+    df_gaps : pd.DataFrame
+        One row per gap (filename, channel, starttime, endtime), times in epoch seconds.
+    indexed_files : list of str
+        The files of the selection which are indexed (possibly without any segment).
+    """
+    connection = open_catalog(catalog_path)
+    try:
+        # Only the rows of the selected files are read (by index)
+        _create_selection(connection, filenames)
+        df_segments = pd.read_sql_query('SELECT t.* FROM selection s JOIN segments t ON t.filename = s.filename',
+                                        connection)
+        df_gaps = pd.read_sql_query('SELECT t.* FROM selection s JOIN gaps t ON t.filename = s.filename', connection)
+        df_indexed = pd.read_sql_query('SELECT i.filename FROM selection s JOIN indexed_files i ON i.filename = s.filename',
+                                       connection)
+    finally:
+        connection.close()
+    return df_segments, df_gaps, df_indexed['filename'].tolist()
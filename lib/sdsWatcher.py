@@ -0,0 +1,360 @@
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from lib.networkFuntions import get_network_file_list, read_mseed_headers
+from lib.dayProcessing import (
+    process_detection_day, get_day_neighbors, get_frame_margin, get_positive_detection, run_p2vr_detection,
+    extend_p2vr_detection, update_p2vr_detection
+)
+from lib.checkpoint import (
+    get_checkpoint_dir, get_day_source, load_manifest, save_day_shard, load_day_shard, save_result, load_result
+)
+
+
+DEFAULT_POLL_INTERVAL = 60.  # seconds between two polls of the SDS archive
+MIN_CAPACITY = 256  # bins allocated for the cepstrogram at first
+
+
+def get_data_end(filenames: list) -> tuple:
+    """
+    Return the end of the data of files (POSIX timestamp) and their sampling rate, from the
+    record headers (no sample decoding), or (None, None) if there is no data.
+    """
+    data_end, sampling_rate = None, None
+    for filename in filenames:
+        if not filename:
+            continue
+        segments, _ = read_mseed_headers(filename)
+        for segment in segments:
+            if data_end is None or segment[5] > data_end:
+                data_end, sampling_rate = segment[5], segment[6]
+    return data_end, sampling_rate
+
+
+class SdsWatcher:
+    """
+    Near-real-time ICI detection on a channel of a growing SDS archive.
+
+    Each poll lists the day files of the channel (through the SDS catalog, so that only the
+    modified channel directories are rescanned), and for the new or grown files computes the
+    bins of params['metric'] completed since the previous poll: only the records of these bins
+    plus the filter and half-frame margins are decoded (see lib.dayProcessing.get_day_window),
+    on the frame grid of the day, so that the work of a poll is bounded by the new data. The
+    bins are written after the last ones of the cepstrogram (preallocated, see reserve) and
+    the peak to valley ratio is only computed for them (see extend_p2vr_detection); bins
+    inserted before the last ones are merged with the whole cepstrogram.
+
+    The catalog does not see the files appended in place (their directory is not modified),
+    so the files of the days not completed yet and of the last two days are stat'ed on every
+    poll. The completed days are not checked again: rewritten ones are left to the batch
+    detections.
+
+    With params['checkpoint_dir'], the cepstra of the days are stored in the per-day shards of
+    lib.checkpoint (the partial days with their window), so that a restarted watcher resumes
+    from the stored cepstrogram, and the batch detections reuse the completed days.
+    """
+
+    def __init__(self, sds_path: str, net: str, sta: str, cha: str, params: dict, metric: str = '1H',
+                 catalog_path: str = None, starttime=None, endtime=None):
+        """
+        Parameters
+        ----------
+        sds_path : str
+            The root of the SDS archive.
+        net, sta, cha : str
+            The channel to watch.
+        params : dict
+            The detection parameters and the processing options (see
+            lib.batchProcessing.get_processing_options).
+        metric : str
+            The width of the time bins of the cepstrogram.
+        catalog_path : str, optional
+            The SDS catalog (see lib.sdsCatalog).
+        starttime, endtime : datetime, optional
+            The watched period (unbounded if None).
+        """
+        self.sds_path = sds_path
+        self.net, self.sta, self.cha = net, sta, cha
+        self.catalog_path = catalog_path
+        self.starttime = pd.Timestamp(starttime) if starttime is not None else None
+        self.endtime = pd.Timestamp(endtime) if endtime is not None else None
+        self.metric = metric
+        self.delta = pd.to_timedelta(metric)
+        self.params = {key: value for key, value in params.items() if not isinstance(value, pd.DataFrame)}
+        self.params['metric'] = metric
+
+        # (size, mtime) of the files at the last poll, and end of the bins computed for each day
+        self.files = {}
+        self.processed_until = {}
+
+        # The cepstrogram is held in the first n_bins bins of the buffers
+        self.n_bins = 0
+        self.q = None
+        self._tscale = np.empty(0, dtype='datetime64[ns]')
+        self._cepstro = None
+        self._p2vr = np.empty(0)
+
+        self.checkpoint_dir = None
+        if params.get('checkpoint_dir'):
+            self.checkpoint_dir = get_checkpoint_dir(params['checkpoint_dir'], f'{net}.{sta}.{cha}', self.params)
+            self.restore()
+
+    def restore(self):
+        """Reload the days stored in the checkpoint folder (see lib.checkpoint)."""
+        days = []
+        for day_key, entry in sorted(load_manifest(self.checkpoint_dir).items()):
+            day = pd.Timestamp(day_key)
+            if entry.get('window') is None or not os.path.exists(entry['filename']):
+                continue
+            window_start, window_end = (pd.Timestamp(value) for value in entry['window'])
+            if window_start != self.get_day_start(day):
+                continue
+            shard = load_day_shard(self.checkpoint_dir, day)
+            if shard is None:
+                continue
+            days.append(shard)
+            self.processed_until[day] = window_end
+        if days:
+            self.insert(days)
+            # The stored p2vr may be older than the shards (it is saved when a day is completed)
+            previous_result = load_result(self.checkpoint_dir, self.params)
+            if previous_result is not None:
+                p2vr, _ = update_p2vr_detection(self.tscale, self.q, self.cepstro, self.params, previous_result[0],
+                                                previous_result[1], np.zeros(self.n_bins, dtype=bool))
+            else:
+                p2vr, _ = run_p2vr_detection(self.q, self.cepstro, self.params)
+            self._p2vr[:self.n_bins] = np.asarray(p2vr)
+            logging.info(f'Watcher {self.net}.{self.sta}.{self.cha}: {len(days)} days restored from {self.checkpoint_dir}')
+
+    @property
+    def tscale(self) -> np.ndarray:
+        return self._tscale[:self.n_bins]
+
+    @property
+    def cepstro(self) -> np.ndarray:
+        return self._cepstro[:, :self.n_bins] if self._cepstro is not None else None
+
+    @property
+    def p2vr(self) -> np.ndarray:
+        return self._p2vr[:self.n_bins]
+
+    def get_day_start(self, day) -> pd.Timestamp:
+        day = pd.Timestamp(day).floor('D')
+        return max(day, self.starttime) if self.starttime is not None else day
+
+    def get_day_end(self, day) -> pd.Timestamp:
+        day_end = pd.Timestamp(day).floor('D') + pd.Timedelta(days=1)
+        return min(day_end, self.endtime) if self.endtime is not None else day_end
+
+    def is_day_completed(self, day) -> bool:
+        """Return True if all the bins of a day are computed."""
+        processed_until = self.processed_until.get(pd.Timestamp(day).floor('D'))
+        return processed_until is not None and processed_until >= self.get_day_end(day)
+
+    def get_files(self) -> pd.DataFrame:
+        """Return the day files of the watched channel and period, with their size and mtime."""
+        files_df = get_network_file_list(self.net, self.sta, self.sds_path, self.catalog_path, self.cha)
+        if files_df.empty:
+            return files_df
+        files_df['cha'] = files_df['cha'].str.split('.').str[0]
+        files_df = files_df[files_df['cha'] == self.cha]
+        days = pd.to_datetime(files_df['datetime'])
+        if self.starttime is not None:
+            files_df = files_df[days + pd.Timedelta(days=1) > self.starttime]
+        if self.endtime is not None:
+            files_df = files_df[pd.to_datetime(files_df['datetime']) < self.endtime]
+        files_df = files_df.sort_values('datetime').reset_index(drop=True)
+        if files_df.empty:
+            return files_df
+
+        # The size and mtime of the catalog are only refreshed with their directory
+        recent_days = pd.to_datetime(files_df['datetime']).max().floor('D') - pd.Timedelta(days=1)
+        states = []
+        for row in files_df.itertuples():
+            day = pd.Timestamp(row.datetime).floor('D')
+            if row.filename in self.files and day < recent_days and self.is_day_completed(day):
+                states.append(self.files[row.filename])
+                continue
+            try:
+                stat = os.stat(row.filename)
+                states.append((stat.st_size, stat.st_mtime))
+            except OSError:
+                states.append((np.nan, np.nan))
+        files_df['size'] = [state[0] for state in states]
+        files_df['mtime'] = [state[1] for state in states]
+        return files_df
+
+    def get_bins_end(self, day, data_end: float, sampling_rate: float) -> pd.Timestamp:
+        """Return the end of the last bin of a day whose frames can all be computed from the data."""
+        margin = get_frame_margin(self.params['fftsize'], self.params['filter_boundaries'], sampling_rate)
+        end = pd.Timestamp(data_end - margin, unit='s').floor(self.delta)
+        return min(end, self.get_day_end(day))
+
+    def reserve(self, n_bins: int, c: np.ndarray):
+        """Make room for n_bins bins in the buffers (their size is doubled when full)."""
+        if self._cepstro is not None and self._cepstro.shape[1] >= n_bins:
+            return
+        capacity = max(n_bins, 2 * len(self._tscale), MIN_CAPACITY)
+        tscale = np.empty(capacity, dtype='datetime64[ns]')
+        cepstro = np.empty((c.shape[0], capacity), dtype=c.dtype)
+        p2vr = np.empty(capacity)
+        tscale[:self.n_bins] = self.tscale
+        if self._cepstro is not None:
+            cepstro[:, :self.n_bins] = self.cepstro
+        p2vr[:self.n_bins] = self.p2vr
+        self._tscale, self._cepstro, self._p2vr = tscale, cepstro, p2vr
+
+    def insert(self, days: list) -> tuple:
+        """
+        Insert the bins (t, q, c) of days in the cepstrogram.
+
+        Returns
+        -------
+        index : np.ndarray
+            The positions of the inserted bins in the cepstrogram.
+        appended : bool
+            True if the bins were written after the last ones, False if they were merged
+            with the cepstrogram (the bins before them may have moved).
+        """
+        if self.q is None:
+            self.q = np.asarray(days[0][1])
+        t = np.concatenate([pd.to_datetime(day[0]).to_numpy(dtype='datetime64[ns]') for day in days])
+        c = np.concatenate([np.asarray(day[2]) for day in days], axis=1)
+        # Sorted, the bins computed last replacing the previous ones at the same time
+        order = np.argsort(t, kind='stable')
+        t, c = t[order], c[:, order]
+        last = np.r_[t[1:] != t[:-1], True]
+        t, c = t[last], c[:, last]
+
+        first = self.n_bins
+        if first == 0 or t[0] > self.tscale[-1]:
+            self.reserve(first + len(t), c)
+            self._tscale[first:first + len(t)] = t
+            self._cepstro[:, first:first + len(t)] = c
+            self.n_bins += len(t)
+            return np.arange(first, self.n_bins), True
+
+        t = np.concatenate([self.tscale, t])
+        c = np.concatenate([self.cepstro, c], axis=1)
+        inserted = np.r_[np.zeros(first, dtype=bool), np.ones(len(t) - first, dtype=bool)]
+        order = np.lexsort((~inserted, t))
+        t, c, inserted = t[order], c[:, order], inserted[order]
+        unique = np.r_[True, t[1:] != t[:-1]]
+        t, c, inserted = t[unique], c[:, unique], inserted[unique]
+
+        # New buffers: the previous cepstrogram is still needed by update_p2vr_detection
+        self._tscale, self._cepstro, self._p2vr = t, c, np.full(len(t), np.nan)
+        self.n_bins = len(t)
+        return np.flatnonzero(inserted), False
+
+    def poll(self) -> dict:
+        """
+        Process the data appended since the previous poll.
+
+        Returns
+        -------
+        dict
+            The new bins (tscale, q, cepstro, p2vr, positive), or None if there are none.
+        """
+        files_df = self.get_files()
+        if files_df.empty:
+            return None
+        neighbors = dict(zip(files_df['filename'], get_day_neighbors(files_df)))
+        changed_files = {row.filename for row in files_df.itertuples()
+                         if self.files.get(row.filename) != (row.size, row.mtime)}
+        self.files = {row.filename: (row.size, row.mtime) for row in files_df.itertuples()}
+
+        days = []
+        completed = False
+        for row in files_df.itertuples():
+            day = pd.Timestamp(row.datetime).floor('D')
+            previous_file, next_file = neighbors[row.filename]
+            # The last bins of a day are completed by the samples of the next day
+            if row.filename not in changed_files and next_file not in changed_files:
+                continue
+            start = self.processed_until.get(day, self.get_day_start(day))
+            data_end, sampling_rate = get_data_end([row.filename, next_file])
+            if data_end is None:
+                continue
+            end = self.get_bins_end(day, data_end, sampling_rate)
+            if end <= start:
+                continue
+
+            job_params = dict(self.params, starttime=start, endtime=end)
+            result = process_detection_day(row.filename, day, job_params, None, (previous_file, next_file))
+            self.processed_until[day] = end
+            completed |= self.is_day_completed(day)
+            if result is None:
+                continue
+            days.append(result)
+
+            if self.checkpoint_dir:
+                # The shard of a day holds all its bins computed so far
+                t, q, c = result
+                stored = load_day_shard(self.checkpoint_dir, day) if start > self.get_day_start(day) else None
+                if stored is not None:
+                    t = np.concatenate([stored[0], pd.to_datetime(t).to_numpy(dtype='datetime64[ns]')])
+                    c = np.concatenate([stored[2], c], axis=1)
+                source = get_day_source(row.filename, (self.get_day_start(day), end), (previous_file, next_file))
+                save_day_shard(self.checkpoint_dir, day, source, t, q, c)
+
+        if not days:
+            return None
+
+        previous_tscale, previous_p2vr = self.tscale, self.p2vr
+        index, appended = self.insert(days)
+        if appended:
+            p2vr, positive_detection = extend_p2vr_detection(self.q, self.cepstro, self.params, index[0])
+            self._p2vr[index] = p2vr
+        else:
+            inserted = np.zeros(self.n_bins, dtype=bool)
+            inserted[index] = True
+            p2vr, positive_detection = update_p2vr_detection(self.tscale, self.q, self.cepstro, self.params,
+                                                             previous_tscale, previous_p2vr, inserted)
+            self._p2vr[:self.n_bins] = np.asarray(p2vr)
+            positive_detection = positive_detection[index]
+        # Saved once per completed day only: a restarted watcher recomputes the p2vr of the
+        # bins added since (see restore)
+        if self.checkpoint_dir and (completed or not appended):
+            save_result(self.checkpoint_dir, self.params, self.tscale, self.p2vr)
+
+        logging.info(f'Watcher {self.net}.{self.sta}.{self.cha}: {len(index)} new bins')
+        return {
+            'tscale': self.tscale[index],
+            'q': self.q,
+            'cepstro': self.cepstro[:, index],
+            'p2vr': self.p2vr[index],
+            'positive': positive_detection,
+        }
+
+    def get_result(self) -> dict:
+        """Return the whole cepstrogram and its detections (same keys as poll)."""
+        return {
+            'tscale': self.tscale,
+            'q': self.q,
+            'cepstro': self.cepstro,
+            'p2vr': self.p2vr,
+            'positive': get_positive_detection(self.p2vr, self.params['p2vr_threshold']),
+        }
+
+    def run(self, interval: float = DEFAULT_POLL_INTERVAL, on_update=None, stop_event=None):
+        """
+        Poll the archive every interval seconds until stop_event is set, calling on_update
+        with the new bins of each poll (see poll).
+        """
+        while stop_event is None or not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                update = self.poll()
+            except Exception as e:
+                logging.error(f'Watcher {self.net}.{self.sta}.{self.cha}: error processing the new data: {e}')
+                update = None
+            if update is not None and on_update is not None:
+                on_update(update)
+            remaining = interval - (time.monotonic() - started)
+            if stop_event is not None:
+                stop_event.wait(max(0., remaining))
+            elif remaining > 0:
+                time.sleep(remaining)
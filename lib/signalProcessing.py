@@ -1,7 +1,11 @@
 import numpy as np
 import scipy.signal as sp
+import scipy.fft
+from lib.fftBackend import get_stft_window, rfft, irfft
+from lib.filterBank import get_butter_sos, sosfiltfilt_inplace
 import pandas as pd
-from scipy.signal import decimate, resample
+from scipy.signal import resample_poly
+from fractions import Fraction
 from obspy.core import Trace
 
 
@@ -12,41 +16,201 @@ import numpy as np
 import pandas as pd
 import logging
 
-def integrate_tf_representation(t, R: np.ndarray, i: int) -> tuple:
+def _reduce_blocks(R: np.ndarray, reducer: str) -> np.ndarray:
+    """Reduce the last axis of R (the spectra of each block), ignoring NaNs."""
+    if reducer == 'mean':
+        return np.nanmean(R, axis=-1)
+    # The nan-aware order statistics are much slower, only use them when needed
+    has_nan = np.isnan(R).any()
+    if reducer == 'median':
+        return np.nanmedian(R, axis=-1) if has_nan else np.median(R, axis=-1)
+    if reducer.startswith('p'):
+        percentile = float(reducer[1:])
+        reduced = np.nanpercentile(R, percentile, axis=-1) if has_nan else np.percentile(R, percentile, axis=-1)
+        return reduced.astype(R.dtype)
+    raise ValueError(f"Unknown reducer: {reducer}")
+
+
+def integrate_tf_representation(t, R: np.ndarray, i: int, reducer: str = 'mean') -> tuple:
     """
     Average every 'i' spectra along the time axis, ignoring NaNs in R,
     and include the last incomplete block.
+
+    The full blocks are reduced at once through a (rows x blocks x i) reshape, and the
+    last incomplete block separately. The time of each block is the mean of its times,
+    computed on int64 nanoseconds.
+
+    reducer is 'mean', 'median' or 'pNN' for the NN-th percentile (e.g. 'p5' or 'p95').
+    R may have leading axes (e.g. traces x frequency x time): the last axis is integrated.
     """
     logging.info("Call fucntion: integrate_tf_representation")
-    t = np.asarray(t)
+    t_ns = np.asarray(t).astype("datetime64[ns]").astype("int64")
 
-    n_rows, n_cols = R.shape
-    n_blocks = int(np.ceil(n_cols / i))  # on arrondit vers le haut
+    leading_shape, n_cols = R.shape[:-1], R.shape[-1]
+    n_full = n_cols // i
+    n_full_cols = n_full * i
 
     R_mean_list = []
     t_mean_list = []
+    if n_full > 0:
+        R_mean_list.append(_reduce_blocks(R[..., :n_full_cols].reshape(leading_shape + (n_full, i)), reducer))
+        t_mean_list.append(t_ns[:n_full_cols].reshape(n_full, i).mean(axis=1))
+    if n_full_cols < n_cols:
+        R_mean_list.append(_reduce_blocks(R[..., np.newaxis, n_full_cols:], reducer))
+        t_mean_list.append(t_ns[np.newaxis, n_full_cols:].mean(axis=1))
 
-    for b in range(n_blocks):
-        start = b * i
-        end = min((b + 1) * i, n_cols)
+    R_mean = np.concatenate(R_mean_list, axis=-1)  # (freq x temps)
+    t_mean = np.concatenate(t_mean_list).astype("datetime64[ns]")
 
-        R_block = R[:, start:end]
-        t_block = t[start:end]
+    return t_mean, R_mean
 
-        R_mean_list.append(np.nanmean(R_block, axis=1))
 
-        # moyenne temporelle
-        t_block_ns = t_block.astype("datetime64[ns]").astype("int64")
-        t_mean_ns = np.nanmean(t_block_ns, axis=0)
-        t_mean_list.append(t_mean_ns.astype("datetime64[ns]"))
+def get_stft_frame_count(n_samples: int, nperseg: int, noverlap: int) -> int:
+    """
+    Return the number of frames of scipy.signal.stft (boundary='zeros', padded=True).
+    """
+    step = nperseg - noverlap
+    n_extended = n_samples + 2 * (nperseg // 2)
+    n_extended += (-(n_extended - nperseg) % step) % nperseg
+    return (n_extended - noverlap) // step
 
-    R_mean = np.vstack(R_mean_list).T  # on remet dans la forme (freq x temps)
-    t_mean = np.array(t_mean_list)
 
-    return t_mean, R_mean
+def iter_stft_magnitude(samples: np.ndarray, nperseg: int, noverlap: int, chunk_size: int,
+                        first_sample: int = None, n_frames: int = None):
+    """
+    Compute |STFT| of the samples chunk by chunk, so that only chunk_size frames of the
+    complex spectrogram exist at a time.
+
+    The frames are computed as scipy.signal.stft does (periodic hann window, zero boundary
+    extension and padding, 'spectrum' scaling and the same dtypes), so that the concatenated
+    chunks are identical to np.abs(scipy.signal.stft(...)[2]). The FFTs use the number of
+    threads set with lib.fftBackend.set_workers.
+
+    first_sample and n_frames select other frames: n_frames frames starting at first_sample
+    (which may be negative), the samples outside of the signal being zeros.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        The time series, or a stack of time series of equal length (traces x samples).
+    nperseg : int
+        Length of each segment (FFT size).
+    noverlap : int
+        Number of overlapping samples between segments.
+    chunk_size : int
+        Number of frames per chunk.
+    first_sample : int, optional
+        Index of the first sample of the first frame (default: -(nperseg // 2)).
+    n_frames : int, optional
+        Number of frames (default: the number of frames of scipy.signal.stft).
+
+    Yields
+    ------
+    first_frame : int
+        The index of the first frame of the chunk.
+    magnitude : np.ndarray
+        |STFT| of the frames of the chunk (frequency x time, or traces x frequency x time).
+    """
+    step = nperseg - noverlap
+    n_samples = samples.shape[-1]
+    if n_frames is None:
+        n_frames = get_stft_frame_count(n_samples, nperseg, noverlap)
+    offset = nperseg // 2 if first_sample is None else -first_sample
+
+    window, scale, outdtype = get_stft_window(nperseg, np.asarray(samples).dtype)
+
+    for first_frame in range(0, n_frames, chunk_size):
+        last_frame = min(first_frame + chunk_size, n_frames)
+
+        # Samples of the frames, in the zero-extended signal
+        start = first_frame * step - offset
+        end = (last_frame - 1) * step + nperseg - offset
+        chunk = np.zeros(samples.shape[:-1] + (end - start,))
+        chunk[..., max(0, -start):min(end, n_samples) - start] = samples[..., max(0, start):min(end, n_samples)]
+
+        frames = np.lib.stride_tricks.sliding_window_view(chunk, nperseg, axis=-1)[..., ::step, :]
+        result = rfft(frames * window, n=nperseg)
+        result *= scale
+        yield first_frame, np.abs(result.astype(outdtype)).swapaxes(-1, -2)
 
 
-def get_spectrogram(tr: Trace, fftsize: int, noverlap: int, integration: int = None, demBounds: list = None) -> tuple:
+def get_frame_grid(starttime_ns: int, n_samples: int, sampling_rate: float, nperseg: int, noverlap: int,
+                   time_range: tuple, grid_origin=None) -> tuple:
+    """
+    Return the frames of a trace on a frame grid: frames every nperseg - noverlap samples,
+    the first one centred on the first sample at or after grid_origin, keeping the frames
+    centred on a sample of the trace within time_range.
+
+    The frames of adjacent time ranges (e.g. consecutive days) never overlap, so that each
+    frame is computed once and the times are strictly increasing from one range to the next.
+
+    Parameters
+    ----------
+    starttime_ns : int
+        The time of the first sample (ns since the epoch).
+    n_samples : int
+        The number of samples.
+    sampling_rate : float
+        The sampling rate (Hz).
+    nperseg, noverlap : int
+        The length and overlap of the frames.
+    time_range : tuple
+        [start, end) (anything accepted by pd.Timestamp, UTC).
+    grid_origin : optional
+        The origin of the grid (default: time_range[0]), e.g. the start of the day of a
+        sub-day time range, so that its frames are those of the whole day.
+
+    Returns
+    -------
+    first_sample : int
+        The index of the first sample of the first frame (may be negative).
+    n_frames : int
+        The number of frames.
+    centres : np.ndarray
+        The time of the centre of each frame (int64 ns).
+    first_index : int
+        The index of the first frame on the grid (0 for the frame centred at grid_origin).
+    """
+    step = nperseg - noverlap
+    start_ns, end_ns = (pd.Timestamp(value).value for value in time_range)
+    origin_ns = start_ns if grid_origin is None else pd.Timestamp(grid_origin).value
+    period_ns = 1e9 / sampling_rate
+
+    def first_sample_after(time_ns):
+        return int(np.ceil((time_ns - starttime_ns) / period_ns - 1e-6))
+
+    # Samples of the grid origin, of the first centre (in the range and in the trace) and of
+    # the last centre candidate (before end_ns)
+    origin_centre = first_sample_after(origin_ns)
+    lowest_centre = max(0, first_sample_after(start_ns))
+    last_centre = min(n_samples, first_sample_after(end_ns)) - 1
+
+    k_first = max(0, -((origin_centre - lowest_centre) // step))
+    k_last = (last_centre - origin_centre) // step if last_centre >= origin_centre else -1
+    n_frames = max(0, k_last - k_first + 1)
+
+    centre_samples = origin_centre + (k_first + np.arange(n_frames, dtype=np.int64)) * step
+    centres = starttime_ns + np.round(centre_samples * period_ns).astype(np.int64)
+    return origin_centre + k_first * step - nperseg // 2, n_frames, centres, k_first
+
+
+def get_spectrogram(tr: Trace, fftsize: int, noverlap: int, integration: int = None, demBounds: list = None,
+                    chunk_size: int = None, reducer: str = 'mean', time_range: tuple = None, grid_origin=None) -> tuple:
+    """
+    Compute the spectrogram of a trace, optionally demodulated to demBounds and averaged
+    over blocks of integration spectra.
+
+    With integration, chunk_size (in frames, rounded up to a multiple of integration) enables
+    the streaming mode: the STFT is computed and averaged chunk by chunk, so that the peak
+    memory depends on the chunk size instead of the trace length. The output is identical.
+    reducer is the block reduction of integrate_tf_representation.
+
+    With time_range ([start, end)), the frames are those of get_frame_grid: only the frames
+    centred in time_range are computed, from the samples of the trace around them (e.g. the
+    samples of the neighbouring days), and their times are the exact frame centres. The
+    spectrogram is then |STFT|. The integration blocks are aligned on grid_origin (see
+    get_frame_grid).
+    """
     
     logging.info("Call fucntion: get_spectrogram")
     samples = tr.data
@@ -58,9 +222,55 @@ def get_spectrogram(tr: Trace, fftsize: int, noverlap: int, integration: int = N
             samples, sampling_rate = get_demodulated_samples(samples, sampling_rate, demBounds)
             additional_freq = demBounds[0]
         except Exception as e:
-            print(f"Error in demodulation: {e}")
-
-    frequencies, times, spectrogram = sp.stft(samples, fs=sampling_rate, nperseg=int(fftsize), noverlap=noverlap)   
+            logging.error(f"Error in demodulation: {e}")
+
+    fftsize = int(fftsize)
+    if time_range is not None:
+        frequencies = scipy.fft.rfftfreq(fftsize, 1 / sampling_rate)
+        frequencies += additional_freq
+        first_sample, n_frames, centres, first_index = get_frame_grid(tr.stats.starttime.ns, len(samples), sampling_rate,
+                                                                      fftsize, noverlap, time_range, grid_origin)
+        times = centres.astype("datetime64[ns]")
+        if n_frames == 0:
+            return frequencies, times, np.empty((len(frequencies), 0))
+
+        step = fftsize - noverlap
+        chunk_size = int(np.ceil(chunk_size / integration)) * integration if integration and chunk_size else n_frames
+        # A first incomplete block when the first frame is not at the start of an integration block
+        head = min((-first_index) % integration, n_frames) if integration else 0
+        parts = [(0, head, head), (head, n_frames - head, chunk_size)] if head else [(0, n_frames, chunk_size)]
+
+        times_list, spectrogram_list = [], []
+        for part_start, part_frames, part_chunk_size in parts:
+            if part_frames == 0:
+                continue
+            for first_frame, magnitude in iter_stft_magnitude(samples, fftsize, noverlap, part_chunk_size,
+                                                              first_sample + part_start * step, part_frames):
+                t_chunk = times[part_start + first_frame:part_start + first_frame + magnitude.shape[1]]
+                if integration:
+                    t_chunk, magnitude = integrate_tf_representation(t_chunk, magnitude, integration, reducer)
+                times_list.append(t_chunk)
+                spectrogram_list.append(magnitude)
+        return frequencies, np.concatenate(times_list), np.concatenate(spectrogram_list, axis=1)
+
+    if integration and chunk_size and len(samples) >= fftsize:
+        frequencies = scipy.fft.rfftfreq(fftsize, 1 / sampling_rate)
+        frequencies += additional_freq
+        n_frames = get_stft_frame_count(len(samples), fftsize, noverlap)
+        times = pd.date_range(start=tr.stats.starttime.datetime,
+                              end=tr.stats.endtime.datetime,
+                              periods=n_frames)
+
+        # Chunks are aligned on the integration blocks
+        chunk_size = int(np.ceil(chunk_size / integration)) * integration
+        times_list, spectrogram_list = [], []
+        for first_frame, magnitude in iter_stft_magnitude(samples, fftsize, noverlap, chunk_size):
+            t_chunk, s_chunk = integrate_tf_representation(times[first_frame:first_frame + magnitude.shape[1]], magnitude, integration, reducer)
+            times_list.append(t_chunk)
+            spectrogram_list.append(s_chunk)
+        return frequencies, np.concatenate(times_list), np.concatenate(spectrogram_list, axis=1)
+
+    frequencies, times, spectrogram = sp.stft(samples, fs=sampling_rate, nperseg=fftsize, noverlap=noverlap)   
     frequencies += additional_freq
 
     times = pd.date_range(start=tr.stats.starttime.datetime,
@@ -68,11 +278,93 @@ def get_spectrogram(tr: Trace, fftsize: int, noverlap: int, integration: int = N
                           periods=times.shape[0])
 
     if integration:
-        times, spectrogram = integrate_tf_representation(times, np.abs(spectrogram), integration)
+        times, spectrogram = integrate_tf_representation(times, np.abs(spectrogram), integration, reducer)
 
     return frequencies, times, spectrogram
 
 
+def get_frame_time_offsets(n_samples: int, sampling_rate: float, n_frames: int) -> np.ndarray:
+    """
+    Return the time of the STFT frames relative to the start of the trace, in int64
+    nanoseconds: n_frames times evenly spaced from the first to the last sample, as the
+    pd.date_range of get_spectrogram, computed with integer arithmetic.
+    """
+    span = int(round((n_samples - 1) * 1e9 / sampling_rate))
+    if n_frames < 2:
+        return np.zeros(n_frames, dtype=np.int64)
+    # k * span // (n_frames - 1) without overflowing int64 for long traces
+    quotient, remainder = divmod(span, n_frames - 1)
+    k = np.arange(n_frames, dtype=np.int64)
+    return k * quotient + (k * remainder) // (n_frames - 1)
+
+
+def get_batched_spectrogram(traces: list, fftsize: int, noverlap: int, integration: int = None, demBounds: list = None,
+                            chunk_size: int = None, reducer: str = 'mean') -> tuple:
+    """
+    Compute the spectrograms of traces of equal length and sampling rate (e.g. the acquisition
+    cycles of a duty-cycle recording) as one stack: the demodulation, the STFT and the
+    integration run once over a (traces x samples) array instead of once per trace.
+
+    The spectra are the same as get_spectrogram's. The frame times are generated with
+    integer arithmetic (see get_frame_time_offsets), so they may differ from those of
+    get_spectrogram by the rounding of pd.date_range (a few hundred nanoseconds).
+
+    Parameters
+    ----------
+    traces : list of Trace
+        The traces, all with the same number of samples and sampling rate.
+    fftsize, noverlap, integration, demBounds, reducer
+        See get_spectrogram.
+    chunk_size : int, optional
+        Maximum number of frames computed at a time: the traces are processed in batches of
+        about chunk_size frames. All the traces are processed at once if None or 0.
+
+    Returns
+    -------
+    tuple or None
+        (frequencies, times, spectrogram): the frequencies, the time of the spectra of each
+        trace (traces x time, datetime64[ns]) and |STFT| of each trace (traces x frequency x
+        time). None if the (demodulated) traces are shorter than fftsize.
+    """
+    logging.info("Call fucntion: get_batched_spectrogram")
+    samples = np.stack([tr.data for tr in traces])
+    additional_freq = 0
+    sampling_rate = traces[0].stats.sampling_rate
+    n_input_samples = samples.shape[-1]
+
+    if demBounds:
+        try:
+            samples, sampling_rate = get_demodulated_samples(samples, sampling_rate, demBounds)
+            additional_freq = demBounds[0]
+        except Exception as e:
+            logging.error(f"Error in demodulation: {e}")
+
+    fftsize = int(fftsize)
+    frequencies = scipy.fft.rfftfreq(fftsize, 1 / sampling_rate)
+    frequencies += additional_freq
+
+    if samples.shape[-1] < fftsize:
+        # scipy.signal.stft shortens the segments of short signals: not supported here
+        return None
+
+    n_frames = get_stft_frame_count(samples.shape[-1], fftsize, noverlap)
+    frame_offsets = get_frame_time_offsets(n_input_samples, traces[0].stats.sampling_rate, n_frames)
+    offsets = frame_offsets
+
+    traces_per_batch = max(1, chunk_size // n_frames) if chunk_size else len(traces)
+    spectrogram_list = []
+    for first_trace in range(0, len(traces), traces_per_batch):
+        batch = samples[first_trace:first_trace + traces_per_batch]
+        _, magnitude = next(iter_stft_magnitude(batch, fftsize, noverlap, n_frames))
+        if integration:
+            offsets, magnitude = integrate_tf_representation(frame_offsets, magnitude, integration, reducer)
+        spectrogram_list.append(magnitude)
+
+    starts = np.array([tr.stats.starttime.ns for tr in traces], dtype=np.int64)
+    times = (starts[:, np.newaxis] + np.asarray(offsets).astype(np.int64)).astype("datetime64[ns]")
+    return frequencies, times, np.concatenate(spectrogram_list, axis=0)
+
+
 
 def get_demodulated_samples(samples: np.ndarray, fs: float, demodulation_boundaries: list) -> tuple:
     """
@@ -81,7 +373,8 @@ def get_demodulated_samples(samples: np.ndarray, fs: float, demodulation_boundar
     Parameters
     ----------
     samples : np.ndarray
-        The samples (time series) to filter and demodulate.
+        The samples (time series) to filter and demodulate. A stack of time series of
+        equal length (traces x samples) is demodulated along the last axis.
     fs : float
         The original sample rate.
     demodulation_boundaries : list of float
@@ -116,44 +409,65 @@ def get_demodulated_samples(samples: np.ndarray, fs: float, demodulation_boundar
     band_width = fmax - fmin
     new_fs = band_width * 2
 
+    # Intermediate rate: the same power of 4 as the former decimate(..., 4) loop, reached
+    # with a single polyphase FIR pass
+    n_samples = samples.shape[-1]
     current_fs = fs
-    filtered = np.copy(samples)
-
+    decimation = 1
     while (current_fs / 2) / fmax > 4:
-        filtered = decimate(filtered, 4)
+        decimation *= 4
+        n_samples = int(np.ceil(n_samples / 4))
         current_fs /= 4
+    n_output = int(n_samples / (current_fs / new_fs))
 
     if demodulation_boundaries[0] > 0:
+        filtered = samples
+        if decimation > 1:
+            filtered = resample_poly(filtered, 1, decimation, axis=-1)
+        # Filtered in place in float64 (on a copy when the samples are the trace data)
+        filtered = filtered.astype(np.result_type(filtered.dtype, np.float64), copy=filtered is samples)
+
         # Bandpass filtering
-        b, a = sp.butter(8, demodulation_boundaries, 'bandpass', fs=current_fs)
-        filtered = sp.filtfilt(b, a, filtered, padlen=150)
+        sos = get_butter_sos(8, demodulation_boundaries, 'bandpass', current_fs)
+        sosfiltfilt_inplace(sos, filtered, padlen=min(150, filtered.shape[-1] - 1))
 
         # Demodulation step
-        time_band = np.arange(len(filtered)) / current_fs
-        filtered = np.real(filtered) * np.cos(2 * np.pi * demodulation_boundaries[0] * time_band)
-
-        # Lowpass filter
-        b, a = sp.butter(8, band_width, 'lowpass', fs=current_fs)
-        filtered = sp.filtfilt(b, a, filtered)
+        time_band = np.arange(filtered.shape[-1]) / current_fs
+        filtered *= np.cos(2 * np.pi * demodulation_boundaries[0] * time_band)
     else:
-        # Lowpass filter
-        b, a = sp.butter(8, band_width, 'lowpass', fs=current_fs)
-        filtered = sp.filtfilt(b, a, filtered)
+        # The lowpass filter of resample_poly is enough: resample from the original rate
+        filtered = samples
+        current_fs = fs
 
-    # Resample
-    demodulated_samples = resample(filtered, int(len(filtered) / (current_fs / new_fs)))
-    # Lowpass filter
-    b, a = sp.butter(8, band_width, 'lowpass', fs=current_fs)
-    filtered = sp.filtfilt(b, a, filtered)
+    # Resample: the anti-aliasing FIR of resample_poly is the lowpass filter at band_width
+    ratio = Fraction(new_fs / current_fs).limit_denominator(10000)
+    demodulated_samples = resample_poly(filtered, ratio.numerator, ratio.denominator, axis=-1)[..., :n_output]
+    if demodulated_samples.shape[-1] < n_output:
+        pad_width = [(0, 0)] * (demodulated_samples.ndim - 1) + [(0, n_output - demodulated_samples.shape[-1])]
+        demodulated_samples = np.pad(demodulated_samples, pad_width, mode='edge')
 
     return demodulated_samples, new_fs
 
 
 
-def get_cepstro(t: np.ndarray, f: np.ndarray, s: np.ndarray) -> tuple:
+def get_quefrency_slice(q: np.ndarray, quefrency_range: list = None) -> slice:
+    """Return the slice of the (sorted) quefrencies q within quefrency_range ([qmin, qmax]), all of them if None."""
+    if quefrency_range is None:
+        return slice(0, len(q))
+    return slice(int(np.searchsorted(q, quefrency_range[0], side='left')),
+                 int(np.searchsorted(q, quefrency_range[1], side='right')))
+
+
+def get_cepstro(t: np.ndarray, f: np.ndarray, s: np.ndarray, quefrency_range: list = None, dtype=np.float32,
+                block_size: int = 4096) -> tuple:
     """
     Compute the cepstrum of the given spectrogram.
 
+    The log magnitude is taken in place, in dtype, on blocks of block_size columns, with a
+    floor at the smallest positive value of dtype (instead of -inf for null spectra), and
+    only the quefrency bins of quefrency_range are kept. The inverse FFTs use the number of
+    threads set with lib.fftBackend.set_workers.
+
     Parameters
     ----------
     t : np.ndarray
@@ -161,7 +475,13 @@ def get_cepstro(t: np.ndarray, f: np.ndarray, s: np.ndarray) -> tuple:
     f : np.ndarray
         Array of frequency values.
     s : np.ndarray
-        Spectrogram (complex values).
+        Spectrogram (complex or magnitude values).
+    quefrency_range : list of float, optional
+        [qmin, qmax], the range of quefrencies to keep. All the bins are kept if None.
+    dtype : np.dtype
+        The floating point type of the computation and of the output.
+    block_size : int
+        Number of spectra transformed at a time.
 
     Returns
     -------
@@ -174,12 +494,20 @@ def get_cepstro(t: np.ndarray, f: np.ndarray, s: np.ndarray) -> tuple:
     """
     logging.info("Call fucntion: get_cepstro")
 
-    c = np.zeros(np.shape(s))
     df = f[1] - f[0]
-    q = np.fft.rfftfreq(2*(len(f) - 1), df)
-    c = np.fft.irfft(np.log(np.abs(s)), axis=-2)
-    c = c[..., :len(q),:]
-    return t, q, c
+    n_fft = 2*(len(f) - 1)
+    q = np.fft.rfftfreq(n_fft, df)
+
+    kept = get_quefrency_slice(q, quefrency_range)
+
+    floor = np.finfo(dtype).tiny
+    c = np.empty((kept.stop - kept.start, s.shape[-1]), dtype=dtype)
+    for start in range(0, s.shape[-1], block_size):
+        block = np.abs(s[:, start:start + block_size]).astype(dtype, copy=False)
+        np.maximum(block, floor, out=block)
+        np.log(block, out=block)
+        c[:, start:start + block_size] = irfft(block, n=n_fft, axis=0)[kept]
+    return t, q[kept], c
 
 def find_knees(s):
     yn = s / np.max(s, axis=-1)[..., np.newaxis]
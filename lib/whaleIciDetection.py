@@ -4,7 +4,101 @@ from scipy import signal
 import logging
 
 
-def get_peak_to_valley_ratio(quefrency: np.ndarray, cepstrogram: np.ndarray, peak_values: list, valley_values: list, window_size: int) -> pd.Series:
+def get_quefrency_prefix_sums(cepstrogram: np.ndarray) -> tuple:
+    """
+    Compute the cumulative sums of |cepstrogram| along the quefrency axis, so that the mean
+    over any quefrency range is obtained with O(T) work (see get_quefrency_region_mean).
+
+    Parameters
+    ----------
+    cepstrogram : np.ndarray
+        Cepstrogram data (quefrency x time).
+
+    Returns
+    -------
+    sums : np.ndarray
+        The cumulative sums of the non-NaN values, with a leading row of zeros.
+    counts : np.ndarray or None
+        The cumulative count of the non-NaN values (same shape), or None if there is no NaN.
+    """
+    logging.info("Call function: get_quefrency_prefix_sums")
+    cepstrogram_abs = np.abs(cepstrogram)
+    finite = ~np.isnan(cepstrogram_abs)
+
+    sums = np.zeros((cepstrogram_abs.shape[0] + 1, cepstrogram_abs.shape[1]))
+    if finite.all():
+        np.cumsum(cepstrogram_abs, axis=0, out=sums[1:])
+        return sums, None
+
+    np.cumsum(np.where(finite, cepstrogram_abs, 0), axis=0, out=sums[1:])
+    counts = np.zeros(sums.shape, dtype=np.int32)
+    np.cumsum(finite, axis=0, out=counts[1:])
+    return sums, counts
+
+
+def get_quefrency_region_mean(quefrency: np.ndarray, prefix_sums: tuple, low, high) -> np.ndarray:
+    """
+    Compute the nan-mean of |cepstrogram| over the quefrencies low < q < high.
+
+    Parameters
+    ----------
+    quefrency : np.ndarray
+        Array of (increasing) quefrency values.
+    prefix_sums : tuple
+        The output of get_quefrency_prefix_sums.
+    low, high : float or np.ndarray
+        The boundaries of the region. With arrays of K boundaries, K regions are computed.
+
+    Returns
+    -------
+    np.ndarray
+        The mean over time (T,), or (K, T) for K regions. NaN where the region is empty.
+    """
+    sums, counts = prefix_sums
+    first = np.searchsorted(quefrency, low, side='right')
+    last = np.maximum(np.searchsorted(quefrency, high, side='left'), first)
+
+    if counts is None:
+        n = np.asarray(last - first)[..., np.newaxis]
+    else:
+        n = counts[last] - counts[first]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[last] - sums[first]) / n
+
+
+def get_time_prefix_sums(values: np.ndarray) -> tuple:
+    """
+    Compute the cumulative sums (and counts) of the non-NaN values along the last axis,
+    with a leading zero, for get_rolling_mean.
+    """
+    finite = ~np.isnan(values)
+    shape = values.shape[:-1] + (values.shape[-1] + 1,)
+    sums = np.zeros(shape)
+    counts = np.zeros(shape, dtype=np.int64)
+    np.cumsum(np.where(finite, values, 0), axis=-1, out=sums[..., 1:])
+    np.cumsum(finite, axis=-1, out=counts[..., 1:])
+    return sums, counts
+
+
+def get_rolling_mean(values: np.ndarray, window_size: int, prefix_sums: tuple = None) -> np.ndarray:
+    """
+    Trailing rolling nan-mean along the last axis with a cumulative-sum kernel
+    (same as pandas rolling(window_size, min_periods=1).mean()). prefix_sums is the optional
+    output of get_time_prefix_sums for values, to compute several windows from one pass.
+    """
+    sums, counts = get_time_prefix_sums(values) if prefix_sums is None else prefix_sums
+    n_values = sums.shape[-1] - 1
+    window_sums = sums[..., 1:].copy()
+    window_counts = counts[..., 1:].copy()
+    # The first window_size values average everything before them
+    window_sums[..., window_size:] -= sums[..., 1:n_values - window_size + 1]
+    window_counts[..., window_size:] -= counts[..., 1:n_values - window_size + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return window_sums / window_counts
+
+
+def get_peak_to_valley_ratio(quefrency: np.ndarray, cepstrogram: np.ndarray, peak_values: list, valley_values: list, window_size: int,
+                             prefix_sums: tuple = None) -> pd.Series:
     """
     Compute the peak to valley ratio in the long-term cepstrogram based on the given parameters.
 
@@ -20,6 +114,9 @@ def get_peak_to_valley_ratio(quefrency: np.ndarray, cepstrogram: np.ndarray, pea
         List containing the lower and upper boundaries of the valley regions.
     window_size : int
         Size of the rolling window on which the peak to valley ratio is computed.
+    prefix_sums : tuple, optional
+        The output of get_quefrency_prefix_sums for this cepstrogram. Passing it avoids
+        recomputing it when only the boundaries change.
 
     Returns
     -------
@@ -28,22 +125,18 @@ def get_peak_to_valley_ratio(quefrency: np.ndarray, cepstrogram: np.ndarray, pea
     """
     logging.info("Call function: get_peak_to_valley_ratio")
     try:
-        cepstrogram_df = pd.DataFrame(np.abs(cepstrogram))
-
-        # Define the regions for peak and valley
-        peak_region = np.logical_and(quefrency > peak_values[0], quefrency < peak_values[1])
-        valley_low_region = np.logical_and(quefrency > valley_values[0], quefrency < peak_values[0])
-        valley_high_region = np.logical_and(quefrency > peak_values[1], quefrency < valley_values[1])
+        if prefix_sums is None:
+            prefix_sums = get_quefrency_prefix_sums(cepstrogram)
 
         # Compute the mean values for peak and valley regions
-        valley_mean = 0.5 * cepstrogram_df.iloc[valley_low_region].mean(axis=0).rolling(window_size, min_periods=1).mean() + \
-                      0.5 * cepstrogram_df.iloc[valley_high_region].mean(axis=0).rolling(window_size, min_periods=1).mean()
-        peak_mean = cepstrogram_df.iloc[peak_region].mean(axis=0).rolling(window_size, min_periods=1).mean()
+        valley_mean = 0.5 * get_rolling_mean(get_quefrency_region_mean(quefrency, prefix_sums, valley_values[0], peak_values[0]), window_size) + \
+                      0.5 * get_rolling_mean(get_quefrency_region_mean(quefrency, prefix_sums, peak_values[1], valley_values[1]), window_size)
+        peak_mean = get_rolling_mean(get_quefrency_region_mean(quefrency, prefix_sums, peak_values[0], peak_values[1]), window_size)
 
         # Compute the peak to valley ratio
         peak_to_valley_ratio = (peak_mean ** 3 / valley_mean ** 3) - 1
 
-        return peak_to_valley_ratio
+        return pd.Series(peak_to_valley_ratio)
 
     except Exception as e:
         logging.error(f"Error computing peak to valley ratio: {e}")
@@ -85,6 +178,78 @@ def get_mean_cepstrum(cepstrum: np.ndarray, quefrency: np.ndarray = None) -> np.
     return mean_cepstrum - linear_trend
 
 
+def get_binned_mean_cepstra(time: np.ndarray, cepstrum: np.ndarray, quefrency: np.ndarray, bin_starts: np.ndarray, bin_width) -> tuple:
+    """
+    Compute the detrended mean cepstrum (see get_mean_cepstrum) of every time bin at once.
+
+    The frames are assigned to the bins [bin_start, bin_start + bin_width) with searchsorted,
+    the nan-mean of each bin is computed with one reduceat, and the median filter and the
+    linear fit are applied to all the bins as 2-D array operations.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        The time of the frames (datetime64).
+    cepstrum : np.ndarray
+        The cepstra (quefrency x time).
+    quefrency : np.ndarray
+        The quefrency values.
+    bin_starts : np.ndarray
+        The (sorted) start time of the bins (datetime64).
+    bin_width : timedelta
+        The width of the bins.
+
+    Returns
+    -------
+    bin_index : np.ndarray
+        The positions in bin_starts of the bins holding at least one frame.
+    mean_cepstra : np.ndarray
+        The detrended mean cepstra of these bins (quefrency x bins).
+    """
+    logging.info("Call Function: get_binned_mean_cepstra")
+    time = np.asarray(time).astype('datetime64[ns]')
+    bin_starts = np.asarray(bin_starts).astype('datetime64[ns]')
+    bin_width = pd.to_timedelta(bin_width).to_timedelta64()
+
+    cepstrum_abs = np.abs(cepstrum)
+    order = np.argsort(time, kind='stable')
+    if np.any(order != np.arange(len(order))):
+        time = time[order]
+        cepstrum_abs = cepstrum_abs[:, order]
+
+    starts = np.searchsorted(time, bin_starts, side='left')
+    ends = np.searchsorted(time, bin_starts + bin_width, side='left')
+    bin_index = np.flatnonzero(ends > starts)
+    if len(bin_index) == 0:
+        return bin_index, np.empty((len(quefrency), 0))
+    starts, ends = starts[bin_index], ends[bin_index]
+
+    # Sums over [start, end) of every bin: reduceat on interleaved boundaries, keeping every other
+    # value (a zero column is appended so that end may be the number of frames)
+    finite = ~np.isnan(cepstrum_abs)
+    values = np.concatenate([np.where(finite, cepstrum_abs, 0), np.zeros((cepstrum_abs.shape[0], 1))], axis=1)
+    counts = np.concatenate([finite, np.zeros((finite.shape[0], 1), dtype=bool)], axis=1).astype(np.int64)
+    boundaries = np.column_stack([starts, ends]).ravel()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_cepstra = np.add.reduceat(values, boundaries, axis=1)[:, ::2] / np.add.reduceat(counts, boundaries, axis=1)[:, ::2]
+
+    qmin = int(0.1 * len(quefrency))
+    qmax = int(0.9 * len(quefrency))
+    sub_quefrency = quefrency[qmin:qmax]
+    sub_mean_cepstra = signal.medfilt(mean_cepstra[qmin:qmax], [5, 1])
+
+    # Bins with NaNs are fitted one by one, as get_mean_cepstrum does
+    valid = np.isfinite(sub_mean_cepstra).all(axis=0)
+    poly_coefficients = np.empty((2, mean_cepstra.shape[1]))
+    if np.any(valid):
+        poly_coefficients[:, valid] = np.polyfit(sub_quefrency, sub_mean_cepstra[:, valid], deg=1)
+    for column in np.flatnonzero(~valid):
+        poly_coefficients[:, column] = np.polyfit(sub_quefrency, sub_mean_cepstra[:, column], deg=1)
+
+    linear_trend = poly_coefficients[0] * quefrency[:, np.newaxis] + poly_coefficients[1]
+    return bin_index, mean_cepstra - linear_trend
+
+
 def get_preset_parameters(species=None):    
     logging.info("Call Function: get_preset_parameters")
     params = [
@@ -2,11 +2,16 @@ from module.ici_detector.widget import ParametersWidgetDetector
 from module.ici_detector.worker import WorkerIciDetector
 from module.ici_detector.plot import PlottingIciDetectorHandler
 from module.ici_detector.display import DisplayIciDetector
+from lib.resultBuffer import CepstrogramBuffer
+from lib.whaleIciDetection import get_quefrency_prefix_sums
+from lib.batchProcessing import get_channel_id
+from lib.resultStore import STORE_FOLDER, save_cepstrogram
 
 from PySide6.QtCore import Signal, QObject
 import numpy as np
 import pandas as pd
-import pickle, json
+import json
+import os
 import logging
 
 class ModuleIciDetector(QObject):
@@ -21,6 +26,12 @@ class ModuleIciDetector(QObject):
         self.parameterWidget.cepstrogram_radio.clicked.connect(self.update_p2vr_result)
         self.parameterWidget.detection_results_radio.clicked.connect(self.update_p2vr_result)
         self.worker.sig_processed_detection.connect(self.get_detection_result)
+        self.worker.sig_processed_multi_detection.connect(self.get_multi_species_result)
+        self.worker.sig_partial_detection.connect(self.update_partial_result)
+        self.parameterWidget.species_combo.currentIndexChanged.connect(self.show_species_result)
+        self.parameterWidget.sig_cancelRequested.connect(self.worker.cancel)
+        self.parameterWidget.sig_pauseToggled.connect(self.set_worker_paused)
+        self.worker.finished.connect(self.parameterWidget.reset_run_controls)
 
     def __init__(self, config_path: str):
         self.config_path=config_path
@@ -31,9 +42,17 @@ class ModuleIciDetector(QObject):
         self.worker = WorkerIciDetector()
         self.parameterWidget = ParametersWidgetDetector()
         self.display.setObjectName("DisplayWidgetDetector")
+        self.p2vr_prefix_sums = None
+        self.species_results = {}
 
         self.set_connections()
 
+    def set_worker_paused(self, paused):
+        if paused:
+            self.worker.pause()
+        else:
+            self.worker.resume()
+
     def get_display_widget(self):
         """
         Returns the widget for displaying the spectrogram.
@@ -62,10 +81,26 @@ class ModuleIciDetector(QObject):
         self.dict_params['endtime'] = self.endtime
         self.dict_params.update(self.parameterWidget.get_all_parameters())
         self.worker.dict_params = self.dict_params
+        self.species_results = {}
+        self.partial_buffer = CepstrogramBuffer(self.dict_params["files_to_process_df"]['datetime'], self.worker.metric)
         self.worker.start()
 
+    def update_partial_result(self, partial_result):
+        """
+        Insert the cepstra of a finished day in the partial result and refresh the
+        cepstrogram (the plotter throttles the refresh rate).
+        """
+        first_partial = self.partial_buffer.is_empty()
+        self.partial_buffer.insert(partial_result['tscale'], partial_result['q'], partial_result['cepstro'])
+        if first_partial:
+            self.parameterWidget.set_qmin_qmax(0.0, np.max(partial_result['q']))
+
+        self.plotter.display_partial_cepstrogram(self.partial_buffer, self.starttime, self.endtime,
+                                                 self.parameterWidget.get_all_parameters)
+
 
     def get_detection_result(self, result):
+        self.plotter.stop_partial_refresh()
         self.cesptrogram_result = result
         self.parameterWidget.set_qmin_qmax(0.0, np.max(result['q']))
 
@@ -83,8 +118,30 @@ class ModuleIciDetector(QObject):
         result['tscale'] = result['tscale'][mask]
         result['cepstro'] = result['cepstro'][:, mask]
 
+        # Computed once per result, so that changing the p2vr boundaries only costs O(T)
+        self.p2vr_prefix_sums = get_quefrency_prefix_sums(result['cepstro'])
+
         self.update_p2vr_result()
 
+    def get_multi_species_result(self, species_results):
+        """
+        Keep the results of a multi-species detection and display the one of the selected
+        species (the other ones are displayed when their species is selected).
+        """
+        self.species_results = species_results
+        species = self.parameterWidget.get_selected_species()
+        if species not in species_results:
+            species = next(iter(species_results))
+            # Displays the result through show_species_result
+            self.parameterWidget.species_combo.setCurrentText(species)
+            return
+        self.get_detection_result(species_results[species])
+
+    def show_species_result(self):
+        species = self.parameterWidget.get_selected_species()
+        if species in self.species_results:
+            self.get_detection_result(self.species_results[species])
+
     def update_p2vr_result(self):
         new_params = self.parameterWidget.get_all_parameters()
         for key, value in new_params.items():
@@ -93,7 +150,8 @@ class ModuleIciDetector(QObject):
 
         self.cesptrogram_result["p2vr"],self.cesptrogram_result["positive"] = self.worker.run_p2vr_detection(self.cesptrogram_result['q'], 
                                             self.cesptrogram_result['cepstro'], 
-                                            self.cesptrogram_result)
+                                            self.cesptrogram_result,
+                                            self.p2vr_prefix_sums)
 
 
         if self.cesptrogram_result["display_mode"]=="cepstrogram":
@@ -117,24 +175,25 @@ class ModuleIciDetector(QObject):
                 self.cesptrogram_result["vmax"],
                 self.cesptrogram_result["metric"]
             )
-            import pickle
 
-    def save_results_to_pickle(self):
+    def save_results(self):
         """
-        Save the content of self.cesptrogram_result to a pickle file.
-
-        :param file_path: Path to the pickle file where the data will be saved.
+        Save the tscale, q, cepstro, p2vr and positive of self.cesptrogram_result to the
+        cepstrogram store of the channel, species and parameters (see
+        lib.resultStore.save_cepstrogram), in <EXPORT_folder>/cepstrograms, one file per month.
         """
 
         with open(self.config_path, 'r') as file:
             self.config = json.load(file) 
-        file_path = f'{self.config["EXPORT_folder"]}/test.pkl'
+        store_root = os.path.join(self.config["EXPORT_folder"], STORE_FOLDER)
         try:
-            with open(file_path, "wb") as pickle_file:
-                pickle.dump(self.cesptrogram_result, pickle_file)
-            logging.info(f"Results saved successfully to {file_path}")
+            files_df = self.cesptrogram_result["files_to_process_df"]
+            channel_id = get_channel_id(files_df)
+            species = self.cesptrogram_result.get("species") or "unknown"
+            save_cepstrogram(store_root, channel_id, species, self.cesptrogram_result)
+            logging.info(f"Results saved successfully to {store_root}")
         except Exception as e:
-            logging.error(f"Error saving results to pickle: {e}")
+            logging.error(f"Error saving results: {e}")
 
     
     def save_coordinates(self):
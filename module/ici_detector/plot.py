@@ -4,7 +4,7 @@ from matplotlib.widgets import RectangleSelector
 from matplotlib.dates import num2date
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import pandas as pd
-from PySide6.QtCore import Signal
+from PySide6.QtCore import Signal, QTimer
 from PySide6.QtWidgets import QVBoxLayout, QFrame, QScrollArea
 
 from matplotlib.colors import Normalize
@@ -68,6 +68,49 @@ class PlottingIciDetectorHandler(QFrame):
             layout = QVBoxLayout(self)
         layout.addWidget(self.scroll_area)
 
+        # Throttled refresh of the partial results of a running detection
+        self.partial_refresh_interval = 2000  # ms
+        self._pending_partial = None
+        self._partial_timer = QTimer(self)
+        self._partial_timer.setSingleShot(True)
+        self._partial_timer.timeout.connect(self._refresh_partial_cepstrogram)
+
+
+    def display_partial_cepstrogram(self, partial_buffer, starttime, endtime, get_parameters):
+        """
+        Plot the cepstrogram of a running detection. The first call is drawn immediately,
+        the following ones at most once every partial_refresh_interval ms: a call only marks
+        the partial result as changed, and the bins of the buffer are read when it is drawn.
+
+        Parameters
+        ----------
+        partial_buffer : CepstrogramBuffer
+            The buffer filled with the cepstra of the finished days.
+        starttime, endtime : datetime
+            The time range of the plot.
+        get_parameters : callable
+            Return the display parameters (qmin, qmax, vmin, vmax) when the plot is drawn.
+        """
+        self._pending_partial = (partial_buffer, starttime, endtime, get_parameters)
+        if not self._partial_timer.isActive():
+            self._refresh_partial_cepstrogram()
+
+    def _refresh_partial_cepstrogram(self):
+        if self._pending_partial is None:
+            return
+        (partial_buffer, starttime, endtime, get_parameters), self._pending_partial = self._pending_partial, None
+        tscale, q, cepstro = partial_buffer.get_result()
+        if len(tscale) > 1:
+            params = get_parameters()
+            self.display_cepstrogram({'tscale': tscale, 'q': q, 'cepstro': cepstro}, starttime, endtime,
+                                     params["qmin"], params["qmax"], params["vmin"], params["vmax"])
+        self._partial_timer.start(self.partial_refresh_interval)
+
+    def stop_partial_refresh(self):
+        """Drop the pending partial refresh (the final result is about to be displayed)."""
+        self._partial_timer.stop()
+        self._pending_partial = None
+
 
     def edges_from_centers(self, x):
         x = np.asarray(x, float)
@@ -209,7 +252,7 @@ class PlottingIciDetectorHandler(QFrame):
         self.ax1.set_ylim(qmin, qmax)
 
         # Format the x-axis based on the time range
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             self.ax1.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             self.ax1.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d'))
@@ -316,7 +359,7 @@ class PlottingIciDetectorHandler(QFrame):
         self.ax1.set_ylim(qmin, qmax)
 
         # Format the x-axis based on the time range
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             self.ax1.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             self.ax1.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d'))
@@ -334,7 +377,7 @@ class PlottingIciDetectorHandler(QFrame):
         divider2 = make_axes_locatable(self.ax2)
         cax2 = divider2.append_axes('right', size='2%', pad=0.01)
         cax2.set_visible(False)
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             self.ax2.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             self.ax2.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d'))
@@ -355,7 +398,7 @@ class PlottingIciDetectorHandler(QFrame):
         # self.ax3.set_xlabel('Date')
         self.ax3.set_ylabel('Positive Hours')
         self.ax3.legend()
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             self.ax3.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             self.ax3.xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%Y/%m/%d'))
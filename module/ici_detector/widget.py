@@ -1,5 +1,5 @@
 from PySide6.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QComboBox, QLineEdit, QPushButton, QRadioButton
+    QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QComboBox, QLineEdit, QPushButton, QRadioButton, QCheckBox
 )
 from PySide6.QtCore import Signal
 
@@ -12,6 +12,8 @@ class ParametersWidgetDetector(QWidget):
     runDetectionRequested = Signal()
     sig_refreshPlotRequested = Signal()
     sig_applyP2vrRequested = Signal()
+    sig_cancelRequested = Signal()
+    sig_pauseToggled = Signal(bool)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -37,6 +39,10 @@ class ParametersWidgetDetector(QWidget):
         self.species_combo.setMinimumContentsLength(10)  # Adjust the value as needed
         species_selection_layout.addLayout(species_hbox)
 
+        # Run every preset in one pass over the files (each day is decoded once)
+        self.all_species_checkbox = QCheckBox("All species")
+        species_selection_layout.addWidget(self.all_species_checkbox)
+
         metric_label = QLabel("Metric:")
         self.metric_combo = QComboBox()
         self.metric_combo.addItems(["5mn", "15mn", "1H"])
@@ -59,6 +65,16 @@ class ParametersWidgetDetector(QWidget):
         run_detection_button.clicked.connect(self.runDetectionRequested.emit)
         species_selection_layout.addWidget(run_detection_button)
 
+        run_control_hbox = QHBoxLayout()
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.setCheckable(True)
+        self.pause_button.toggled.connect(self._on_pause_toggled)
+        run_control_hbox.addWidget(self.pause_button)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.sig_cancelRequested.emit)
+        run_control_hbox.addWidget(cancel_button)
+        species_selection_layout.addLayout(run_control_hbox)
+
         species_selection_group.setLayout(species_selection_layout)
         main_layout.addWidget(species_selection_group)
 
@@ -150,6 +166,17 @@ class ParametersWidgetDetector(QWidget):
 
         self.setLayout(main_layout)
 
+    def _on_pause_toggled(self, paused):
+        self.pause_button.setText("Resume" if paused else "Pause")
+        self.sig_pauseToggled.emit(paused)
+
+    def reset_run_controls(self):
+        """Set the pause button back to its initial state (when a run ends)."""
+        self.pause_button.blockSignals(True)
+        self.pause_button.setChecked(False)
+        self.pause_button.setText("Pause")
+        self.pause_button.blockSignals(False)
+
     def _create_labeled_line_edit(self, label_text, layout, default_text=""):
         hbox = QHBoxLayout()
         hbox.addWidget(QLabel(label_text))
@@ -272,6 +299,7 @@ class ParametersWidgetDetector(QWidget):
         """Retrieve all parameters used in the detector as a dictionary."""
         return {
             'species': self.get_selected_species(),
+            'species_list': self.get_species_list(),
             'metric': self.get_detector_metric(),
             'fftsize': self.get_fft_size(),
             'overlap': self.get_overlap(),
@@ -291,6 +319,12 @@ class ParametersWidgetDetector(QWidget):
         """Retrieve the currently selected species from the species combo box."""
         return self.species_combo.currentText()
     
+    def get_species_list(self):
+        """Return all the preset species if 'All species' is checked, None otherwise."""
+        if self.all_species_checkbox.isChecked():
+            return self.species_df.index.tolist()
+        return None
+
     def get_detector_metric(self):
         """Retrieve the current detector metric."""
         return self.detector_metric
@@ -1,18 +1,13 @@
-
 from PySide6.QtCore import QThread, Signal
-import concurrent.futures
-import numpy as np
-import pandas as pd
-from datetime import timedelta
-from obspy import UTCDateTime
-from lib.signalProcessing import get_spectrogram, get_cepstro
-from lib.networkFuntions import get_stream_for_selected_file
-from lib.whaleIciDetection import get_mean_cepstrum, get_peak_to_valley_ratio
-import logging
+import threading
+from lib.dayProcessing import run_p2vr_detection
+from lib.batchProcessing import run_detection, run_multi_species_detection
 
 class WorkerIciDetector(QThread):
     progress = Signal(int)
     sig_processed_detection = Signal(dict)
+    sig_partial_detection = Signal(dict)
+    sig_processed_multi_detection = Signal(dict)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -24,117 +19,94 @@ class WorkerIciDetector(QThread):
         self.species_df = None
         self.currently_computing = False
         self.species_to_process = None
+        self.cancel_event = threading.Event()
+        self.resume_event = threading.Event()
+        self.resume_event.set()
 
     def run(self):
         if self.currently_computing:
             return
 
-        self.run_detection_process()
+        self.cancel_event.clear()
+        self.resume_event.set()
+        try:
+            if self.dict_params.get('species_list'):
+                self.run_multi_species_detection_process()
+            else:
+                self.run_detection_process()
+        finally:
+            self.quit()
+            self.currently_computing = False
+
+    def cancel(self):
+        """
+        Stop the detection: no new day is started, the pending days are dropped and the
+        result of the days already processed is emitted.
+        """
+        self.cancel_event.set()
+        self.resume_event.set()
+
+    def pause(self):
+        """Stop starting new days until resume is called (running days are completed)."""
+        self.resume_event.clear()
+
+    def resume(self):
+        self.resume_event.set()
+
+    def is_paused(self):
+        return not self.resume_event.is_set()
 
     def run_detection_process(self):
         self.currently_computing=True
 
-        # self.species_df = self.dict_params["species_df"]["species"]
         self.stations_df = self.dict_params["stations_df"]
         self.files_to_process_df = self.dict_params["files_to_process_df"]
 
-        # self.species_df = self.species_df.loc[self.dict_params["species"]]
-
         self.counter = 0
+        streaming = self.dict_params.get('streaming', True)
+
+        def on_day(tscale, q, cepstro):
+            self.counter += 1
+            self.progress.emit(self.counter)
+            if streaming:
+                self.sig_partial_detection.emit({'tscale': tscale, 'q': q, 'cepstro': cepstro})
+
+        result = run_detection(self.files_to_process_df, self.dict_params, self.metric,
+                               self.cancel_event, self.resume_event, on_day)
+        if result is not None:
+            self.sig_processed_detection.emit(result)
+
+    def run_multi_species_detection_process(self):
+        """
+        Run the detection of every species of dict_params['species_list'] in one pass over
+        the files (see lib.batchProcessing.run_multi_species_detection).
+
+        sig_processed_multi_detection is emitted with one result per species. The partial
+        results of dict_params['species'] (or of the first species) are streamed.
+        """
+        self.currently_computing=True
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(self.process_file, row) for _, row in self.files_to_process_df.iterrows()]
-
-        results = [f.result() for f in concurrent.futures.as_completed(futures) if f.result() is not None]
-        if not results:
-            return
-
-        results.sort(key=lambda x: x[0][0])
-        tscale, q, cepstro = zip(*results)
-        tscale = np.concatenate(tscale)
-        q = q[0]
-        cepstro = np.concatenate(cepstro, axis=1)
-
-        p2vr, positive_detection = self.run_p2vr_detection(q, cepstro, self.dict_params)  
-
-        result = {
-            'tscale': tscale,
-            'q': q,
-            'cepstro': cepstro,
-            'p2vr': p2vr,
-            'positive': positive_detection
-        }
-        result.update(self.dict_params)
-        self.sig_processed_detection.emit(result)
-
-        self.quit()
-        self.currently_computing = False
-
+        self.stations_df = self.dict_params["stations_df"]
+        self.files_to_process_df = self.dict_params["files_to_process_df"]
 
-    def process_file(self, row):
-        try:
-            st = get_stream_for_selected_file(row.filename)
-            st.trim(UTCDateTime(row.datetime), UTCDateTime(row.datetime + timedelta(hours=24)))
-            t, q, c = self.process_species(st, self.dict_params)
-
-            delta = timedelta(seconds=pd.to_timedelta(self.metric).total_seconds())
-            current_day = row.starttime.floor('D')
-
-            t_hourly, c_hourly = [], []
-            for hour in pd.date_range(start=current_day, periods=int((24*3600)/delta.total_seconds()), freq=self.metric):
-                mask = (t >= hour) & (t < hour + delta)
-                if np.any(mask):
-                    c_hour = get_mean_cepstrum(c[:, mask], q)
-                    t_hourly.append(hour)
-                    c_hourly.append(c_hour)
-
-            if len(t_hourly) > 0:
-                self.counter += 1
-                self.progress.emit(self.counter)
-                return np.array(t_hourly), q, np.transpose(c_hourly)
-            return None
-
-        except Exception as e:
-            # Log the error and return None
-            logging.error(f"ICI detection - Error processing file {row.filename}: {e}")
-            return None
-
-    def process_species(self, st, preset_parameters):
-        try:
-            # Initialize empty lists to store concatenated results
-            all_frequencies = []
-            all_times = []
-            all_spectrograms = []
-
-            for tr in st:
-                f, t, s = get_spectrogram(
-                    tr,
-                    preset_parameters['fftsize'],
-                    int(preset_parameters['fftsize'] * preset_parameters['overlap']),
-                    preset_parameters['integration'],
-                    [preset_parameters['filter_boundaries'][0], preset_parameters['filter_boundaries'][1]]
-                )
-
-                all_frequencies.append(f)
-                all_times.append(t)
-                all_spectrograms.append(s)
-
-            # Concatenate all results
-            f = all_frequencies[0]  # Frequencies are the same for all traces
-            t = np.concatenate(all_times)
-            s = np.concatenate(all_spectrograms, axis=1)
-
-            return get_cepstro(t, f, s)
-        except Exception as e:
-            print('Error processing species:', e)
-            return None, None, None
-
-    def run_p2vr_detection(self, q, c, params):
-
-        p2vr= get_peak_to_valley_ratio(q, c, params['peak_boundaries'], params['valley_boundaries'], 12)
-        threshold = params["p2vr_threshold"]
-        above_threshold_indices = np.where(p2vr > threshold)[0]
-        
-        positive_detection = np.zeros_like(p2vr, dtype=int)
-        positive_detection[above_threshold_indices] = 1 
-        return p2vr, positive_detection
\ No newline at end of file
+        self.counter = 0
+        streaming = self.dict_params.get('streaming', True)
+        streamed_species = self.dict_params.get('species')
+
+        def on_day(day_results):
+            nonlocal streamed_species
+            if streamed_species not in self.dict_params['species_list']:
+                streamed_species = next(iter(day_results))
+            if streaming and streamed_species in day_results:
+                tscale, q, cepstro = day_results[streamed_species]
+                self.sig_partial_detection.emit({'tscale': tscale, 'q': q, 'cepstro': cepstro})
+            self.counter += 1
+            self.progress.emit(self.counter)
+
+        species_results = run_multi_species_detection(self.files_to_process_df, self.dict_params, self.metric,
+                                                      self.cancel_event, self.resume_event, on_day)
+        if species_results:
+            self.sig_processed_multi_detection.emit(species_results)
+
+    def run_p2vr_detection(self, q, c, params, prefix_sums=None):
+        return run_p2vr_detection(q, c, params, prefix_sums)
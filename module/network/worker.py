@@ -1,8 +1,28 @@
 import pandas as pd
-from lib.networkFuntions import get_network_details, get_network_file_list
+from lib.networkFuntions import get_network_details, get_network_file_list, get_file_availability
+from lib.sdsCatalog import CATALOG_FILENAME
+from lib.batchProcessing import get_files_to_process
 import json, os, glob
+import logging
+from PySide6.QtCore import QThread, Signal
 from PySide6.QtWidgets import QFileDialog, QMessageBox
 
+
+class WorkerAvailability(QThread):
+    """Index the MiniSEED headers of the files not indexed yet, outside of the GUI thread."""
+    sig_availability_ready = Signal(object)
+
+    def __init__(self, files_df: pd.DataFrame, catalog_path: str, parent=None):
+        super().__init__(parent)
+        self.files_df = files_df
+        self.catalog_path = catalog_path
+
+    def run(self):
+        try:
+            self.sig_availability_ready.emit(get_file_availability(self.files_df, self.catalog_path))
+        except Exception as e:
+            logging.error(f"Error indexing data availability: {e}")
+
 class NetworkManager:
 
     def __init__(self, config_path: str):
@@ -21,6 +41,9 @@ class NetworkManager:
         self._check_folder_exists(self.data_path, "SDS folder")
         self._check_folder_exists(self.export_path, "EXPORT folder")
 
+        self.catalog_path = os.path.join(self.export_path, CATALOG_FILENAME)
+        self.availability_worker = None
+
 
     
     def load_metadata(self, network: str = '*', station: str = '*'):
@@ -40,12 +63,13 @@ class NetworkManager:
             A tuple containing two DataFrames: dfstations and dfmseeds.
         """
         # Load station metadata
-        self.dfstations = get_network_details(network, self.inventory_path)
+        self.dfstations = get_network_details(network, self.inventory_path, self.catalog_path)
         self.dfstations = self.dfstations[self.dfstations['ele'] < 0]  # Submarine stations only
 
         # Load file metadata
-        self.dfmseeds = get_network_file_list(network, station, self.data_path)
+        self.dfmseeds = get_network_file_list(network, station, self.data_path, self.catalog_path)
         self.dfmseeds['cha'] = self.dfmseeds['cha'].str.split('.').str[0]
+        self.load_availability()
 
         return self.dfstations, self.dfmseeds
 
@@ -54,14 +78,39 @@ class NetworkManager:
         """
         Charge les stations et fichiers disponibles pour un réseau donné.
         """
-        self.dfstations = get_network_details(network, self.inventory_path)
+        self.dfstations = get_network_details(network, self.inventory_path, self.catalog_path)
         self.dfstations = self.dfstations[self.dfstations['ele'] < 0]  # Sous-marins uniquement
 
-        self.dfmseeds = get_network_file_list(network, station, self.data_path)
+        self.dfmseeds = get_network_file_list(network, station, self.data_path, self.catalog_path)
         self.dfmseeds['cha'] = self.dfmseeds['cha'].str.split('.').str[0]
+        self.load_availability()
         
         return self.dfstations, self.dfmseeds
 
+    def load_availability(self):
+        """
+        Add the data availability (real start/end times, gaps, day coverage) already indexed
+        from the MiniSEED headers to the file list. The files not indexed yet are indexed by
+        start_availability_indexing, so that the startup does not wait for them.
+        """
+        try:
+            self.dfmseeds = get_file_availability(self.dfmseeds, self.catalog_path, index=False)
+        except Exception as e:
+            logging.error(f"Error loading data availability: {e}")
+
+    def start_availability_indexing(self):
+        """
+        Index the files not indexed yet in a WorkerAvailability thread; its
+        sig_availability_ready signal is emitted with the completed file list.
+        """
+        self.availability_worker = WorkerAvailability(self.dfmseeds.copy(), self.catalog_path)
+        self.availability_worker.sig_availability_ready.connect(self.set_availability)
+        self.availability_worker.start()
+        return self.availability_worker
+
+    def set_availability(self, dfmseeds: pd.DataFrame):
+        self.dfmseeds = dfmseeds
+        logging.info("Data availability indexed.")
 
     def get_channels_by_station(self, network: str, station: str):
         channels = self.dfmseeds[
@@ -70,27 +119,7 @@ class NetworkManager:
         return [c.split('.')[0] for c in channels]
 
     def get_files_to_process(self, network, station, channel, starttime, endtime):
-        df = self.dfmseeds
-        filtered_df = df[
-            (df['net'] == network) &
-            (df['sta'] == station) &
-            (df['cha'] == channel) &
-            (df['starttime'] < starttime)
-        ]
-
-        files_df = df[
-            (df['net'] == network) &
-            (df['sta'] == station) &
-            (df['cha'] == channel) &
-            (df['starttime'] >= starttime) &
-            (df['starttime'] < endtime)
-        ]
-
-        if not filtered_df.empty:
-            last_file = filtered_df.iloc[[-1]]
-            files_df = pd.concat([last_file, files_df])
-
-        return files_df.reset_index(drop=True)
+        return get_files_to_process(self.dfmseeds, network, station, channel, starttime, endtime)
 
     def get_station_coords(self, net_df):
         """
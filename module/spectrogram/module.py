@@ -11,6 +11,9 @@ class ModuleSpectrogram(QObject):
 
     def set_connections(self):
         self.plotter.cursorMoved.connect(self.display.update_cursor_info)
+        self.parameterWidget.sig_cancelRequested.connect(self.worker.cancel)
+        self.parameterWidget.sig_pauseToggled.connect(self.set_worker_paused)
+        self.worker.finished.connect(self.parameterWidget.reset_run_controls)
 
     def __init__(self):
         super().__init__()
@@ -21,6 +24,12 @@ class ModuleSpectrogram(QObject):
         self.display.setObjectName("DisplayWidgetSpectrogram")
         self.set_connections()
 
+    def set_worker_paused(self, paused):
+        if paused:
+            self.worker.pause()
+        else:
+            self.worker.resume()
+
     def get_display_widget(self):
         """
         Returns the widget for displaying the spectrogram.
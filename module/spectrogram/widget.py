@@ -12,6 +12,8 @@ class ParameterWidgetSpectrogram(QWidget):
     sig_computeSpectrogramRequested = Signal()
     # parametersModified = Signal()
     refreshPlotRequested = Signal()
+    sig_cancelRequested = Signal()
+    sig_pauseToggled = Signal(bool)
     sig_number_of_spectra = Signal(int)
     
     def __init__(self, parent=None):
@@ -51,6 +53,14 @@ class ParameterWidgetSpectrogram(QWidget):
         integration_layout.addWidget(self.integration_edit)
         fft_layout.addLayout(integration_layout)
 
+        reducer_layout = QHBoxLayout()
+        reducer_layout.addWidget(QLabel("Integration reducer:"))
+        self.reducer_combo = QComboBox()
+        self.reducer_combo.addItems(["mean", "median", "p5", "p25", "p75", "p95"])
+        self.reducer_combo.setCurrentText("mean")
+        reducer_layout.addWidget(self.reducer_combo)
+        fft_layout.addLayout(reducer_layout)
+
         freq_shift_fmin_layout = QHBoxLayout()
         freq_shift_fmin_layout.addWidget(QLabel("Freq Shift fmin:"))
         self.freq_shift_fmin_edit = QLineEdit("0")
@@ -69,6 +79,16 @@ class ParameterWidgetSpectrogram(QWidget):
         self.compute_button.clicked.connect(self.sig_computeSpectrogramRequested.emit)
         fft_layout.addWidget(self.compute_button)
 
+        run_control_layout = QHBoxLayout()
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.setCheckable(True)
+        self.pause_button.toggled.connect(self._on_pause_toggled)
+        run_control_layout.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.sig_cancelRequested.emit)
+        run_control_layout.addWidget(self.cancel_button)
+        fft_layout.addLayout(run_control_layout)
+
         self.fft_parameters_group.setLayout(fft_layout)
 
         # --- Plotting Dynamics Group ---
@@ -117,6 +137,17 @@ class ParameterWidgetSpectrogram(QWidget):
         self.freq_shift_fmin_edit.textChanged.connect(self.update_parameters)
 
         # self.setStyleSheet("background-color: red; margin: 0px; padding: 0px;")
+    def _on_pause_toggled(self, paused):
+        self.pause_button.setText("Resume" if paused else "Pause")
+        self.sig_pauseToggled.emit(paused)
+
+    def reset_run_controls(self):
+        """Set the pause button back to its initial state (when a run ends)."""
+        self.pause_button.blockSignals(True)
+        self.pause_button.setChecked(False)
+        self.pause_button.setText("Pause")
+        self.pause_button.blockSignals(False)
+
     def update_parameters(self):
         self.get_number_of_spectra(self.starttime, self.endtime)
         
@@ -180,6 +211,8 @@ class ParameterWidgetSpectrogram(QWidget):
         all_params.update(params)
         all_params['noverlap']= int(all_params['fftsize'] * all_params['overlap'])
         all_params['dem_boundaries'] = [all_params['freq_shift_fmin'],all_params['freq_shift_fmax']]
+        # Not in get_fft_params, whose values are unpacked by get_number_of_spectra
+        all_params['reducer'] = self.reducer_combo.currentText()
         return all_params
 
     def get_number_of_spectra(self, starttime=None, endtime=None):
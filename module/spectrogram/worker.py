@@ -1,13 +1,15 @@
 # model/workers.py — version complète corrigée
 
 from PySide6.QtCore import QThread, Signal
-import concurrent.futures
+import shutil
+import tempfile
+import threading
 import numpy as np
 import pandas as pd
-from datetime import timedelta
-from obspy import UTCDateTime
-from lib.signalProcessing import get_spectrogram
-from lib.networkFuntions import get_stream_for_selected_file, get_calibrated_stream
+from lib.dayProcessing import process_spectrogram_day, get_day_neighbors
+from lib.parallel import create_executor, get_worker_count, iter_results, load_array
+from lib.fftBackend import get_fft_worker_count
+from lib.batchProcessing import get_job_parameters
 import logging
 
 class WorkerSpectrogram(QThread):
@@ -21,12 +23,38 @@ class WorkerSpectrogram(QThread):
         self.stations_df = None
         self.dict_params = None
         self.currently_computing = False
-        
+        self.cancel_event = threading.Event()
+        self.resume_event = threading.Event()
+        self.resume_event.set()
 
     def run(self):
         if self.currently_computing:
             return
-        self.run_longterm_spectrogram()
+        self.cancel_event.clear()
+        self.resume_event.set()
+        try:
+            self.run_longterm_spectrogram()
+        finally:
+            self.quit()
+            self.currently_computing = False
+
+    def cancel(self):
+        """
+        Stop the computation: no new day is started, the pending days are dropped and the
+        spectrogram of the days already processed is emitted.
+        """
+        self.cancel_event.set()
+        self.resume_event.set()
+
+    def pause(self):
+        """Stop starting new days until resume is called (running days are completed)."""
+        self.resume_event.clear()
+
+    def resume(self):
+        self.resume_event.set()
+
+    def is_paused(self):
+        return not self.resume_event.is_set()
 
     def run_longterm_spectrogram(self):
         self.currently_computing=True
@@ -34,51 +62,64 @@ class WorkerSpectrogram(QThread):
         self.stations_df = self.dict_params["stations_df"]
         self.files_to_process_df = self.dict_params["files_to_process_df"]
         self.counter = 0
+        backend = self.dict_params.get('backend', 'thread')
+        n_workers = get_worker_count(self.dict_params.get('max_workers'))
+        job_params = get_job_parameters(self.dict_params)
+        # The FFT threads share the CPUs with the days processed at the same time
+        job_params['fft_workers'] = get_fft_worker_count(min(n_workers, max(1, len(self.files_to_process_df))),
+                                                         self.dict_params.get('fft_workers'))
+        # The process backend hands the spectrograms back through memory-mapped .npy files
+        output_dir = tempfile.mkdtemp(prefix='spectrogram_') if backend == 'process' else None
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(self.process_file, row, self.dict_params) for _, row in self.files_to_process_df.iterrows()]
-
-        results = [f.result() for f in concurrent.futures.as_completed(futures) if f.result() is not None]
-        if not results:
-            return
-        # Calculate the expected number of frequency bins
-        expected_shape = self.dict_params['fftsize'] // 2 + 1
-
-        # Filter results based on the expected shape
-        results = [r for r in results if r is not None and len(r) > 2 and r[2].shape[0] == expected_shape]
-
-        results.sort(key=lambda x: x[0][0])
-        tscale, f, slog = zip(*results)
-        result = {
-            'tscale': pd.to_datetime(np.concatenate(tscale)),
-            'f': f[0],
-            'slog': np.concatenate(slog, axis=1)
-        }
-        self.processed_longterm_spectrogram_ready.emit(result)
-        self.quit()
-        self.currently_computing = False
+        # The samples around midnight are read from the neighbouring days
+        neighbors = get_day_neighbors(self.files_to_process_df)
+        jobs = ((row.filename, row.datetime, self.stations_df[self.stations_df['net'] == row.net], job_params, output_dir,
+                 row_neighbors)
+                for row, row_neighbors in zip(self.files_to_process_df.itertuples(), neighbors))
 
-    def process_file(self, row, dict_params):
         try:
-            filtered_stations_df = self.stations_df[self.stations_df['net'] == row.net]
-            st = get_stream_for_selected_file(row.filename)
-            st.trim(UTCDateTime(row.datetime), UTCDateTime(row.datetime + timedelta(hours=24)))
-            st = get_calibrated_stream(st, filtered_stations_df)
-            fs = st[0].stats.sampling_rate
-            if not dict_params['dem_boundaries']==None:
-                if dict_params['dem_boundaries'][0]==0 and 2*dict_params['dem_boundaries'][1]==fs:
-                    dict_params['dem_boundaries']=None
-            f, t, s = get_spectrogram(
-                st[0],
-                dict_params['fftsize'],
-                dict_params['noverlap'],
-                dict_params['integration'],
-                dict_params['dem_boundaries']
-            )
-            self.counter += 1
-            self.progress.emit(self.counter)
-            return t, f, 120 + 10 * np.log10(np.abs(s))
-        except Exception as e:
-
-            logging.error(f"Spectro - Error processing file {row.filename}: {e}")
-            return None
\ No newline at end of file
+            results = []
+            with create_executor(backend, n_workers) as executor:
+                # Days are submitted a few at a time so that pause and cancel take effect quickly
+                for result in iter_results(executor, process_spectrogram_day, jobs, 2 * n_workers,
+                                           self.cancel_event, self.resume_event):
+                    if result is not None:
+                        results.append(result)
+                        self.counter += 1
+                        self.progress.emit(self.counter)
+
+            if self.cancel_event.is_set():
+                logging.info(f'Spectrogram cancelled after {self.counter} days')
+
+            # Calculate the expected number of frequency bins
+            expected_shape = self.dict_params['fftsize'] // 2 + 1
+
+            # Filter results based on the expected shape
+            results = [(t, f, load_array(slog)) for t, f, slog in results]
+            results = [r for r in results if r is not None and len(r) > 2 and r[2].shape[0] == expected_shape]
+            if not results:
+                return
+
+            results = [r for r in results if len(r[0]) > 0]
+            if not results:
+                return
+            results.sort(key=lambda x: x[0][0])
+            tscale, f, slog = zip(*results)
+            tscale = pd.to_datetime(np.concatenate(tscale)).to_numpy(dtype='datetime64[ns]')
+            slog = np.concatenate(slog, axis=1)
+
+            # Strictly increasing time axis: the frames of consecutive days do not overlap, this
+            # only drops the frames of overlapping traces
+            order = np.argsort(tscale, kind='stable')
+            tscale = tscale[order]
+            keep = np.r_[True, np.diff(tscale) > np.timedelta64(0, 'ns')]
+            result = {
+                'tscale': pd.to_datetime(tscale[keep]),
+                'f': f[0],
+                'slog': slog[:, order[keep]]
+            }
+        finally:
+            if output_dir is not None:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+        self.processed_longterm_spectrogram_ready.emit(result)
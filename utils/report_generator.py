@@ -297,25 +297,25 @@ class ReportGenerator:
 
         tscale = self.spectrogram_result['tscale']
         # Format the x-axis for spectrogram
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             ax2.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             ax2.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d'))
 
         # Format the x-axis for cepstrogram
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             ax3.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             ax3.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d'))
 
         # Format the x-axis for p2vr curve
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             ax4.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             ax4.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d'))
 
         # Format the x-axis for daily positive hours
-        if (tscale[-1] - tscale[0]).total_seconds() < 48 * 3600:
+        if (pd.Timestamp(tscale[-1]) - pd.Timestamp(tscale[0])).total_seconds() < 48 * 3600:
             ax5.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d \n %H:%M'))
         else:
             ax5.xaxis.set_major_formatter(DateFormatter('%Y/%m/%d'))